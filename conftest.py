@@ -0,0 +1,18 @@
+import pytest
+
+
+@pytest.fixture(scope='session', autouse=True)
+def isolated_runtime():
+    """Кэш и метрики тестов во временном каталоге, как в core.test_runner."""
+    from core.test_runner import isolated_runtime
+
+    with isolated_runtime():
+        yield
+
+
+@pytest.fixture(autouse=True)
+def clear_cache():
+    """Страницы и фрагменты из кэша не переходят между тестами."""
+    from django.core.cache import cache
+
+    cache.clear()
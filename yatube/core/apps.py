@@ -1,5 +1,12 @@
 from django.apps import AppConfig
+from django.db.backends.signals import connection_created
 
 
 class CoreConfig(AppConfig):
     name = 'core'
+
+    def ready(self):
+        from .sqlite import apply_profile
+        connection_created.connect(
+            apply_profile, dispatch_uid='core.sqlite.apply_profile'
+        )
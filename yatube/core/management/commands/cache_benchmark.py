@@ -0,0 +1,92 @@
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand
+
+from core.cache import SQLiteCache
+
+BACKENDS = {
+    'locmem': lambda directory: LocMemCache('benchmark', {
+        'OPTIONS': {'MAX_ENTRIES': 1_000_000},
+    }),
+    'filebased': lambda directory: FileBasedCache(
+        os.path.join(directory, 'files'),
+        {'OPTIONS': {'MAX_ENTRIES': 1_000_000}}
+    ),
+    'sqlite': lambda directory: SQLiteCache(
+        os.path.join(directory, 'cache.sqlite3'),
+        {'OPTIONS': {'MAX_ENTRIES': 1_000_000}}
+    ),
+}
+
+VALUE = 'x' * 2048
+
+
+def worker(barrier, backend, directory, worker_id, workers, keys, results):
+    """Пишет свою долю ключей и читает ключи всех процессов."""
+    cache = BACKENDS[backend](directory)
+    started = time.perf_counter()
+    for number in range(keys):
+        cache.set(f'{worker_id}:{number}', VALUE)
+    barrier.wait()
+    hits = 0
+    for number in range(keys):
+        for other in range(workers):
+            hits += cache.get(f'{other}:{number}') is not None
+    results.put((hits, keys * (workers + 1), time.perf_counter() - started))
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает бэкенды кэша: LocMem, файловый и SQLite. '
+        'Несколько процессов пишут свои ключи и читают чужие, '
+        'поэтому видна и скорость, и доля попаданий между процессами.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument('--keys', type=int, default=1000)
+        parser.add_argument(
+            '--backend', action='append', choices=list(BACKENDS),
+            help='Какие бэкенды сравнивать (по умолчанию все).'
+        )
+
+    def handle(self, *args, **options):
+        workers = options['workers']
+        keys = options['keys']
+        context = multiprocessing.get_context('fork')
+        self.stdout.write(
+            f'{"бэкенд":<10} {"операций/с":>12} {"попадания":>10}'
+        )
+        for backend in options['backend'] or list(BACKENDS):
+            directory = tempfile.mkdtemp()
+            try:
+                barrier = context.Barrier(workers)
+                results = context.Queue()
+                processes = [
+                    context.Process(
+                        target=worker,
+                        args=(barrier, backend, directory, worker_id,
+                              workers, keys, results)
+                    )
+                    for worker_id in range(workers)
+                ]
+                for process in processes:
+                    process.start()
+                stats = [results.get() for _ in processes]
+                for process in processes:
+                    process.join()
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            hits = sum(hit for hit, _, _ in stats)
+            operations = sum(count for _, count, _ in stats)
+            elapsed = max(seconds for _, _, seconds in stats)
+            self.stdout.write(
+                f'{backend:<10} {operations / elapsed:>12.0f} '
+                f'{hits / (keys * workers * workers):>10.0%}'
+            )
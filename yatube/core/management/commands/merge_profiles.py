@@ -0,0 +1,94 @@
+import os
+from collections import Counter, defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.profiling import load_profiles
+
+# Кадры, по которым считается доля рендера шаблонов и SQL в профиле.
+SECTIONS = {
+    'шаблоны': 'django/template/',
+    'SQL': 'django/db/backends/',
+}
+
+
+class Command(BaseCommand):
+    help = (
+        'Сводит профили запросов из PROFILE_SPOOL_DIR по view в файлы '
+        'collapsed stacks для flamegraph.pl или speedscope.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--spool', default=settings.PROFILE_SPOOL_DIR,
+            help='Каталог с профилями запросов.'
+        )
+        parser.add_argument(
+            '--output', help='Куда писать <view>.collapsed '
+            '(по умолчанию <spool>/merged).'
+        )
+        parser.add_argument(
+            '--view', action='append', dest='views',
+            help='Только этот view, например posts:index. Можно повторять.'
+        )
+        parser.add_argument(
+            '--top', type=int, default=10,
+            help='Сколько самых горячих функций показать для view.'
+        )
+        parser.add_argument(
+            '--delete', action='store_true',
+            help='Удалить сведённые профили из каталога.'
+        )
+
+    def handle(self, *args, **options):
+        spool = options['spool']
+        output = options['output'] or os.path.join(spool, 'merged')
+        views = defaultdict(lambda: {
+            'profiles': 0, 'duration': 0.0, 'stacks': Counter()
+        })
+        merged = []
+        for path, profile in load_profiles(spool):
+            if options['views'] and profile['view'] not in options['views']:
+                continue
+            view = views[profile['view']]
+            view['profiles'] += 1
+            view['duration'] += profile['duration']
+            view['stacks'].update(profile['stacks'])
+            merged.append(path)
+        if not views:
+            self.stdout.write('Профилей нет.')
+            return
+        os.makedirs(output, exist_ok=True)
+        for name, view in sorted(views.items()):
+            path = os.path.join(output, name.replace(':', '-') + '.collapsed')
+            with open(path, 'w') as file:
+                for stack, count in sorted(view['stacks'].items()):
+                    file.write(f'{stack} {count}\n')
+            self.report(name, view, path, options['top'])
+        if options['delete']:
+            for path in merged:
+                os.remove(path)
+
+    def report(self, name, view, path, top):
+        stacks = view['stacks']
+        samples = sum(stacks.values())
+        self.stdout.write(
+            f'{name}: профилей {view["profiles"]}, '
+            f'в среднем {view["duration"] / view["profiles"] * 1000:.1f} мс, '
+            f'снимков стека {samples} -> {path}'
+        )
+        if not samples:
+            return
+        for section, prefix in SECTIONS.items():
+            inside = sum(
+                count for stack, count in stacks.items()
+                if prefix in stack
+            )
+            self.stdout.write(f'  {section}: {inside / samples:.1%}')
+        # Собственное время функции — снимки, где она на вершине стека.
+        own = Counter()
+        for stack, count in stacks.items():
+            own[stack.rsplit(';', 1)[-1]] += count
+        for function, count in own.most_common(top):
+            self.stdout.write(f'  {count / samples:6.1%}  {function}')
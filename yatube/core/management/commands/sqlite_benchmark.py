@@ -0,0 +1,126 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from core.sqlite import DEFAULT_PRAGMAS, apply_pragmas
+
+SCHEMA = '''
+CREATE TABLE comment (
+    id INTEGER PRIMARY KEY,
+    post_id INTEGER NOT NULL,
+    text TEXT NOT NULL,
+    created REAL NOT NULL
+);
+CREATE INDEX comment_post_created_idx ON comment (post_id, created, id);
+'''
+
+POSTS = 100
+
+
+def worker(path, pragmas, role, seconds):
+    """Пишет комментарии или читает их до истечения времени.
+
+    Возвращает (операций, ошибок «database is locked»).
+    """
+    connection = sqlite3.connect(path, isolation_level=None)
+    apply_pragmas(connection, pragmas)
+    deadline = time.perf_counter() + seconds
+    done = errors = 0
+    while time.perf_counter() < deadline:
+        post_id = random.randrange(POSTS)
+        try:
+            if role == 'writer':
+                connection.execute('BEGIN')
+                connection.execute(
+                    'INSERT INTO comment (post_id, text, created) '
+                    'VALUES (?, ?, ?)', (post_id, 'комментарий', time.time())
+                )
+                connection.execute('COMMIT')
+            else:
+                connection.execute(
+                    'SELECT id, text FROM comment WHERE post_id = ? '
+                    'ORDER BY created DESC, id DESC LIMIT 20', (post_id,)
+                ).fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            if connection.in_transaction:
+                connection.execute('ROLLBACK')
+            errors += 1
+    connection.close()
+    return done, errors
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает пропускную способность SQLite с настройками '
+        'по умолчанию и с профилем SQLITE_PRAGMAS при одновременных '
+        'записях и чтениях комментариев из нескольких процессов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--readers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=3)
+        parser.add_argument(
+            '--rows', type=int, default=10_000,
+            help='Сколько комментариев заранее положить в базу.'
+        )
+
+    def handle(self, *args, **options):
+        profiles = {
+            'по умолчанию': DEFAULT_PRAGMAS,
+            'SQLITE_PRAGMAS': settings.SQLITE_PRAGMAS,
+        }
+        self.stdout.write(
+            f'писателей: {options["writers"]}, '
+            f'читателей: {options["readers"]}, '
+            f'секунд: {options["seconds"]:g}'
+        )
+        self.stdout.write(
+            f'{"профиль":<16} {"записей/с":>10} {"чтений/с":>10} '
+            f'{"блокировок":>11}'
+        )
+        for label, pragmas in profiles.items():
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, 'benchmark.sqlite3')
+                self.prepare(path, pragmas, options['rows'])
+                writes, reads, errors = self.run(path, pragmas, options)
+            seconds = options['seconds']
+            self.stdout.write(
+                f'{label:<16} {writes / seconds:>10.0f} '
+                f'{reads / seconds:>10.0f} {errors:>11}'
+            )
+
+    @staticmethod
+    def prepare(path, pragmas, rows):
+        connection = sqlite3.connect(path, isolation_level=None)
+        apply_pragmas(connection, pragmas)
+        connection.executescript(SCHEMA)
+        connection.execute('BEGIN')
+        connection.executemany(
+            'INSERT INTO comment (post_id, text, created) VALUES (?, ?, ?)',
+            ((number % POSTS, 'комментарий', number) for number in range(rows))
+        )
+        connection.execute('COMMIT')
+        connection.close()
+
+    @staticmethod
+    def run(path, pragmas, options):
+        roles = (['writer'] * options['writers']
+                 + ['reader'] * options['readers'])
+        with multiprocessing.Pool(len(roles)) as pool:
+            results = pool.starmap(worker, [
+                (path, pragmas, role, options['seconds']) for role in roles
+            ])
+        writes = sum(done for (done, _), role in zip(results, roles)
+                     if role == 'writer')
+        reads = sum(done for (done, _), role in zip(results, roles)
+                    if role == 'reader')
+        errors = sum(error for _, error in results)
+        return writes, reads, errors
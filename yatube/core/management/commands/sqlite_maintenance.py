@@ -0,0 +1,74 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+# Значения PRAGMA auto_vacuum.
+AUTO_VACUUM_INCREMENTAL = 2
+
+
+class Command(BaseCommand):
+    help = (
+        'Обслуживание базы SQLite: статистика планировщика '
+        '(PRAGMA optimize или ANALYZE), возврат свободных страниц '
+        '(incremental_vacuum) и усечение журнала WAL.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--analyze', action='store_true',
+            help='Полный ANALYZE вместо PRAGMA optimize.'
+        )
+        parser.add_argument(
+            '--vacuum-pages', type=int, default=0,
+            help='Сколько свободных страниц вернуть (0 — все).'
+        )
+        parser.add_argument(
+            '--enable-incremental-vacuum', action='store_true',
+            help='Один раз перевести базу на auto_vacuum=INCREMENTAL. '
+                 'Выполняет VACUUM, который переписывает весь файл.'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда обслуживает только SQLite.')
+        with connection.cursor() as cursor:
+            before = self.stats(cursor)
+            if options['enable_incremental_vacuum']:
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute('VACUUM')
+            if options['analyze']:
+                cursor.execute('ANALYZE')
+            else:
+                cursor.execute('PRAGMA optimize')
+            if self.pragma(cursor, 'auto_vacuum') == AUTO_VACUUM_INCREMENTAL:
+                pages = options['vacuum_pages']
+                cursor.execute(
+                    f'PRAGMA incremental_vacuum({pages})' if pages
+                    else 'PRAGMA incremental_vacuum'
+                )
+                cursor.fetchall()
+            elif before['freelist_count']:
+                self.stdout.write(
+                    'auto_vacuum выключен: свободные страницы вернёт '
+                    'только --enable-incremental-vacuum.'
+                )
+            if self.pragma(cursor, 'journal_mode') == 'wal':
+                cursor.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+            after = self.stats(cursor)
+        for name in before:
+            self.stdout.write(f'{name}: {before[name]} -> {after[name]}')
+
+    @staticmethod
+    def pragma(cursor, name):
+        cursor.execute(f'PRAGMA {name}')
+        return cursor.fetchone()[0]
+
+    def stats(self, cursor):
+        name = connection.settings_dict['NAME']
+        return {
+            'page_count': self.pragma(cursor, 'page_count'),
+            'freelist_count': self.pragma(cursor, 'freelist_count'),
+            'file_size': os.path.getsize(name) if os.path.exists(name)
+            else 0,
+        }
@@ -0,0 +1,53 @@
+import sqlite3
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+
+class Command(BaseCommand):
+    help = (
+        'Копирует основную базу SQLite в реплику раз в --lag секунд: '
+        'локальная реплика с отставанием для проверки маршрутизации.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--replica', default='replica', help='Алиас реплики.'
+        )
+        parser.add_argument(
+            '--lag', type=float, default=2,
+            help='Интервал копирования, то есть наибольшее отставание.'
+        )
+        parser.add_argument(
+            '--once', action='store_true', help='Скопировать один раз.'
+        )
+
+    def handle(self, *args, **options):
+        primary = connections['default'].settings_dict
+        replica = connections[options['replica']].settings_dict
+        if {primary['ENGINE'], replica['ENGINE']} != {
+                'django.db.backends.sqlite3'}:
+            raise CommandError('Копировать можно только файлы SQLite.')
+        while True:
+            started = time.perf_counter()
+            self.copy(primary['NAME'], replica['NAME'])
+            self.stdout.write(
+                f'реплика обновлена за '
+                f'{(time.perf_counter() - started) * 1000:.0f} мс'
+            )
+            if options['once']:
+                return
+            time.sleep(options['lag'])
+
+    @staticmethod
+    def copy(source, target):
+        # Резервное копирование SQLite согласовано с писателями
+        # основной базы и с читателями реплики.
+        source = sqlite3.connect(source)
+        target = sqlite3.connect(target)
+        try:
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
@@ -0,0 +1,159 @@
+"""Отдача загруженных файлов из MEDIA_ROOT.
+
+Поддерживает условные запросы (ETag, Last-Modified), один диапазон
+байт в Range и долгий кэш для неизменяемых имён из MEDIA_IMMUTABLE.
+При MEDIA_OFFLOAD сам файл отдаёт фронтовой прокси, а Python только
+проверяет путь и выставляет заголовки.
+"""
+import mimetypes
+import os
+import re
+import stat
+from urllib.parse import quote
+
+from django.conf import settings
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponse
+from django.utils._os import safe_join
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from django.views.decorators.http import require_safe
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+class RangeNotSatisfiable(Exception):
+    pass
+
+
+def parse_range(header, size):
+    """(начало, длина) из заголовка Range или None, если это не один
+    диапазон байт: тогда отдаётся весь файл.
+
+    RangeNotSatisfiable, если диапазон начинается за концом файла.
+    """
+    match = RANGE.match(header.strip())
+    if match is None:
+        return None
+    first, last = match.groups()
+    if not first:
+        if not last:
+            return None
+        length = min(int(last), size)
+        if not length:
+            raise RangeNotSatisfiable
+        return size - length, length
+    first = int(first)
+    if first >= size:
+        raise RangeNotSatisfiable
+    last = min(int(last), size - 1) if last else size - 1
+    if last < first:
+        return None
+    return first, last - first + 1
+
+
+class FileRange:
+    """Часть файла для FileResponse: чтение не выходит за диапазон."""
+
+    def __init__(self, file, start, length):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+@require_safe
+def serve(request, path):
+    """Файл MEDIA_ROOT/path."""
+    try:
+        fullpath = safe_join(settings.MEDIA_ROOT, path)
+        status = os.stat(fullpath)
+    except (SuspiciousFileOperation, OSError):
+        raise Http404
+    if not stat.S_ISREG(status.st_mode):
+        raise Http404
+    etag = f'"{status.st_mtime_ns:x}-{status.st_size:x}"'
+    last_modified = int(status.st_mtime)
+    response = get_conditional_response(
+        request, etag=etag, last_modified=last_modified
+    )
+    if response is None:
+        content_type = (
+            mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        )
+        if settings.MEDIA_OFFLOAD:
+            response = offload(path, fullpath, content_type)
+        else:
+            response = stream(
+                request, fullpath, status.st_size, content_type,
+                etag, last_modified
+            )
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    if any(re.match(pattern, path) for pattern in settings.MEDIA_IMMUTABLE):
+        patch_cache_control(
+            response, public=True, immutable=True,
+            max_age=settings.MEDIA_IMMUTABLE_MAX_AGE
+        )
+    else:
+        patch_cache_control(
+            response, public=True, max_age=settings.MEDIA_MAX_AGE
+        )
+    return response
+
+
+def stream(request, fullpath, size, content_type, etag, last_modified):
+    """Файл целиком или диапазон из заголовка Range."""
+    header = request.META.get('HTTP_RANGE')
+    if_range = request.META.get('HTTP_IF_RANGE')
+    # If-Range: диапазон отдаётся, только если файл не изменился,
+    # иначе клиент получит весь новый файл.
+    if if_range and if_range not in (etag, http_date(last_modified)):
+        header = None
+    try:
+        byte_range = parse_range(header, size) if header else None
+    except RangeNotSatisfiable:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = f'bytes */{size}'
+        return response
+    file = open(fullpath, 'rb')
+    if byte_range is None:
+        response = FileResponse(file, content_type=content_type)
+    else:
+        start, length = byte_range
+        response = FileResponse(
+            FileRange(file, start, length), status=206,
+            content_type=content_type
+        )
+        response['Content-Range'] = (
+            f'bytes {start}-{start + length - 1}/{size}'
+        )
+        response['Content-Length'] = length
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def offload(path, fullpath, content_type):
+    """Пустой ответ, по заголовку которого файл отдаёт прокси:
+    диапазоны и чтение с диска — его забота."""
+    response = HttpResponse(content_type=content_type)
+    if settings.MEDIA_OFFLOAD == 'x-accel-redirect':
+        response['X-Accel-Redirect'] = (
+            settings.MEDIA_OFFLOAD_PREFIX + quote(path)
+        )
+    elif settings.MEDIA_OFFLOAD == 'x-sendfile':
+        response['X-Sendfile'] = fullpath
+    else:
+        raise ValueError(
+            f'Неизвестное значение MEDIA_OFFLOAD: {settings.MEDIA_OFFLOAD}'
+        )
+    return response
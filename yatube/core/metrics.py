@@ -0,0 +1,251 @@
+import atexit
+import math
+import os
+import sqlite3
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metrics (
+    name TEXT NOT NULL,
+    labels TEXT NOT NULL,
+    value REAL NOT NULL,
+    PRIMARY KEY (name, labels)
+) WITHOUT ROWID;
+'''
+
+UPSERT = '''
+INSERT INTO metrics (name, labels, value) VALUES (?, ?, ?)
+ON CONFLICT (name, labels) DO UPDATE SET value = value + excluded.value
+'''
+
+# Имя метрики: (тип, описание, границы корзин для гистограмм).
+METRICS = {
+    'yatube_http_requests_total': (
+        'counter', 'Запросы по имени URL, методу и коду ответа.', None,
+    ),
+    'yatube_http_request_duration_seconds': (
+        'histogram', 'Время ответа по имени URL.',
+        (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5),
+    ),
+    'yatube_db_queries_per_request': (
+        'histogram', 'Число запросов SQL на запрос HTTP.',
+        (0, 1, 2, 3, 5, 10, 20, 50, 100),
+    ),
+    'yatube_db_duration_seconds': (
+        'histogram', 'Суммарное время SQL на запрос HTTP.',
+        (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1),
+    ),
+    'yatube_cache_reads_total': (
+        'counter', 'Чтения ключей кэша в запросах: hit или miss.', None,
+    ),
+    'yatube_page_cache_requests_total': (
+        'counter', 'Запросы к кэшу страниц анонимов: hit или miss.', None,
+    ),
+    'yatube_background_tasks_queued_total': (
+        'counter', 'Фоновые задачи, поставленные в очередь.', None,
+    ),
+    'yatube_background_tasks_done_total': (
+        'counter', 'Фоновые задачи, завершённые (в том числе с ошибкой).',
+        None,
+    ),
+    'yatube_background_queue_depth': (
+        'gauge', 'Фоновые задачи в очереди и в работе во всех процессах.',
+        None,
+    ),
+}
+
+
+def format_labels(**labels):
+    """Метки в виде Prometheus: a="1",b="2" в порядке имён."""
+    return ','.join(
+        '{}="{}"'.format(name, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for name, value in sorted(labels.items())
+    )
+
+
+class MetricsStore:
+    """Значения метрик в файле SQLite, общем для всех процессов хоста.
+
+    Каждый процесс прибавляет свои приращения к строкам (имя, метки),
+    поэтому сумма по процессам получается без отдельного сборщика.
+    """
+
+    def __init__(self, path):
+        self._path = path
+        self._local = threading.local()
+
+    @property
+    def _connection(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            directory = os.path.dirname(self._path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            connection = sqlite3.connect(
+                self._path, isolation_level=None, timeout=5
+            )
+            connection.execute('PRAGMA journal_mode = WAL')
+            connection.execute('PRAGMA synchronous = NORMAL')
+            connection.executescript(SCHEMA)
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def add(self, values):
+        """Прибавляет {(имя, метки): приращение} одной транзакцией."""
+        if not values:
+            return
+        connection = self._connection
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany(
+                UPSERT,
+                [(name, labels, value)
+                 for (name, labels), value in values.items()]
+            )
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        connection.execute('COMMIT')
+
+    def read(self):
+        """Все значения: {(имя, метки): значение}."""
+        return {
+            (name, labels): value for name, labels, value in
+            self._connection.execute(
+                'SELECT name, labels, value FROM metrics'
+            ).fetchall()
+        }
+
+    def clear(self):
+        self._connection.execute('DELETE FROM metrics')
+
+
+class Registry:
+    """Приращения метрик процесса, которые раз в METRICS_FLUSH_INTERVAL
+    секунд одной транзакцией переносятся в общий MetricsStore.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._store = None
+        self._pending = defaultdict(float)
+        self._flushed = time.monotonic()
+        self._pid = os.getpid()
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = MetricsStore(settings.METRICS_STORE)
+        return self._store
+
+    def inc(self, name, value=1, **labels):
+        with self._lock:
+            self._check_fork()
+            self._pending[(name, format_labels(**labels))] += value
+
+    def observe(self, name, value, **labels):
+        """Наблюдение для гистограммы: корзина, сумма и число."""
+        buckets = METRICS[name][2]
+        bound = next((b for b in buckets if value <= b), math.inf)
+        key = format_labels(**labels)
+        with self._lock:
+            self._check_fork()
+            self._pending[(f'{name}_bucket', key + f'|{bound}')] += 1
+            self._pending[(f'{name}_sum', key)] += value
+            self._pending[(f'{name}_count', key)] += 1
+
+    def maybe_flush(self):
+        if (time.monotonic() - self._flushed
+                >= settings.METRICS_FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            self._check_fork()
+            pending, self._pending = self._pending, defaultdict(float)
+            self._flushed = time.monotonic()
+        self.store.add(pending)
+
+    def _check_fork(self):
+        # Приращения, унаследованные от родителя при fork, уже
+        # принадлежат родителю: иначе они были бы посчитаны дважды.
+        if self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._pending = defaultdict(float)
+
+
+registry = Registry()
+atexit.register(lambda: registry._pending and registry.flush())
+
+
+@receiver(setting_changed)
+def reset_store(setting, **kwargs):
+    # Тесты подменяют файл метрик временным.
+    if setting == 'METRICS_STORE':
+        registry._store = None
+
+
+def _bucket_bound(bound):
+    return '+Inf' if bound == math.inf else f'{bound:g}'
+
+
+def _join_labels(*parts):
+    return '{' + ','.join(part for part in parts if part) + '}'
+
+
+def _queue_depth(values):
+    """Глубина очереди по задачам: поставлено минус завершено."""
+    depth = defaultdict(float)
+    for (name, labels), value in values.items():
+        if name == 'yatube_background_tasks_queued_total':
+            depth[labels] += value
+        elif name == 'yatube_background_tasks_done_total':
+            depth[labels] -= value
+    return {
+        ('yatube_background_queue_depth', labels): max(value, 0)
+        for labels, value in depth.items()
+    }
+
+
+def exposition():
+    """Метрики всех процессов в текстовом формате Prometheus 0.0.4."""
+    registry.flush()
+    values = registry.store.read()
+    values.update(_queue_depth(values))
+    lines = []
+    for name, (kind, description, buckets) in METRICS.items():
+        lines.append(f'# HELP {name} {description}')
+        lines.append(f'# TYPE {name} {kind}')
+        if kind != 'histogram':
+            for (metric, labels), value in sorted(values.items()):
+                if metric == name:
+                    lines.append(f'{name}{_join_labels(labels)} {value:g}')
+            continue
+        observed = defaultdict(lambda: defaultdict(float))
+        for (metric, key), value in values.items():
+            if metric == f'{name}_bucket':
+                labels, bound = key.rsplit('|', 1)
+                observed[labels][float(bound)] += value
+        for labels in sorted(observed):
+            cumulative = 0
+            for bound in (*buckets, math.inf):
+                cumulative += observed[labels].get(bound, 0)
+                bucket_label = f'le="{_bucket_bound(bound)}"'
+                lines.append(
+                    f'{name}_bucket{_join_labels(labels, bucket_label)} '
+                    f'{cumulative:g}'
+                )
+            for suffix in ('sum', 'count'):
+                value = values.get((f'{name}_{suffix}', labels), 0)
+                lines.append(
+                    f'{name}_{suffix}{_join_labels(labels)} {value:g}'
+                )
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,155 @@
+import random
+import sys
+import time
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.db import connections
+
+from . import metrics, profiling, routers, timing
+
+
+def _timed_execute(execute, sql, params, many, context):
+    with timing.measure('db'):
+        return execute(sql, params, many, context)
+
+
+def _collect(stack):
+    """Счётчики запроса: уже включённые внешним middleware или новые."""
+    timings = timing.current()
+    if timings is not None:
+        return timings
+    timings = stack.enter_context(timing.collect())
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(_timed_execute))
+    return timings
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else 'unresolved'
+
+
+class MetricsMiddleware:
+    """Метрики каждого запроса для /metrics.
+
+    По имени URL (posts:*, users:* и т. д.) считаются запросы, время
+    ответа, число и время запросов SQL, а также чтения кэша. Значения
+    копятся в процессе и раз в METRICS_FLUSH_INTERVAL секунд переносятся
+    в общее для всех процессов хранилище core.metrics.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with ExitStack() as stack:
+            timings = _collect(stack)
+            response = self.get_response(request)
+        total = time.perf_counter() - timings.started
+        view = _view_name(request)
+        registry = metrics.registry
+        registry.inc(
+            'yatube_http_requests_total', view=view,
+            method=request.method, status=response.status_code
+        )
+        registry.observe(
+            'yatube_http_request_duration_seconds', total, view=view
+        )
+        registry.observe(
+            'yatube_db_queries_per_request', timings.counts['db'], view=view
+        )
+        registry.observe(
+            'yatube_db_duration_seconds', timings.durations['db'], view=view
+        )
+        if timings.cache_hits:
+            registry.inc('yatube_cache_reads_total', timings.cache_hits,
+                         result='hit')
+        if timings.cache_misses:
+            registry.inc('yatube_cache_reads_total', timings.cache_misses,
+                         result='miss')
+        registry.maybe_flush()
+        return response
+
+
+class ServerTimingMiddleware:
+    """Замеры запроса в заголовке Server-Timing и сводке по view.
+
+    Заголовок получает доля SERVER_TIMING_SAMPLE_RATE запросов.
+    Считаются запросы SQL и их время, рендер шаблонов, чтения кэша
+    с попаданиями и промахами, поиск миниатюр. Если выше стоит
+    MetricsMiddleware, используются его счётчики.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if random.random() >= settings.SERVER_TIMING_SAMPLE_RATE:
+            return self.get_response(request)
+        with ExitStack() as stack:
+            timings = _collect(stack)
+            response = self.get_response(request)
+        total = time.perf_counter() - timings.started
+        response['Server-Timing'] = timings.header(total)
+        timing.summary.add(_view_name(request), total, timings)
+        return response
+
+
+class ProfilingMiddleware:
+    """Профили живого трафика: каждый PROFILE_SAMPLE_EVERY-й запрос
+    к каждому view снимается сэмплером стеков и пишется в
+    PROFILE_SPOOL_DIR. Команда merge_profiles сводит их по view.
+
+    Профиль начинается в process_view, когда имя view уже известно,
+    и включает рендер шаблонов и нижние middleware.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.PROFILE_SAMPLE_EVERY:
+            return self.get_response(request)
+        request._profiling_root = sys._getframe()
+        response = self.get_response(request)
+        if getattr(request, '_profiling', False):
+            sample = profiling.sampler.stop()
+            profiling.spool(sample, response.status_code)
+        return response
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        root = getattr(request, '_profiling_root', None)
+        if root is None:
+            return None
+        view = request.resolver_match.view_name
+        if profiling.should_profile(view):
+            profiling.sampler.start(view, root)
+            request._profiling = True
+        return None
+
+
+class ReplicaPinningMiddleware:
+    """Чтения с реплик и закрепление за основной базой после записи.
+
+    Запрос, который писал в базу, ставит cookie REPLICA_PIN_COOKIE
+    на REPLICA_PIN_SECONDS: пока она жива, запросы пользователя читают
+    основную базу и видят свои изменения, даже если реплика отстаёт.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not settings.DATABASE_REPLICAS:
+            return self.get_response(request)
+        pinned = settings.REPLICA_PIN_COOKIE in request.COOKIES
+        with routers.replica_reads(not pinned) as state:
+            response = self.get_response(request)
+        if state.wrote:
+            response.set_cookie(
+                settings.REPLICA_PIN_COOKIE, '1',
+                max_age=settings.REPLICA_PIN_SECONDS, httponly=True,
+                samesite='Lax'
+            )
+        return response
@@ -0,0 +1,131 @@
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+
+class Sample:
+    """Стеки одного профилируемого запроса.
+
+    root — кадр, выше которого стек не записывается: сервер и внешние
+    middleware одинаковы во всех запросах и только загромождают граф.
+    """
+
+    def __init__(self, view, root):
+        self.view = view
+        self.root = root
+        self.started = time.perf_counter()
+        self.stacks = Counter()
+
+
+def frame_label(frame):
+    """Имя кадра: модуль относительно проекта или site-packages и функция."""
+    filename = frame.f_code.co_filename
+    if filename.startswith(settings.BASE_DIR):
+        filename = os.path.relpath(filename, settings.BASE_DIR)
+    elif 'site-packages' in filename:
+        filename = filename.rsplit('site-packages' + os.sep, 1)[1]
+    return f'{filename}:{frame.f_code.co_name}'
+
+
+class StackSampler:
+    """Фоновый поток, который раз в PROFILE_INTERVAL секунд снимает стеки
+    потоков с профилируемыми запросами.
+
+    В отличие от cProfile, не замедляет каждый вызов функции и даёт
+    полные стеки, из которых строится flame graph.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._active = {}
+        self._thread = None
+        self._pid = None
+
+    def start(self, view, root):
+        sample = Sample(view, root)
+        with self._lock:
+            self._active[threading.get_ident()] = sample
+            if self._thread is None or self._pid != os.getpid():
+                self._thread = threading.Thread(
+                    target=self._run, name='yatube-profiler', daemon=True
+                )
+                self._pid = os.getpid()
+                self._thread.start()
+        return sample
+
+    def stop(self):
+        with self._lock:
+            return self._active.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            time.sleep(settings.PROFILE_INTERVAL)
+            with self._lock:
+                if not self._active:
+                    continue
+                frames = sys._current_frames()
+                for thread_id, sample in self._active.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        sample.stacks[self._stack(frame, sample.root)] += 1
+
+    @staticmethod
+    def _stack(frame, root):
+        labels = []
+        while frame is not None and frame is not root:
+            labels.append(frame_label(frame))
+            frame = frame.f_back
+        return ';'.join(reversed(labels))
+
+
+sampler = StackSampler()
+
+_counts = defaultdict(int)
+_counts_lock = threading.Lock()
+
+
+def should_profile(view):
+    """Каждый PROFILE_SAMPLE_EVERY-й запрос к view в этом процессе."""
+    every = settings.PROFILE_SAMPLE_EVERY
+    if not every:
+        return False
+    with _counts_lock:
+        _counts[view] += 1
+        return _counts[view] % every == 0
+
+
+def spool(sample, status):
+    """Пишет профиль запроса в PROFILE_SPOOL_DIR отдельным файлом."""
+    directory = settings.PROFILE_SPOOL_DIR
+    os.makedirs(directory, exist_ok=True)
+    name = f'{sample.view.replace(":", "-")}.{uuid.uuid4().hex}.json'
+    path = os.path.join(directory, name)
+    with open(path + '.tmp', 'w') as file:
+        json.dump({
+            'view': sample.view,
+            'status': status,
+            'duration': time.perf_counter() - sample.started,
+            'interval': settings.PROFILE_INTERVAL,
+            'stacks': sample.stacks,
+        }, file)
+    # Команда слияния не увидит недописанный файл.
+    os.replace(path + '.tmp', path)
+    return path
+
+
+def load_profiles(directory):
+    """Профили из каталога: [(путь, профиль)]."""
+    profiles = []
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        with open(path) as file:
+            profiles.append((path, json.load(file)))
+    return profiles
@@ -0,0 +1,56 @@
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+
+_state = threading.local()
+
+
+@contextmanager
+def replica_reads(enabled):
+    """Разрешает чтения с реплик в текущем потоке на время запроса.
+
+    Возвращает состояние, в котором после блока видно, писал ли
+    запрос в базу (state.wrote).
+    """
+    _state.replicas = enabled
+    _state.replica = None
+    _state.wrote = False
+    try:
+        yield _state
+    finally:
+        _state.replicas = False
+        _state.replica = None
+
+
+class PrimaryReplicaRouter:
+    """Записи идут в default, чтения запросов — на DATABASE_REPLICAS.
+
+    Реплики читаются только внутри replica_reads(True): фоновые задачи,
+    команды и запросы, закреплённые за основной базой, читают default.
+    Реплика выбирается одна на запрос: разные реплики могут отставать
+    по-разному, и страница не должна собираться из разных снимков.
+    После первой записи запрос до конца читает основную базу, чтобы
+    увидеть своё изменение.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (not replicas or not getattr(_state, 'replicas', False)
+                or _state.wrote):
+            return 'default'
+        if _state.replica is None:
+            _state.replica = random.choice(replicas)
+        return _state.replica
+
+    def db_for_write(self, model, **hints):
+        _state.wrote = True
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Реплика получает схему вместе с копией файла основной базы.
+        return db == 'default'
@@ -0,0 +1,21 @@
+from django.conf import settings
+
+# Настройки, которые SQLite применяет без профиля: откатный журнал
+# и полная синхронизация на каждый коммит.
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'DELETE',
+    'synchronous': 'FULL',
+}
+
+
+def apply_pragmas(cursor, pragmas):
+    """Выполняет PRAGMA из словаря {имя: значение} на соединении."""
+    for name, value in pragmas.items():
+        cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def apply_profile(sender, connection, **kwargs):
+    """Приёмник connection_created: профиль SQLITE_PRAGMAS для SQLite."""
+    if connection.vendor == 'sqlite':
+        with connection.cursor() as cursor:
+            apply_pragmas(cursor, settings.SQLITE_PRAGMAS)
@@ -0,0 +1,27 @@
+from django.template.backends import django
+
+from . import timing
+
+
+class Template:
+    """Шаблон, время рендера которого попадает в Server-Timing."""
+
+    def __init__(self, template):
+        self._template = template
+
+    def __getattr__(self, name):
+        return getattr(self._template, name)
+
+    def render(self, context=None, request=None):
+        with timing.measure('tpl'):
+            return self._template.render(context, request)
+
+
+class DjangoTemplates(django.DjangoTemplates):
+    """Бэкенд Django Templates с замером времени рендера."""
+
+    def from_string(self, template_code):
+        return Template(super().from_string(template_code))
+
+    def get_template(self, template_name):
+        return Template(super().get_template(template_name))
@@ -0,0 +1,43 @@
+import copy
+import shutil
+import tempfile
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+from . import metrics
+
+
+@contextmanager
+def isolated_runtime():
+    """Кэш и метрики во временном каталоге, который удаляется на выходе.
+
+    Тесты не видят кэш и метрики прошлых запусков и работающего сайта.
+    """
+    directory = tempfile.mkdtemp(prefix='yatube-test-')
+    caches = copy.deepcopy(settings.CACHES)
+    caches['default']['LOCATION'] = f'{directory}/cache.sqlite3'
+    try:
+        with override_settings(
+            CACHES=caches, METRICS_STORE=f'{directory}/metrics.sqlite3'
+        ):
+            yield directory
+            # Иначе atexit допишет приращения тестов в файл метрик сайта.
+            metrics.registry.flush()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class TestRunner(DiscoverRunner):
+    """DiscoverRunner с кэшем и метриками во временном каталоге."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        self._runtime = isolated_runtime()
+        self._runtime.__enter__()
+
+    def teardown_test_environment(self, **kwargs):
+        self._runtime.__exit__(None, None, None)
+        super().teardown_test_environment(**kwargs)
@@ -1,4 +1,28 @@
-from django.test import Client, TestCase
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import re
+import time
+from io import StringIO
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings
+)
+from django.test.utils import CaptureQueriesContext
+
+from posts.models import Post
+
+from . import metrics, profiling, routers, timing
+from .cache import SQLiteCache
+
+User = get_user_model()
 
 
 class ViewTestClass(TestCase):
@@ -15,3 +39,487 @@ class ViewTestClass(TestCase):
         """ Cтраница 404 отдает кастомный шаблон. """
         response = self.guest_client.get('/group/general/')
         self.assertTemplateUsed(response, 'core/404.html')
+
+
+class SQLiteCacheTests(TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, 'cache.sqlite3')
+        self.cache = SQLiteCache(self.path, {'OPTIONS': {'MAX_ENTRIES': 10}})
+
+    def tearDown(self):
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def test_get_set_delete(self):
+        """ Значения сохраняются, читаются и удаляются. """
+        self.cache.set('post', {'text': 'Текст'})
+        self.cache.set('flag', True)
+        self.assertEqual(self.cache.get('post'), {'text': 'Текст'})
+        self.assertIs(self.cache.get('flag'), True)
+        self.cache.delete('post')
+        self.assertIsNone(self.cache.get('post'))
+        self.assertEqual(self.cache.get_many(['flag', 'post']),
+                         {'flag': True})
+
+    def test_expired_values_are_missing(self):
+        """ Просроченные значения не возвращаются, add их перезаписывает. """
+        self.cache.set('key', 'старое', timeout=0)
+        self.assertFalse(self.cache.has_key('key'))
+        self.assertTrue(self.cache.add('key', 'новое'))
+        self.assertFalse(self.cache.add('key', 'лишнее'))
+        self.assertEqual(self.cache.get('key'), 'новое')
+
+    def test_incr_is_shared_between_connections(self):
+        """ Другой процесс с тем же файлом видит изменения incr. """
+        other = SQLiteCache(self.path, {})
+        self.cache.set('version', 1)
+        self.assertEqual(other.incr('version'), 2)
+        self.assertEqual(self.cache.incr('version', 10), 12)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_least_recently_used_are_culled(self):
+        """ При переполнении вытесняются давно не читанные записи. """
+        cache = SQLiteCache(self.path, {'OPTIONS': {
+            'MAX_ENTRIES': 10, 'LRU_RESOLUTION': 0
+        }})
+        for number in range(10):
+            cache.set(number, number)
+        time.sleep(0.01)
+        cache.get(0)
+        cache.set('extra', 'value')
+        self.assertEqual(cache.get(0), 0)
+        self.assertIsNone(cache.get(1))
+        self.assertEqual(cache.get('extra'), 'value')
+
+
+@override_settings(SERVER_TIMING_SAMPLE_RATE=1)
+class ServerTimingTests(TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='timing')
+        Post.objects.create(author=author, text='Пост', image='posts/t.gif')
+
+    def setUp(self):
+        cache.clear()
+        timing.summary._reset()
+        self.guest_client = Client()
+
+    def metrics(self, response):
+        return {
+            name: params for name, params in re.findall(
+                r'(\w+);([^,]*)', response['Server-Timing']
+            )
+        }
+
+    def test_header_reports_request_work(self):
+        """ Заголовок Server-Timing содержит SQL, шаблоны, кэш, миниатюры. """
+        # Посты и одно пакетное чтение всех вариантов миниатюры.
+        with self.assertNumQueries(2):
+            response = self.guest_client.get('/')
+        metrics = self.metrics(response)
+        self.assertEqual(
+            set(metrics), {'total', 'db', 'tpl', 'cache', 'thumb'}
+        )
+        self.assertIn('desc="2 queries"', metrics['db'])
+        self.assertIn(
+            f'desc="{len(settings.POST_THUMBNAILS)} lookups"', metrics['thumb']
+        )
+        self.assertRegex(metrics['cache'], r'desc="hits=\d+ misses=\d+"')
+
+    def test_unsampled_requests_not_measured(self):
+        """ Запросы вне выборки идут без замеров и заголовка. """
+        with override_settings(SERVER_TIMING_SAMPLE_RATE=0):
+            response = self.guest_client.get('/')
+        self.assertFalse(response.has_header('Server-Timing'))
+        self.assertEqual(timing.summary.snapshot(), {})
+
+    def test_summary_aggregated_per_view(self):
+        """ Сводка копится по view и пишется в лог по интервалу. """
+        self.guest_client.get('/')
+        self.guest_client.get('/')
+        self.guest_client.get('/group/missing/')
+        views = timing.summary.snapshot()
+        self.assertEqual(views['posts:index']['requests'], 2)
+        self.assertEqual(views['posts:group_lists']['requests'], 1)
+        with override_settings(SERVER_TIMING_SUMMARY_INTERVAL=0):
+            with self.assertLogs('core.timing', 'INFO') as logs:
+                self.guest_client.get('/')
+        self.assertTrue(any('posts:index: 3' in line for line in logs.output))
+        self.assertEqual(timing.summary.snapshot(), {})
+
+
+def _add_metrics(path, times):
+    store = metrics.MetricsStore(path)
+    for _ in range(times):
+        store.add({('requests_total', 'view="posts:index"'): 1})
+
+
+@override_settings(METRICS_TOKEN='metrics-token')
+class MetricsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        metrics.registry.flush()
+        metrics.registry.store.clear()
+        self.guest_client = Client(HTTP_AUTHORIZATION='Bearer metrics-token')
+
+    def test_requests_counted_per_url_name(self):
+        """ /metrics отдаёт счётчики и гистограммы по имени URL. """
+        self.guest_client.get('/')
+        self.guest_client.get('/')
+        self.guest_client.get('/auth/signup/')
+        response = self.guest_client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain'))
+        text = response.content.decode()
+        self.assertIn(
+            'yatube_http_requests_total'
+            '{method="GET",status="200",view="posts:index"} 2', text
+        )
+        self.assertIn(
+            'yatube_http_requests_total'
+            '{method="GET",status="200",view="users:signup"} 1', text
+        )
+        self.assertIn(
+            'yatube_http_request_duration_seconds_bucket'
+            '{view="posts:index",le="+Inf"} 2', text
+        )
+        self.assertIn(
+            'yatube_http_request_duration_seconds_count'
+            '{view="posts:index"} 2', text
+        )
+        self.assertRegex(
+            text, r'yatube_db_queries_per_request_sum\{view="posts:index"\} \d'
+        )
+        self.assertRegex(
+            text, r'yatube_cache_reads_total\{result="(hit|miss)"\}'
+        )
+
+    def test_histogram_buckets_are_cumulative(self):
+        """ Корзины гистограммы накапливают все меньшие наблюдения. """
+        for value in (0, 2, 7, 500):
+            metrics.registry.observe(
+                'yatube_db_queries_per_request', value, view='test'
+            )
+        text = metrics.exposition()
+        for bound, count in (('0', 1), ('2', 2), ('5', 2), ('10', 3),
+                             ('100', 3), ('+Inf', 4)):
+            self.assertIn(
+                'yatube_db_queries_per_request_bucket'
+                f'{{view="test",le="{bound}"}} {count}\n', text
+            )
+        self.assertIn(
+            'yatube_db_queries_per_request_sum{view="test"} 509', text
+        )
+
+    def test_counters_aggregate_across_processes(self):
+        """ Приращения из нескольких процессов складываются в общем файле. """
+        path = metrics.registry.store._path
+        context = multiprocessing.get_context('fork')
+        workers = [
+            context.Process(target=_add_metrics, args=(path, 50))
+            for _ in range(4)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+            self.assertEqual(worker.exitcode, 0)
+        values = metrics.registry.store.read()
+        self.assertEqual(
+            values[('requests_total', 'view="posts:index"')], 200
+        )
+
+    def test_background_queue_depth(self):
+        """ Глубина очереди — поставленные минус завершённые задачи. """
+        name = 'generate_thumbnails'
+        metrics.registry.inc(
+            'yatube_background_tasks_queued_total', 3, task=name
+        )
+        metrics.registry.inc('yatube_background_tasks_done_total', task=name)
+        text = self.guest_client.get('/metrics').content.decode()
+        self.assertIn(
+            'yatube_background_queue_depth{task="generate_thumbnails"} 2',
+            text
+        )
+
+    def test_metrics_closed_without_token(self):
+        """ /metrics недоступна без верного токена и без METRICS_TOKEN. """
+        for authorization in ('', 'Bearer wrong', 'metrics-token'):
+            with self.subTest(authorization=authorization):
+                response = Client().get(
+                    '/metrics', HTTP_AUTHORIZATION=authorization
+                )
+                self.assertEqual(response.status_code, 403)
+        with self.settings(METRICS_TOKEN=''):
+            response = self.guest_client.get(
+                '/metrics', HTTP_AUTHORIZATION='Bearer '
+            )
+            self.assertEqual(response.status_code, 403)
+
+
+def _busy(seconds):
+    deadline = time.perf_counter() + seconds
+    while time.perf_counter() < deadline:
+        pass
+
+
+# Попадание в кэш страниц минует view, а профилируются только view.
+@override_settings(PAGE_CACHE_ENABLED=False)
+class ProfilingTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.spool = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.spool, ignore_errors=True)
+        profiling._counts.clear()
+        self.guest_client = Client()
+
+    def test_every_nth_request_per_view_is_spooled(self):
+        """ Профилируется каждый N-й запрос к каждому view отдельно. """
+        with self.settings(PROFILE_SAMPLE_EVERY=2,
+                           PROFILE_SPOOL_DIR=self.spool):
+            for _ in range(4):
+                self.guest_client.get('/')
+            self.guest_client.get('/auth/signup/')
+        profiles = profiling.load_profiles(self.spool)
+        self.assertEqual(
+            [profile['view'] for path, profile in profiles],
+            ['posts:index', 'posts:index']
+        )
+        self.assertEqual(profiles[0][1]['status'], 200)
+
+    def test_sampler_records_stacks_below_root(self):
+        """ Сэмплер снимает стеки потока только ниже корневого кадра. """
+        with self.settings(PROFILE_INTERVAL=0.001):
+            profiling.sampler.start('test', sys._getframe())
+            _busy(0.05)
+            sample = profiling.sampler.stop()
+        self.assertTrue(sample.stacks)
+        for stack in sample.stacks:
+            self.assertTrue(stack.startswith('core/tests.py:_busy'))
+
+    def test_merge_profiles_writes_collapsed_stacks(self):
+        """ merge_profiles складывает стеки профилей одного view. """
+        with self.settings(PROFILE_SPOOL_DIR=self.spool):
+            for count in (1, 2):
+                sample = profiling.Sample('posts:index', None)
+                sample.stacks['a.py:view;django/template/base.py:render'] = (
+                    count
+                )
+                sample.stacks['a.py:view'] = 1
+                profiling.spool(sample, 200)
+        out = StringIO()
+        call_command(
+            'merge_profiles', spool=self.spool, delete=True, stdout=out
+        )
+        path = os.path.join(self.spool, 'merged', 'posts-index.collapsed')
+        with open(path) as file:
+            self.assertEqual(file.read(), (
+                'a.py:view 2\n'
+                'a.py:view;django/template/base.py:render 3\n'
+            ))
+        self.assertIn('шаблоны: 60.0%', out.getvalue())
+        self.assertEqual(profiling.load_profiles(self.spool), [])
+
+
+class SQLiteProfileTests(TestCase):
+
+    def pragma(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'PRAGMA {name}')
+            return cursor.fetchone()[0]
+
+    def test_connection_uses_profile(self):
+        """ Новое соединение получает настройки из SQLITE_PRAGMAS. """
+        self.assertEqual(self.pragma('synchronous'), 1)
+        self.assertEqual(self.pragma('busy_timeout'), 5000)
+        self.assertEqual(self.pragma('cache_size'), -64 * 1024)
+        self.assertEqual(self.pragma('temp_store'), 2)
+
+    def test_maintenance_reports_pages(self):
+        """ sqlite_maintenance обновляет статистику и печатает размеры. """
+        out = StringIO()
+        call_command('sqlite_maintenance', analyze=True, stdout=out)
+        self.assertIn('page_count:', out.getvalue())
+        self.assertIn('freelist_count:', out.getvalue())
+
+    def test_benchmark_compares_profiles(self):
+        """ sqlite_benchmark печатает строку для каждого профиля. """
+        out = StringIO()
+        call_command(
+            'sqlite_benchmark', writers=1, readers=1, seconds=0.1, rows=100,
+            stdout=out
+        )
+        self.assertIn('по умолчанию', out.getvalue())
+        self.assertIn('SQLITE_PRAGMAS', out.getvalue())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaRoutingTests(TransactionTestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='replica_author')
+        self.reader = User.objects.create_user(username='replica_reader')
+        Post.objects.create(author=self.author, text='Пост')
+        self.client = Client()
+        self.client.force_login(self.reader)
+
+    def get(self, url):
+        with CaptureQueriesContext(connections['default']) as primary:
+            with CaptureQueriesContext(connections['replica']) as replica:
+                response = self.client.get(url)
+        return response, len(primary), len(replica)
+
+    def test_feed_reads_go_to_replica(self):
+        """ Ленты читаются с реплики, пока пользователь ничего не писал. """
+        response, primary, replica = self.get('/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(primary, 0)
+        self.assertGreater(replica, 0)
+        self.assertNotIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+
+    def test_writer_is_pinned_to_primary(self):
+        """ После записи запросы пользователя читают основную базу. """
+        response, primary, replica = self.get(
+            f'/profile/{self.author.username}/follow/'
+        )
+        self.assertIn(settings.REPLICA_PIN_COOKIE, response.cookies)
+        self.assertEqual(
+            response.cookies[settings.REPLICA_PIN_COOKIE]['max-age'],
+            settings.REPLICA_PIN_SECONDS
+        )
+        response, primary, replica = self.get('/follow/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(replica, 0)
+        self.assertGreater(primary, 0)
+
+    def test_reads_outside_requests_use_primary(self):
+        """ Фоновые задачи и команды читают основную базу. """
+        router = routers.PrimaryReplicaRouter()
+        self.assertEqual(router.db_for_read(Post), 'default')
+        with routers.replica_reads(True):
+            self.assertEqual(router.db_for_read(Post), 'replica')
+            router.db_for_write(Post)
+            self.assertEqual(router.db_for_read(Post), 'default')
+
+    @override_settings(DATABASE_REPLICAS=['replica', 'replica_2'])
+    def test_one_replica_per_request(self):
+        """ Все чтения запроса идут на одну реплику. """
+        router = routers.PrimaryReplicaRouter()
+        for _ in range(5):
+            with routers.replica_reads(True):
+                reads = {router.db_for_read(Post) for _ in range(10)}
+            self.assertEqual(len(reads), 1)
+
+
+MEDIA_ROOT = tempfile.mkdtemp(dir=settings.BASE_DIR)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT)
+class MediaServingTests(TestCase):
+    content = bytes(range(256)) * 4
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        for name in ('posts/photo.jpg', 'cache/ab/cd/thumb.jpg'):
+            path = os.path.join(MEDIA_ROOT, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as file:
+                file.write(cls.content)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.guest_client = Client()
+
+    def get(self, name, **headers):
+        return self.guest_client.get(settings.MEDIA_URL + name, **headers)
+
+    def test_serves_file_with_validators(self):
+        """ Файл отдаётся целиком с ETag, Last-Modified и кэшем. """
+        response = self.get('posts/photo.jpg')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+        self.assertEqual(response['Content-Type'], 'image/jpeg')
+        self.assertEqual(response['Accept-Ranges'], 'bytes')
+        self.assertIn('Last-Modified', response)
+        self.assertIn(f'max-age={settings.MEDIA_MAX_AGE}',
+                      response['Cache-Control'])
+        self.assertNotIn('immutable', response['Cache-Control'])
+        cached = self.get(
+            'posts/photo.jpg', HTTP_IF_NONE_MATCH=response['ETag']
+        )
+        self.assertEqual(cached.status_code, 304)
+
+    def test_immutable_names_cached_for_long(self):
+        """ Миниатюры кэшируются браузером надолго. """
+        response = self.get('cache/ab/cd/thumb.jpg')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn(f'max-age={settings.MEDIA_IMMUTABLE_MAX_AGE}',
+                      response['Cache-Control'])
+
+    def test_range_requests(self):
+        """ Range отдаёт часть файла, а диапазон за концом — 416. """
+        size = len(self.content)
+        cases = (
+            ('bytes=10-19', 10, 19),
+            ('bytes=1000-', 1000, size - 1),
+            ('bytes=-24', size - 24, size - 1),
+        )
+        for header, first, last in cases:
+            with self.subTest(header=header):
+                response = self.get('posts/photo.jpg', HTTP_RANGE=header)
+                self.assertEqual(response.status_code, 206)
+                self.assertEqual(
+                    b''.join(response.streaming_content),
+                    self.content[first:last + 1]
+                )
+                self.assertEqual(response['Content-Range'],
+                                 f'bytes {first}-{last}/{size}')
+                self.assertEqual(response['Content-Length'],
+                                 str(last - first + 1))
+        response = self.get('posts/photo.jpg', HTTP_RANGE=f'bytes={size}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{size}')
+
+    def test_stale_if_range_returns_whole_file(self):
+        """ Range с устаревшим If-Range отдаёт весь файл. """
+        response = self.get(
+            'posts/photo.jpg', HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"old"'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.content)
+
+    def test_missing_and_outside_files_not_found(self):
+        """ Отсутствующие файлы и пути вне MEDIA_ROOT дают 404. """
+        for name in ('posts/absent.jpg', 'posts', '../manage.py'):
+            with self.subTest(name=name):
+                self.assertEqual(self.get(name).status_code, 404)
+
+    def test_offload_to_proxy(self):
+        """ При MEDIA_OFFLOAD файл отдаёт прокси, а ответ пустой. """
+        headers = (
+            ('x-accel-redirect', 'X-Accel-Redirect',
+             settings.MEDIA_OFFLOAD_PREFIX + 'posts/photo.jpg'),
+            ('x-sendfile', 'X-Sendfile',
+             os.path.join(MEDIA_ROOT, 'posts/photo.jpg')),
+        )
+        for offload, header, value in headers:
+            with self.subTest(offload=offload):
+                with self.settings(MEDIA_OFFLOAD=offload):
+                    response = self.get('posts/photo.jpg')
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response[header], value)
+                self.assertEqual(response.content, b'')
+                self.assertIn('ETag', response)
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class RequestTimings:
+    """Счётчики одного запроса: число событий и время по видам работы.
+
+    Виды: db (запросы SQL), tpl (рендер шаблонов), cache (чтения кэша),
+    thumb (поиск миниатюр). Для кэша ещё считаются попадания и промахи.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = defaultdict(int)
+        self.durations = defaultdict(float)
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def add(self, name, duration, count=1):
+        self.counts[name] += count
+        self.durations[name] += duration
+
+    def header(self, total):
+        """Значение заголовка Server-Timing, длительности в миллисекундах."""
+        parts = [f'total;dur={total * 1000:.1f}']
+        descriptions = {
+            'db': f'{self.counts["db"]} queries',
+            'tpl': 'templates',
+            'cache': f'hits={self.cache_hits} misses={self.cache_misses}',
+            'thumb': f'{self.counts["thumb"]} lookups',
+        }
+        for name, description in descriptions.items():
+            if self.counts[name]:
+                parts.append(
+                    f'{name};dur={self.durations[name] * 1000:.1f};'
+                    f'desc="{description}"'
+                )
+        return ', '.join(parts)
+
+
+def current():
+    """Счётчики текущего запроса или None, если запрос не замеряется."""
+    return getattr(_local, 'timings', None)
+
+
+@contextmanager
+def collect():
+    """Включает замеры в текущем потоке на время блока."""
+    timings = RequestTimings()
+    _local.timings = timings
+    try:
+        yield timings
+    finally:
+        _local.timings = None
+
+
+@contextmanager
+def measure(name, count=1):
+    """Добавляет время блока к виду работы name текущего запроса."""
+    timings = current()
+    if timings is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings.add(name, time.perf_counter() - started, count)
+
+
+def record_cache(hits, misses):
+    timings = current()
+    if timings is not None:
+        timings.cache_hits += hits
+        timings.cache_misses += misses
+
+
+class ViewSummary:
+    """Сводка замеров по view внутри процесса.
+
+    Раз в SERVER_TIMING_SUMMARY_INTERVAL секунд сводка пишется в лог
+    core.timing и начинается заново.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.started = time.monotonic()
+        self.views = defaultdict(lambda: defaultdict(float))
+
+    def add(self, view, total, timings):
+        with self._lock:
+            stats = self.views[view]
+            stats['requests'] += 1
+            stats['total'] += total
+            stats['db_queries'] += timings.counts['db']
+            for name, duration in timings.durations.items():
+                stats[name] += duration
+            stats['cache_hits'] += timings.cache_hits
+            stats['cache_misses'] += timings.cache_misses
+            due = (time.monotonic() - self.started
+                   >= settings.SERVER_TIMING_SUMMARY_INTERVAL)
+            if due:
+                views = self._snapshot()
+                self._reset()
+        if due:
+            self.log(views)
+
+    def snapshot(self):
+        """Средние значения по view: {view: {метрика: значение}}."""
+        with self._lock:
+            return self._snapshot()
+
+    def _snapshot(self):
+        return {
+            view: {
+                name: value / stats['requests'] if name != 'requests'
+                else int(value)
+                for name, value in stats.items()
+            }
+            for view, stats in self.views.items()
+        }
+
+    @staticmethod
+    def log(views):
+        for view, stats in sorted(views.items()):
+            logger.info(
+                '%s: %d запросов, в среднем %.1f мс, SQL %.1f мс '
+                '(%.1f запросов), шаблоны %.1f мс, кэш %.1f мс',
+                view, stats['requests'], stats['total'] * 1000,
+                stats.get('db', 0) * 1000, stats['db_queries'],
+                stats.get('tpl', 0) * 1000, stats.get('cache', 0) * 1000,
+            )
+
+
+summary = ViewSummary()
@@ -1,4 +1,10 @@
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import HttpResponse
 from django.shortcuts import render
+from django.utils.crypto import constant_time_compare
+
+from . import metrics as core_metrics
 
 
 def page_not_found(request, exception):
@@ -16,3 +22,19 @@ def permission_denied(request, exception):
 def csrf_failure(request, reason=''):
     return render(request, 'core/403csrf.html')
 
+
+def metrics(request):
+    """Метрики всех процессов в формате Prometheus.
+
+    Доступны только с токеном METRICS_TOKEN в заголовке Authorization.
+    """
+    token = settings.METRICS_TOKEN
+    authorization = request.META.get('HTTP_AUTHORIZATION', '')
+    if not token or not constant_time_compare(
+        authorization, f'Bearer {token}'
+    ):
+        raise PermissionDenied
+    return HttpResponse(
+        core_metrics.exposition(),
+        content_type='text/plain; version=0.0.4; charset=utf-8'
+    )
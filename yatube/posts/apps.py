@@ -3,3 +3,12 @@ from django.apps import AppConfig
 
 class PostsConfig(AppConfig):
     name = 'posts'
+
+    def ready(self):
+        from PIL import Image
+        from django.conf import settings
+
+        from . import signals  # noqa: F401
+
+        # Защита от «бомб распаковки» везде, где Pillow открывает файлы.
+        Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
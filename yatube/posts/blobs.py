@@ -0,0 +1,98 @@
+"""Ссылки постов на файлы картинок в хранилище по содержимому.
+
+Один файл может быть картинкой многих постов, поэтому удалять его
+вместе с постом нельзя. Сигналы ведут в MediaBlob число ссылок на
+файл, а файл без ссылок удаляется вместе с миниатюрами.
+"""
+import os
+import posixpath
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
+from sorl.thumbnail import delete
+
+from .counters import bump
+from .models import MediaBlob, Post
+from .tasks import run_after_commit
+
+
+def image_storage():
+    return Post._meta.get_field('image').storage
+
+
+def acquire(name):
+    """Добавляет ссылку на файл name."""
+    blobs = MediaBlob.objects.filter(name=name)
+    if not bump(blobs, refs=1):
+        MediaBlob.objects.get_or_create(name=name)
+        bump(blobs, refs=1)
+
+
+def release(name):
+    """Убирает ссылку на файл name; файл без ссылок удаляется
+    в фоне после коммита."""
+    blobs = MediaBlob.objects.filter(name=name)
+    bump(blobs, refs=-1)
+    if blobs.filter(refs__lte=0).exists():
+        run_after_commit(collect, [name])
+
+
+def collect(names, grace=None):
+    """Удаляет файлы names, на которые нет ссылок, и их миниатюры.
+
+    Файл, записанный или загруженный повторно меньше grace секунд назад
+    (по умолчанию MEDIA_BLOB_GRACE), не удаляется: запрос, который его
+    сохранил, мог ещё не записать пост со ссылкой на него.
+    Возвращает число удалённых файлов.
+    """
+    storage = image_storage()
+    if grace is None:
+        grace = settings.MEDIA_BLOB_GRACE
+    deadline = time.time() - grace
+    removed = 0
+    for name in names:
+        with transaction.atomic():
+            if MediaBlob.objects.filter(name=name, refs__gt=0).exists():
+                continue
+            path = storage.path(name)
+            if os.path.exists(path) and os.path.getmtime(path) > deadline:
+                continue
+            MediaBlob.objects.filter(name=name).delete()
+            delete(name)
+            removed += 1
+    return removed
+
+
+def stored_names(directory):
+    """Имена всех файлов хранилища картинок в directory и глубже."""
+    storage = image_storage()
+    if not storage.exists(directory):
+        return
+    directories, files = storage.listdir(directory)
+    for file in files:
+        # Точка в начале — временный файл незавершённой записи.
+        if not file.startswith('.'):
+            yield posixpath.join(directory, file)
+    for subdirectory in directories:
+        yield from stored_names(posixpath.join(directory, subdirectory))
+
+
+def repair_refs():
+    """Пересчитывает ссылки на файлы по постам и возвращает число
+    исправленных строк."""
+    refs = dict(
+        Post.objects.exclude(image='').order_by().values_list('image')
+        .annotate(total=Count('pk'))
+    )
+    MediaBlob.objects.bulk_create(
+        [MediaBlob(name=name) for name in refs], ignore_conflicts=True
+    )
+    fixed = 0
+    for name, current in MediaBlob.objects.values_list('name', 'refs'):
+        expected = refs.get(name, 0)
+        if current != expected:
+            MediaBlob.objects.filter(name=name).update(refs=expected)
+            fixed += 1
+    return fixed
@@ -0,0 +1,92 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _version_key(scope):
+    return f'feed_version:{scope}'
+
+
+def _fresh_version():
+    # Версия, пережившая вытеснение из кэша, не должна совпасть
+    # со старой: иначе снова станут видны устаревшие фрагменты.
+    return int(time.time() * 1000)
+
+
+def get_versions(*scopes):
+    """Текущие версии областей кэша: index, group:<id>, profile:<id>..."""
+    keys = [_version_key(scope) for scope in scopes]
+    versions = cache.get_many(keys)
+    missing = {
+        key: _fresh_version() for key in keys if key not in versions
+    }
+    if missing:
+        # Недостающие версии создаются одной записью, а не add и get
+        # на каждую: страница может читать сотни областей.
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*scopes):
+    """Делает недействительными все ключи, построенные на этих областях."""
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            cache.set(_version_key(scope), _fresh_version(), None)
+
+
+def tag_request(request, scopes, versions):
+    """Запоминает области, из которых собрана страница, и их версии.
+
+    Это суррогатные ключи для кэша целых страниц: страница годна,
+    пока версии всех её областей не изменились.
+    """
+    keys = getattr(request, 'surrogate_keys', {})
+    keys.update(zip(scopes, versions))
+    request.surrogate_keys = keys
+
+
+def page_etag(request, *scopes):
+    """ETag страницы из версий её областей кэша.
+
+    В хэш входят и пользователь, и CSRF-cookie: страница с формами,
+    отданная одному зрителю, не годится другому.
+    """
+    versions = get_versions(*scopes)
+    tag_request(request, scopes, versions)
+    viewer = request.user.pk if request.user.is_authenticated else ''
+    raw = ':'.join(map(str, [
+        *scopes, *versions, viewer,
+        request.COOKIES.get(settings.CSRF_COOKIE_NAME, ''),
+    ]))
+    return hashlib.md5(raw.encode()).hexdigest()
+
+
+def post_scopes(post, group_id=None):
+    """Области кэша, в которых виден пост."""
+    scopes = ['index', f'profile:{post.author_id}', f'post:{post.pk}']
+    for scope_group_id in {post.group_id, group_id} - {None}:
+        scopes.append(f'group:{scope_group_id}')
+    return scopes
+
+
+def feed_cache(request, feed, *scopes):
+    """Контекст для {% cache %} ленты: ключ с версиями и номером страницы.
+
+    Ключ меняется при любой записи в области ленты, поэтому фрагменты
+    можно хранить долго, не показывая устаревшие данные.
+    """
+    versions = get_versions(*scopes)
+    tag_request(request, scopes, versions)
+    page = request.GET.get('page', '')
+    cursor = request.GET.get('cursor', '')
+    return {
+        'feed_cache_key': ':'.join(
+            [feed, *scopes, *map(str, versions), page, cursor]
+        ),
+        'feed_cache_timeout': settings.FEED_CACHE_TIMEOUT,
+    }
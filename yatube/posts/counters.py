@@ -0,0 +1,69 @@
+from django.apps import apps as global_apps
+from django.conf import settings
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def bump(queryset, **deltas):
+    """Атомарно меняет счётчики строк queryset на deltas через F()."""
+    return queryset.update(**{
+        field: F(field) + delta for field, delta in deltas.items()
+    })
+
+
+def bump_author(user_id, **deltas):
+    """Меняет счётчики автора; строку создаёт только при увеличении.
+
+    При каскадном удалении пользователя его строка уже удалена,
+    и создавать её заново для уменьшения счётчика нельзя.
+    """
+    AuthorStats = global_apps.get_model('posts', 'AuthorStats')
+    stats = AuthorStats.objects.filter(user_id=user_id)
+    if not bump(stats, **deltas) and min(deltas.values()) > 0:
+        AuthorStats.objects.get_or_create(user_id=user_id)
+        bump(stats, **deltas)
+
+
+def count_of(model, field):
+    """Подзапрос: сколько строк model ссылаются полем field на строку."""
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def repair_counters(apps=global_apps):
+    """Пересчитывает все счётчики и возвращает число исправленных строк.
+
+    Принимает реестр приложений, чтобы работать и в миграциях.
+    """
+    User = apps.get_model(settings.AUTH_USER_MODEL)
+    AuthorStats = apps.get_model('posts', 'AuthorStats')
+    Comment = apps.get_model('posts', 'Comment')
+    Follow = apps.get_model('posts', 'Follow')
+    Group = apps.get_model('posts', 'Group')
+    Post = apps.get_model('posts', 'Post')
+    AuthorStats.objects.bulk_create(
+        [AuthorStats(user_id=pk) for pk in User.objects.filter(
+            stats__isnull=True).values_list('pk', flat=True)],
+        ignore_conflicts=True
+    )
+    counters = (
+        (AuthorStats, 'posts_count', count_of(Post, 'author')),
+        (AuthorStats, 'followers_count', count_of(Follow, 'author')),
+        (AuthorStats, 'following_count', count_of(Follow, 'user')),
+        (Post, 'comments_count', count_of(Comment, 'post')),
+        (Group, 'posts_count', count_of(Post, 'group')),
+    )
+    fixed = {}
+    for model, field, actual in counters:
+        drifted = model.objects.annotate(
+            actual=actual
+        ).exclude(**{field: F('actual')}).values('pk')
+        fixed[f'{model.__name__}.{field}'] = model.objects.filter(
+            pk__in=drifted
+        ).update(**{field: actual})
+    return fixed
@@ -0,0 +1,56 @@
+"""Граф подписок: авторы, на которых подписан пользователь.
+
+Множество id авторов хранится в общем кэше под ключом following:<user_id>
+и загружается одним запросом при первом обращении. Внутри запроса оно
+запоминается на объекте пользователя, поэтому проверки «подписан ли»
+для целой страницы авторов не стоят ни запросов, ни чтений кэша.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Follow
+
+
+def _key(user_id):
+    return f'following:{user_id}'
+
+
+def _load(user_id, using=None):
+    return frozenset(
+        Follow.objects.db_manager(using).filter(
+            user_id=user_id
+        ).values_list('author_id', flat=True)
+    )
+
+
+def following_ids(user):
+    """Множество id авторов, на которых подписан user (пустое для гостя)."""
+    if not user.is_authenticated:
+        return frozenset()
+    ids = getattr(user, '_following_ids', None)
+    if ids is None:
+        ids = cache.get(_key(user.pk))
+        if ids is None:
+            ids = _load(user.pk)
+            # add, а не set: свежее множество, записанное после коммита
+            # подписки, не должно затереться прочитанным раньше.
+            cache.add(_key(user.pk), ids, settings.FOLLOW_GRAPH_TIMEOUT)
+        user._following_ids = ids
+    return ids
+
+
+def is_following(user, author_id):
+    return author_id in following_ids(user)
+
+
+def forget(user_id):
+    """Убирает множество из кэша, пока подписка ещё не закоммичена."""
+    cache.delete(_key(user_id))
+
+
+def refresh(user_id):
+    """Записывает в кэш множество, прочитанное из основной базы."""
+    cache.set(
+        _key(user_id), _load(user_id, using='default'),
+        settings.FOLLOW_GRAPH_TIMEOUT
+    )
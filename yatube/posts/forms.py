@@ -1,11 +1,13 @@
 from django import forms
+from django.conf import settings
 
 from .models import Post, Comment
 
 
 class PostForm(forms.ModelForm):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, rejected_uploads=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.rejected_uploads = rejected_uploads or {}
         self.fields['text'].widget.attrs['placeholder'] = (
             'Напиши текст, пожалуйста'
         )
@@ -25,6 +27,23 @@ class PostForm(forms.ModelForm):
             'group': 'Выбор за тобой'
         }
 
+    def clean_image(self):
+        image = self.cleaned_data.get('image')
+        # Размер новой картинки известен из заголовка: ImageField
+        # проверяет файл без декодирования пикселей.
+        size = getattr(getattr(image, 'image', None), 'size', None)
+        if size and size[0] * size[1] > settings.IMAGE_MAX_PIXELS:
+            raise forms.ValidationError(
+                f'Картинка больше {settings.IMAGE_MAX_PIXELS} пикселей.'
+            )
+        return image
+
+    def clean(self):
+        cleaned_data = super().clean()
+        for field, message in self.rejected_uploads.items():
+            self.add_error(field, message)
+        return cleaned_data
+
 
 class CommentForm(forms.ModelForm):
     class Meta:
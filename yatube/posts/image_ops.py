@@ -0,0 +1,77 @@
+"""Обработка картинок в отдельных процессах.
+
+Модуль не зависит от Django: его импортируют процессы пула,
+запущенные через spawn, без настроек проекта.
+"""
+import base64
+import os
+from io import BytesIO
+
+from PIL import Image, ImageOps
+
+# Сторона заглушки в пикселях: около полукилобайта в base64.
+PLACEHOLDER_SIDE = 16
+
+# Форматы, которые перекодируются без метаданных. Анимированные GIF
+# остаются как есть: перекодирование потеряло бы кадры.
+REENCODE = {
+    'JPEG': {'quality': 85, 'optimize': True, 'progressive': True},
+    'PNG': {'optimize': True},
+    'WEBP': {'quality': 85},
+}
+
+
+def normalize(source, target, max_pixels):
+    """Поворачивает картинку по EXIF и перекодирует её в target.
+
+    Метаданные (EXIF с координатами и моделью камеры) не сохраняются.
+    Возвращает (ширину, высоту) результата или None, если формат
+    не перекодируется и target не создан.
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with Image.open(source) as image:
+        image_format = image.format
+        if image_format not in REENCODE:
+            return None
+        image = ImageOps.exif_transpose(image)
+        if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        image.save(target, image_format, **REENCODE[image_format])
+        return image.size
+
+
+def describe(path, max_pixels):
+    """Метаданные картинки для шаблонов, чтобы не открывать её при рендере.
+
+    Ширина и высота, размер файла в байтах, основной цвет #rrggbb
+    и крошечная размытая заглушка в виде data URI.
+    """
+    Image.MAX_IMAGE_PIXELS = max_pixels
+    with Image.open(path) as image:
+        width, height = image.size
+        # JPEG сразу декодируется в уменьшенном виде.
+        image.draft('RGB', (PLACEHOLDER_SIDE * 2, PLACEHOLDER_SIDE * 2))
+        small = image.convert('RGB')
+    small.thumbnail((PLACEHOLDER_SIDE, PLACEHOLDER_SIDE))
+    palette = small.quantize(colors=4)
+    count, index = max(palette.getcolors())
+    red, green, blue = palette.getpalette()[index * 3:index * 3 + 3]
+    buffer = BytesIO()
+    small.save(buffer, 'JPEG', quality=40)
+    return {
+        'image_width': width,
+        'image_height': height,
+        'image_size': os.path.getsize(path),
+        'image_color': f'#{red:02x}{green:02x}{blue:02x}',
+        'image_placeholder': 'data:image/jpeg;base64,'
+        + base64.b64encode(buffer.getvalue()).decode(),
+    }
+
+
+def prepare(source, target, max_pixels):
+    """normalize и describe одним заданием пула.
+
+    Возвращает (перекодирована ли картинка в target, метаданные).
+    """
+    reencoded = normalize(source, target, max_pixels) is not None
+    return reencoded, describe(target if reencoded else source, max_pixels)
@@ -0,0 +1,76 @@
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+
+from posts import image_ops
+from posts.caching import bump_versions, post_scopes
+from posts.models import Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает метаданные картинок (размеры, байты, цвет, заглушку) '
+        'для постов, у которых их ещё нет, в пуле процессов.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--workers', type=int, default=multiprocessing.cpu_count(),
+            help='Сколько процессов декодируют картинки.'
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=500,
+            help='Сколько постов читать из базы за раз.'
+        )
+        parser.add_argument(
+            '--all', action='store_true',
+            help='Пересчитать и уже заполненные метаданные.'
+        )
+
+    def handle(self, *args, **options):
+        posts = Post.objects.exclude(image='')
+        if not options['all']:
+            posts = posts.filter(image_width__isnull=True)
+        posts = posts.order_by('pk').only(
+            'pk', 'image', 'author_id', 'group_id'
+        )
+        done = failed = 0
+        last_pk = 0
+        with ProcessPoolExecutor(
+            max_workers=options['workers'],
+            mp_context=multiprocessing.get_context('spawn')
+        ) as pool:
+            while True:
+                # Пачки по первичному ключу: обновлённые строки
+                # не сдвигают следующую пачку.
+                batch = list(
+                    posts.filter(pk__gt=last_pk)[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_pk = batch[-1].pk
+                futures = {
+                    pool.submit(
+                        image_ops.describe,
+                        default_storage.path(post.image.name),
+                        settings.IMAGE_MAX_PIXELS
+                    ): post for post in batch
+                }
+                for future in as_completed(futures):
+                    post = futures[future]
+                    try:
+                        metadata = future.result()
+                    except Exception as error:
+                        failed += 1
+                        self.stderr.write(f'{post.image.name}: {error}')
+                        continue
+                    Post.objects.filter(
+                        pk=post.pk, image=post.image.name
+                    ).update(**metadata)
+                    bump_versions(*post_scopes(post))
+                    done += 1
+                self.stdout.write(f'обработано: {done}, ошибок: {failed}')
+        self.stdout.write(f'Готово: {done}, ошибок: {failed}.')
@@ -0,0 +1,206 @@
+import re
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import override_settings
+from django.urls import reverse
+
+from posts import urls
+from posts.models import Comment, Follow, Group, Post, User
+
+# Строки EXPLAIN QUERY PLAN, которые означают полный проход таблицы
+# или сортировку во временном B-дереве. Проход по индексу
+# (SCAN t USING INDEX) и по виртуальной таблице FTS5 допустимы.
+BAD_PLAN = re.compile(
+    r'^SCAN (TABLE )?\w+( AS \w+)?$|USE TEMP B-TREE'
+)
+
+# Служебные таблицы SQLite: статистика планировщика и схема. Их читают
+# оценки числа строк (FeedPaginator), индексов у них не бывает.
+SYSTEM_TABLES = re.compile(r'\bsqlite_(stat\d|master|schema)\b')
+
+# Полный проход таблицы, в которой по ANALYZE меньше стольких строк,
+# допустим: на маленькой таблице планировщик справедливо предпочитает
+# его индексу и сам перейдёт на индекс, когда таблица вырастет.
+SMALL_TABLE_ROWS = 1000
+
+SCANNED_TABLE = re.compile(r'^SCAN (?:TABLE )?(\w+)')
+
+# Параметры запроса для view, которым они нужны. View из POST_DATA
+# принимают только POST и вызываются с этими данными.
+QUERY_STRINGS = {
+    'search': {'q': 'план'},
+}
+
+POST_DATA = {
+    'add_comment': {'text': 'план'},
+}
+
+# View, которые вызываются от имени автора поста, а не читателя.
+AUTHOR_VIEWS = {'post_edit'}
+
+# Известные и допустимые шаги плана: {view: {шаг: причина}}.
+ALLOWED = {
+    'search': {
+        'USE TEMP B-TREE FOR ORDER BY':
+            'ранг bm25 считается по найденным строкам, индекса у него нет',
+    },
+    'post_create': {
+        'SCAN posts_group': 'форма предлагает выбрать из всех групп',
+    },
+    'post_edit': {
+        'SCAN posts_group': 'форма предлагает выбрать из всех групп',
+    },
+}
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет все view из posts.urls на временных данных, '
+        'проверяет EXPLAIN QUERY PLAN каждого запроса SELECT и завершается '
+        'ошибкой, если есть полный проход таблицы или временный B-tree.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Печатать планы всех запросов, а не только плохих.'
+        )
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError('Команда разбирает планы только SQLite.')
+        problems = []
+        # Данные создаются в транзакции и откатываются, кэш и фоновые
+        # middleware подменяются, чтобы проверка не оставляла следов.
+        middleware = [
+            name for name in settings.MIDDLEWARE
+            if not name.startswith('core.middleware.')
+        ]
+        with override_settings(
+            CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'
+            }},
+            MIDDLEWARE=middleware,
+            ALLOWED_HOSTS=['testserver'],
+            PAGE_CACHE_ENABLED=False,
+        ):
+            small = self.small_tables()
+            try:
+                with transaction.atomic():
+                    for view, queries in self.replay():
+                        problems += self.check_view(
+                            view, queries, small, options['verbose_plans']
+                        )
+                    raise Rollback
+            except Rollback:
+                pass
+        if problems:
+            raise CommandError(
+                f'Плохих планов: {len(problems)}\n' + '\n'.join(problems)
+            )
+        self.stdout.write('Все запросы используют индексы.')
+
+    def replay(self):
+        """(имя view, [(SQL, параметры)]) для каждого маршрута posts.urls.
+
+        Запросы, завершившиеся ошибкой (например, чтение sqlite_stat1
+        до ANALYZE), не проверяются: view их перехватил, а EXPLAIN
+        упал бы на той же ошибке.
+        """
+        author = User.objects.create_user(username='plan_author')
+        reader = User.objects.create_user(username='plan_reader')
+        group = Group.objects.create(
+            title='План', slug='plan-group', description='План'
+        )
+        # Больше страницы постов: лента считает страницы и число строк.
+        Post.objects.bulk_create(
+            Post(author=author, group=group, text='план')
+            for _ in range(settings.POSTS_PER_PAGE)
+        )
+        post = Post.objects.create(author=author, group=group, text='план')
+        Comment.objects.create(post=post, author=reader, text='план')
+        Follow.objects.create(user=reader, author=author)
+        values = {
+            'slug': group.slug,
+            'username': author.username,
+            'post_id': post.pk,
+        }
+        clients = {user: Client() for user in (author, reader)}
+        for user, client in clients.items():
+            client.force_login(user)
+        for pattern in urls.urlpatterns:
+            client = clients[
+                author if pattern.name in AUTHOR_VIEWS else reader
+            ]
+            url = reverse(f'posts:{pattern.name}', kwargs={
+                name: values[name] for name in pattern.pattern.converters
+            })
+            queries = []
+
+            def record(execute, sql, params, many, context):
+                result = execute(sql, params, many, context)
+                if (sql.lstrip().upper().startswith('SELECT')
+                        and not SYSTEM_TABLES.search(sql)):
+                    queries.append((sql, params))
+                return result
+
+            with connection.execute_wrapper(record):
+                if pattern.name in POST_DATA:
+                    client.post(url, POST_DATA[pattern.name])
+                else:
+                    client.get(url, QUERY_STRINGS.get(pattern.name, {}))
+            yield pattern.name, queries
+
+    @staticmethod
+    def small_tables():
+        """Таблицы, в которых по статистике ANALYZE мало строк.
+
+        Без ANALYZE статистики нет, и планировщик считает все таблицы
+        большими: тогда проверяются все полные проходы.
+        """
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'"
+            )
+            if cursor.fetchone() is None:
+                return set()
+            cursor.execute('SELECT tbl, stat FROM sqlite_stat1')
+            rows = {}
+            for table, stat in cursor.fetchall():
+                count = int(stat.split()[0])
+                rows[table] = max(rows.get(table, 0), count)
+        return {
+            table for table, count in rows.items()
+            if count < SMALL_TABLE_ROWS
+        }
+
+    def check_view(self, view, queries, small, verbose):
+        problems = []
+        with connection.cursor() as cursor:
+            for sql, params in queries:
+                cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+                plan = [row[-1] for row in cursor.fetchall()]
+                bad = [
+                    step for step in plan if BAD_PLAN.search(step)
+                    and step not in ALLOWED.get(view, {})
+                    and not self.scans_small_table(step, small)
+                ]
+                if bad:
+                    problems.append(f'{view}: {"; ".join(bad)}\n    {sql}')
+                if verbose or bad:
+                    self.stdout.write(f'{view}: {sql}')
+                    for step in plan:
+                        self.stdout.write(f'    {step}')
+        return problems
+
+    @staticmethod
+    def scans_small_table(step, small):
+        match = SCANNED_TABLE.match(step)
+        return match is not None and match.group(1) in small
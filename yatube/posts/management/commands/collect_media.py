@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+
+from posts import blobs
+from posts.models import MediaBlob, Post
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает ссылки постов на файлы картинок и удаляет '
+        'файлы без ссылок вместе с миниатюрами.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--grace', type=int, default=None,
+            help='Не удалять файлы моложе стольких секунд '
+                 '(по умолчанию MEDIA_BLOB_GRACE).'
+        )
+
+    def handle(self, *args, **options):
+        fixed = blobs.repair_refs()
+        referenced = set(MediaBlob.objects.filter(
+            refs__gt=0
+        ).values_list('name', flat=True))
+        directory = Post._meta.get_field('image').upload_to
+        candidates = set(MediaBlob.objects.filter(
+            refs__lte=0
+        ).values_list('name', flat=True))
+        candidates.update(
+            name for name in blobs.stored_names(directory.rstrip('/'))
+            if name not in referenced
+        )
+        removed = blobs.collect(sorted(candidates), options['grace'])
+        posts = Post.objects.exclude(image='').count()
+        self.stdout.write(
+            f'Постов с картинками: {posts}, файлов: {len(referenced)}.'
+        )
+        self.stdout.write(
+            f'Ссылок исправлено: {fixed}, файлов удалено: {removed}.'
+        )
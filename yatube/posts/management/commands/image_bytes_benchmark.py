@@ -0,0 +1,101 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sorl.thumbnail import default
+
+from posts.models import Post
+from posts.thumbnails import backend, generate_thumbnails, thumbnail_options
+
+# Клиенты: ширина окна в CSS-пикселях, плотность пикселей, поддержка WebP.
+CLIENTS = (
+    ('телефон', 360, 2, True),
+    ('телефон без WebP', 360, 2, False),
+    ('планшет', 768, 1, True),
+    ('ноутбук', 1280, 1, True),
+    ('ноутбук без WebP', 1280, 1, False),
+)
+
+# Слот карточки по sizes из POST_PICTURES: вся ширина окна, но не больше
+# 960 CSS-пикселей.
+SLOT_WIDTH = 960
+
+
+class Command(BaseCommand):
+    help = (
+        'Считает, сколько байт картинок скачивает страница ленты: '
+        'с одной JPEG-миниатюрой для всех (как до <picture>) и с '
+        'вариантом из srcset, который выберет браузер клиента.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--picture', default='card')
+        parser.add_argument(
+            '--generate', action='store_true',
+            help='Создать недостающие миниатюры страницы перед подсчётом.'
+        )
+
+    def handle(self, *args, **options):
+        posts = list(
+            Post.objects.exclude(image='').order_by('-pub_date')
+            .only('pk', 'image', 'author_id', 'group_id')
+            [:settings.POSTS_PER_PAGE]
+        )
+        if not posts:
+            raise CommandError('В базе нет постов с картинками.')
+        picture = settings.POST_PICTURES[options['picture']]
+        if options['generate']:
+            for post in posts:
+                generate_thumbnails(post.pk)
+        sizes = [self.variant_sizes(post, picture) for post in posts]
+        if not all(variants[picture['img']] for variants in sizes):
+            raise CommandError(
+                'Не у всех картинок страницы есть миниатюры: '
+                'запустите с --generate.'
+            )
+        before = sum(variants[picture['img']][1] for variants in sizes)
+        self.stdout.write(f'картинок на странице: {len(posts)}')
+        self.stdout.write(
+            f'{"клиент":<18} {"до, КБ":>9} {"после, КБ":>10} '
+            f'{"экономия":>9}'
+        )
+        for label, viewport, density, webp in CLIENTS:
+            needed = min(viewport, SLOT_WIDTH) * density
+            after = sum(
+                self.choose(picture, variants, needed, webp)
+                for variants in sizes
+            )
+            self.stdout.write(
+                f'{label:<18} {before / 1024:>9.1f} {after / 1024:>10.1f} '
+                f'{1 - after / before:>9.0%}'
+            )
+
+    @staticmethod
+    def variant_sizes(post, picture):
+        """{миниатюра: (ширина, байт) или None} для картинки поста."""
+        aliases = {picture['img']}
+        for variants in picture['sources'].values():
+            aliases.update(variants)
+        aliases = sorted(aliases)
+        thumbnails = backend.get_ready_thumbnails([
+            (post.image.name, *thumbnail_options(alias)) for alias in aliases
+        ])
+        return {
+            alias: (thumbnail.width, default.storage.size(thumbnail.name))
+            if thumbnail is not None else None
+            for alias, thumbnail in zip(aliases, thumbnails)
+        }
+
+    @staticmethod
+    def choose(picture, variants, needed, webp):
+        """Байты варианта, который выберет браузер: первый подходящий
+        <source>, в нём самый узкий вариант не уже нужного, иначе самый
+        широкий."""
+        for mime_type, aliases in picture['sources'].items():
+            if mime_type == 'image/webp' and not webp:
+                continue
+            ready = sorted(
+                variants[alias] for alias in aliases if variants[alias]
+            )
+            if ready:
+                wide = [variant for variant in ready if variant[0] >= needed]
+                return (wide[0] if wide else ready[-1])[1]
+        return variants[picture['img']][1]
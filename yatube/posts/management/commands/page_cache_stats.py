@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from posts.middleware import page_cache_stats
+
+
+class Command(BaseCommand):
+    help = (
+        'Показывает долю попаданий в кэш страниц для анонимных читателей '
+        'по метрике yatube_page_cache_requests_total.'
+    )
+
+    def handle(self, *args, **options):
+        hits, misses = page_cache_stats()
+        total = hits + misses
+        ratio = hits / total if total else 0
+        self.stdout.write(
+            f'попаданий: {hits}, промахов: {misses}, доля: {ratio:.1%}'
+        )
@@ -0,0 +1,67 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from sorl.thumbnail import default
+
+from posts.models import Post
+from posts.thumbnails import backend, thumbnail_options
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает затраты на поиск миниатюр одной страницы ленты: '
+        'по одному чтению на миниатюру (как тег {% thumbnail %}) '
+        'и одним пакетным чтением (prefetch_thumbnails).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rounds', type=int, default=200)
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Перед каждым проходом убирать миниатюры страницы из кэша.'
+        )
+
+    def handle(self, *args, **options):
+        posts = list(
+            Post.objects.exclude(image='').order_by('-pub_date')
+            .only('image')[:settings.POSTS_PER_PAGE]
+        )
+        if not posts:
+            raise CommandError('В базе нет постов с картинками.')
+        requests = [
+            (post.image.name, *thumbnail_options(alias))
+            for post in posts for alias in settings.POST_THUMBNAILS
+        ]
+        keys = backend.thumbnail_keys(requests)
+        lookups = {
+            'по одной': lambda: [
+                backend.get_ready_thumbnail(name, geometry, **options)
+                for name, geometry, options in requests
+            ],
+            'разом': lambda: backend.get_ready_thumbnails(requests),
+        }
+        rounds = options['rounds']
+        self.stdout.write(
+            f'{len(requests)} миниатюр на странице, проходов: {rounds}'
+        )
+        self.stdout.write(
+            f'{"поиск":<10} {"мс/страница":>12} {"запросов/страница":>18}'
+        )
+        for label, lookup in lookups.items():
+            elapsed = 0
+            queries = 0
+            for _ in range(rounds):
+                if options['cold']:
+                    default.kvstore.cache.delete_many(keys)
+                with CaptureQueriesContext(connection) as captured:
+                    started = time.perf_counter()
+                    lookup()
+                    elapsed += time.perf_counter() - started
+                queries += len(captured)
+            self.stdout.write(
+                f'{label:<10} {elapsed / rounds * 1000:>12.3f} '
+                f'{queries / rounds:>18.1f}'
+            )
@@ -0,0 +1,104 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+from django.utils.cache import get_conditional_response
+
+from core import metrics
+
+from .caching import get_versions
+
+
+def page_cache_stats():
+    """Попадания и промахи кэша страниц во всех процессах: (hits, misses).
+
+    Берутся из метрики yatube_page_cache_requests_total.
+    """
+    metrics.registry.flush()
+    values = metrics.registry.store.read()
+    return tuple(
+        int(values.get((
+            'yatube_page_cache_requests_total',
+            metrics.format_labels(result=result)
+        ), 0))
+        for result in ('hit', 'miss')
+    )
+
+
+class AnonymousPageCacheMiddleware:
+    """Кэш целых страниц для анонимных читателей.
+
+    Страница хранится вместе с суррогатными ключами — областями кэша
+    и их версиями, которые view прочитал при рендере (tag_request).
+    Сигналы моделей сбрасывают версии областей, поэтому после записи
+    устаревают ровно те страницы, в которых была эта область.
+    Кэшируются только представления из PAGE_CACHE_VIEWS
+    и только при PAGE_CACHE_ENABLED.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not self._cacheable_request(request):
+            return self.get_response(request)
+        key = 'page:' + hashlib.md5(
+            request.get_full_path().encode()
+        ).hexdigest()
+        entry = cache.get(key)
+        if entry is not None:
+            content, headers, keys = entry
+            if get_versions(*keys) == list(keys.values()):
+                metrics.registry.inc(
+                    'yatube_page_cache_requests_total', result='hit'
+                )
+                return self._cached_response(request, content, headers)
+        metrics.registry.inc(
+            'yatube_page_cache_requests_total', result='miss'
+        )
+        response = self.get_response(request)
+        keys = getattr(request, 'surrogate_keys', None)
+        if keys and self._cacheable_response(response):
+            response['Surrogate-Key'] = ' '.join(keys)
+            cache.set(
+                key, (response.content, list(response.items()), keys),
+                settings.PAGE_CACHE_TIMEOUT
+            )
+        response['X-Page-Cache'] = 'MISS'
+        return response
+
+    @staticmethod
+    def _cacheable_request(request):
+        if not settings.PAGE_CACHE_ENABLED:
+            return False
+        if request.method not in ('GET', 'HEAD'):
+            return False
+        if request.user.is_authenticated:
+            return False
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        # Попадание в кэш минует разбор URL, а замерам нужно имя view.
+        request.resolver_match = match
+        return match.view_name in settings.PAGE_CACHE_VIEWS
+
+    @staticmethod
+    def _cacheable_response(response):
+        return (
+            response.status_code == 200
+            and not response.streaming
+            and not response.cookies
+        )
+
+    @staticmethod
+    def _cached_response(request, content, headers):
+        response = HttpResponse(content)
+        for header, value in headers:
+            response[header] = value
+        response['X-Page-Cache'] = 'HIT'
+        return get_conditional_response(
+            request, etag=response.get('ETag'), response=response
+        )
@@ -0,0 +1,102 @@
+from django.db import migrations
+
+# Полнотекстовый индекс постов: rowid совпадает с id поста. Триггеры
+# держат его в согласии с постами, названиями групп и именами авторов,
+# в том числе при bulk_create() и update(), которые не шлют сигналов.
+CREATE_SEARCH = [
+    '''
+    CREATE VIRTUAL TABLE posts_post_search USING fts5(
+        text, group_title, author_username,
+        tokenize = 'unicode61 remove_diacritics 2'
+    )
+    ''',
+    '''
+    CREATE TRIGGER posts_post_search_insert AFTER INSERT ON posts_post
+    BEGIN
+        INSERT INTO posts_post_search (
+            rowid, text, group_title, author_username
+        ) VALUES (
+            new.id, new.text,
+            (SELECT title FROM posts_group WHERE id = new.group_id),
+            (SELECT username FROM auth_user WHERE id = new.author_id)
+        );
+    END
+    ''',
+    '''
+    CREATE TRIGGER posts_post_search_update
+    AFTER UPDATE OF text, group_id, author_id ON posts_post
+    BEGIN
+        UPDATE posts_post_search SET
+            text = new.text,
+            group_title = (
+                SELECT title FROM posts_group WHERE id = new.group_id
+            ),
+            author_username = (
+                SELECT username FROM auth_user WHERE id = new.author_id
+            )
+        WHERE rowid = new.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER posts_post_search_delete AFTER DELETE ON posts_post
+    BEGIN
+        DELETE FROM posts_post_search WHERE rowid = old.id;
+    END
+    ''',
+    '''
+    CREATE TRIGGER posts_group_search_update
+    AFTER UPDATE OF title ON posts_group
+    BEGIN
+        UPDATE posts_post_search SET group_title = new.title
+        WHERE rowid IN (SELECT id FROM posts_post WHERE group_id = new.id);
+    END
+    ''',
+    '''
+    CREATE TRIGGER posts_author_search_update
+    AFTER UPDATE OF username ON auth_user
+    BEGIN
+        UPDATE posts_post_search SET author_username = new.username
+        WHERE rowid IN (SELECT id FROM posts_post WHERE author_id = new.id);
+    END
+    ''',
+    '''
+    INSERT INTO posts_post_search (rowid, text, group_title, author_username)
+    SELECT posts_post.id, posts_post.text, posts_group.title,
+           auth_user.username
+    FROM posts_post
+    JOIN auth_user ON auth_user.id = posts_post.author_id
+    LEFT JOIN posts_group ON posts_group.id = posts_post.group_id
+    ''',
+]
+
+DROP_SEARCH = [
+    'DROP TRIGGER IF EXISTS posts_author_search_update',
+    'DROP TRIGGER IF EXISTS posts_group_search_update',
+    'DROP TRIGGER IF EXISTS posts_post_search_delete',
+    'DROP TRIGGER IF EXISTS posts_post_search_update',
+    'DROP TRIGGER IF EXISTS posts_post_search_insert',
+    'DROP TABLE IF EXISTS posts_post_search',
+]
+
+
+def run_sqlite(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('auth', '0011_update_proxy_permissions'),
+        ('posts', '0015_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            run_sqlite(CREATE_SEARCH), run_sqlite(DROP_SEARCH)
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 2.2.16 on 2026-10-18 18:31
+
+from importlib import import_module
+
+from django.db import migrations, models
+
+search = import_module('posts.migrations.0016_post_search')
+
+# SQLite пересоздаёт таблицу постов при добавлении полей, а триггеры
+# поискового индекса ссылаются на неё: на время миграции их нет.
+CREATE_TRIGGERS = [
+    statement for statement in search.CREATE_SEARCH
+    if 'CREATE TRIGGER' in statement
+]
+DROP_TRIGGERS = [
+    statement for statement in search.DROP_SEARCH
+    if 'DROP TRIGGER' in statement
+]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0018_follow_user_author_idx'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            search.run_sqlite(DROP_TRIGGERS),
+            search.run_sqlite(CREATE_TRIGGERS)
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_color',
+            field=models.CharField(blank=True, editable=False, max_length=7, verbose_name='Основной цвет картинки'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_height',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Высота картинки'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_placeholder',
+            field=models.TextField(blank=True, editable=False, verbose_name='Заглушка картинки'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_size',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Размер картинки, байт'),
+        ),
+        migrations.AddField(
+            model_name='post',
+            name='image_width',
+            field=models.PositiveIntegerField(blank=True, editable=False, null=True, verbose_name='Ширина картинки'),
+        ),
+        migrations.RunPython(
+            search.run_sqlite(CREATE_TRIGGERS),
+            search.run_sqlite(DROP_TRIGGERS)
+        ),
+    ]
@@ -1,5 +1,9 @@
 from django.contrib.auth import get_user_model
 from django.db import models
+from django.db.models.expressions import RawSQL
+
+from .search import RANK, SEARCH_TABLE, match_expression
+from .storage import ContentAddressedStorage
 
 User = get_user_model()
 
@@ -8,11 +12,54 @@ class Group(models.Model):
     title = models.CharField(max_length=200)
     slug = models.SlugField(unique=True, max_length=100)
     description = models.TextField()
+    posts_count = models.IntegerField('Записей в группе', default=0)
 
     def __str__(self):
         return self.title
 
 
+class PostQuerySet(models.QuerySet):
+
+    def for_feed(self):
+        """Посты с автором и группой одним запросом, только нужные поля."""
+        return self.select_related('author', 'group').only(
+            'text', 'pub_date', 'image', 'comments_count',
+            'image_color', 'image_placeholder', 'image_width', 'image_height',
+            'author', 'author__username', 'author__first_name',
+            'author__last_name', 'group', 'group__slug', 'group__title',
+        )
+
+    def search(self, query):
+        """Посты, найденные полнотекстовым индексом, с рангом bm25.
+
+        Чем меньше rank, тем выше пост в выдаче. Пустой запрос
+        не находит ничего.
+        """
+        expression = match_expression(query)
+        if not expression:
+            return self.annotate(
+                rank=models.Value(0.0, output_field=models.FloatField())
+            ).none()
+        return self.extra(
+            tables=[SEARCH_TABLE],
+            where=[f'{SEARCH_TABLE}.rowid = posts_post.id',
+                   f'{SEARCH_TABLE} MATCH %s'],
+            params=[expression],
+        ).annotate(rank=RawSQL(RANK, (), output_field=models.FloatField()))
+
+    def count(self):
+        if (self._result_cache is not None
+                or 'rank' not in self.query.annotations):
+            return super().count()
+        # Django 2.2 считает queryset с аннотациями через GROUP BY, а bm25()
+        # в таком запросе недоступна. Для числа строк ранг не нужен:
+        # считаем посты по id найденных, без аннотации.
+        found = self.order_by().values('pk')
+        return self.model._default_manager.using(self.db).filter(
+            pk__in=found
+        ).count()
+
+
 class Post(models.Model):
     text = models.TextField()
     pub_date = models.DateTimeField(auto_now_add=True)
@@ -31,15 +78,55 @@ class Post(models.Model):
     image = models.ImageField(
         'Картинка',
         upload_to='posts/',
+        storage=ContentAddressedStorage(),
         blank=True
     )
+    comments_count = models.IntegerField('Комментариев', default=0)
+    # Метаданные картинки считаются один раз после загрузки
+    # (posts.uploads), чтобы рендер не открывал исходный файл.
+    image_width = models.PositiveIntegerField(
+        'Ширина картинки', null=True, blank=True, editable=False
+    )
+    image_height = models.PositiveIntegerField(
+        'Высота картинки', null=True, blank=True, editable=False
+    )
+    image_size = models.PositiveIntegerField(
+        'Размер картинки, байт', null=True, blank=True, editable=False
+    )
+    image_color = models.CharField(
+        'Основной цвет картинки', max_length=7, blank=True, editable=False
+    )
+    image_placeholder = models.TextField(
+        'Заглушка картинки', blank=True, editable=False
+    )
+
+    objects = PostQuerySet.as_manager()
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(
+                fields=['-pub_date', '-id'],
+                name='post_pub_date_idx'
+            ),
+            models.Index(
+                fields=['author', '-pub_date', '-id'],
+                name='post_author_pub_date_idx'
+            ),
+            models.Index(
+                fields=['group', '-pub_date', '-id'],
+                name='post_group_pub_date_idx'
+            ),
+        )
 
     def __str__(self):
         return self.text[:15]
 
+    def reset_image_metadata(self):
+        """Забывает метаданные прежней картинки до обработки новой."""
+        self.image_width = self.image_height = self.image_size = None
+        self.image_color = self.image_placeholder = ''
+
 
 class Comment(models.Model):
     post = models.ForeignKey(
@@ -60,6 +147,14 @@ class Comment(models.Model):
         auto_now_add=True
     )
 
+    class Meta:
+        indexes = (
+            models.Index(
+                fields=['post', 'created', 'id'],
+                name='comment_post_created_idx'
+            ),
+        )
+
     def __str__(self):
         return self.text[:15]
 
@@ -84,3 +179,69 @@ class Follow(models.Model):
             fields=['author', 'user'],
             name='unique_follow'),
         )
+        # Подписки пользователя читаются в порядке ordering без сортировки.
+        indexes = (
+            models.Index(
+                fields=['user', 'author'],
+                name='follow_user_author_idx'
+            ),
+        )
+
+
+class TimelineEntry(models.Model):
+    """Запись домашней ленты подписчика, разложенная при публикации."""
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='timeline',
+        verbose_name='Подписчик'
+    )
+    post = models.ForeignKey(
+        Post,
+        on_delete=models.CASCADE,
+        related_name='timeline_entries',
+        verbose_name='Пост'
+    )
+    pub_date = models.DateTimeField(verbose_name='Дата публикации поста')
+
+    class Meta:
+        constraints = (models.UniqueConstraint(
+            fields=['user', 'post'],
+            name='unique_timeline_entry'),
+        )
+        indexes = (
+            models.Index(
+                fields=['user', '-pub_date', '-post'],
+                name='timeline_user_pub_date_idx'
+            ),
+        )
+
+
+class AuthorStats(models.Model):
+    """Счётчики автора, которые обновляются сигналами при записи."""
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name='stats',
+        verbose_name='Автор'
+    )
+    posts_count = models.IntegerField('Постов', default=0)
+    followers_count = models.IntegerField('Подписчиков', default=0)
+    following_count = models.IntegerField('Подписок', default=0)
+    # Посты автора публиковались или подписки оформлялись, пока он был
+    # популярным (posts.timeline): лента подмешивает его посты при
+    # чтении, пока timeline.catch_up не разложит их по лентам.
+    timeline_pending = models.BooleanField(
+        'Посты не разложены по лентам', default=False
+    )
+
+
+class MediaBlob(models.Model):
+    """Файл хранилища по содержимому и число постов, которые на него
+    ссылаются. Обновляется сигналами, пересчитывается collect_media."""
+    name = models.CharField('Имя файла', max_length=100, primary_key=True)
+    refs = models.IntegerField('Ссылок', default=0)
+
+    def __str__(self):
+        return self.name
@@ -0,0 +1,59 @@
+import re
+
+from django.db import connections, router
+from django.utils.html import escape
+from django.utils.safestring import mark_safe
+
+SEARCH_TABLE = 'posts_post_search'
+
+# Веса колонок индекса для bm25: текст, название группы, имя автора.
+RANK = f'bm25({SEARCH_TABLE}, 10.0, 2.0, 2.0)'
+
+# Маркеры подсветки не встречаются в тексте и переживают escape().
+_MARK_START = '\x02'
+_MARK_END = '\x03'
+
+
+def match_expression(query):
+    """Запрос FTS5 из пользовательской строки или '' для пустой.
+
+    Каждое слово становится отдельной фразой в кавычках, поэтому
+    операторы FTS5 во вводе не работают и не ломают запрос. Последнее
+    слово ищется по префиксу: «прив» найдёт «привет».
+    """
+    words = re.findall(r'\w+', query)
+    if not words:
+        return ''
+    phrases = [f'"{word}"' for word in words]
+    phrases[-1] += '*'
+    return ' '.join(phrases)
+
+
+def attach_snippets(expression, length=24):
+    """prefetch для пагинатора: фрагменты текста с подсветкой совпадений.
+
+    Фрагменты для всех постов страницы строятся одним запросом
+    и попадают в post.snippet как безопасный HTML.
+    """
+    def prefetch(posts):
+        if not posts:
+            return
+        placeholders = ', '.join(['%s'] * len(posts))
+        # Фрагменты читаются из той же базы, что и сами посты.
+        using = router.db_for_read(type(posts[0]))
+        with connections[using].cursor() as cursor:
+            cursor.execute(
+                f'SELECT rowid, snippet({SEARCH_TABLE}, 0, %s, %s, %s, %s) '
+                f'FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s '
+                f'AND rowid IN ({placeholders})',
+                [_MARK_START, _MARK_END, '…', length, expression,
+                 *[post.pk for post in posts]]
+            )
+            snippets = dict(cursor.fetchall())
+        for post in posts:
+            snippet = escape(snippets.get(post.pk) or post.text[:200])
+            post.snippet = mark_safe(
+                snippet.replace(_MARK_START, '<mark>')
+                .replace(_MARK_END, '</mark>')
+            )
+    return prefetch
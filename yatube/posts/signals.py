@@ -0,0 +1,321 @@
+import threading
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models.signals import (
+    post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from . import blobs, follow_graph, timeline
+from .caching import bump_versions, post_scopes
+from .counters import bump, bump_author
+from .models import AuthorStats, Comment, Follow, Group, Post, User
+from .tasks import run_after_commit
+from .utils import feed_count_key
+
+
+_deleting = threading.local()
+
+
+def deleting_post_ids():
+    """Посты, которые удаляются в этом потоке прямо сейчас."""
+    if not hasattr(_deleting, 'post_ids'):
+        _deleting.post_ids = set()
+    return _deleting.post_ids
+
+
+@receiver(pre_delete, sender=Post)
+def remember_deleting_post(sender, instance, **kwargs):
+    """Комментарии удаляемого поста удаляются каскадом раньше него:
+    обновлять счётчик поста и версии кэша на каждый из них незачем,
+    версии сбросит удаление самого поста."""
+    deleting_post_ids().add(instance.pk)
+
+
+@receiver(post_delete, sender=Post)
+def forget_deleting_post(sender, instance, **kwargs):
+    deleting_post_ids().discard(instance.pk)
+
+
+@receiver(pre_save, sender=Post)
+def remember_previous_values(sender, instance, **kwargs):
+    """Запоминает прежние группу и картинку поста, чтобы сбросить
+    счётчик группы и ссылку на файл."""
+    instance.previous_group_id = None
+    instance.previous_image = ''
+    if instance.pk is not None:
+        previous = Post.objects.filter(
+            pk=instance.pk
+        ).values_list('group_id', 'image').first()
+        if previous is not None:
+            instance.previous_group_id, instance.previous_image = previous
+
+
+@receiver(post_save, sender=User)
+def create_author_stats(sender, instance, created, **kwargs):
+    if created:
+        AuthorStats.objects.get_or_create(user=instance)
+
+
+@receiver(post_save, sender=Post)
+def count_post_on_save(sender, instance, created, **kwargs):
+    previous_group_id = getattr(instance, 'previous_group_id', None)
+    if created:
+        bump_author(instance.author_id, posts_count=1)
+    elif previous_group_id != instance.group_id:
+        bump(Group.objects.filter(pk=previous_group_id), posts_count=-1)
+    else:
+        return
+    bump(Group.objects.filter(pk=instance.group_id), posts_count=1)
+
+
+@receiver(post_delete, sender=Post)
+def count_post_on_delete(sender, instance, **kwargs):
+    bump_author(instance.author_id, posts_count=-1)
+    bump(Group.objects.filter(pk=instance.group_id), posts_count=-1)
+
+
+@receiver(post_save, sender=Post)
+def count_image_refs_on_save(sender, instance, **kwargs):
+    previous_image = getattr(instance, 'previous_image', '')
+    image = instance.image.name or ''
+    if image == previous_image:
+        return
+    if image:
+        blobs.acquire(image)
+    if previous_image:
+        blobs.release(previous_image)
+
+
+@receiver(post_delete, sender=Post)
+def count_image_refs_on_delete(sender, instance, **kwargs):
+    if instance.image:
+        blobs.release(instance.image.name)
+
+
+@receiver(post_save, sender=Comment)
+def count_comment_on_save(sender, instance, created, **kwargs):
+    if created:
+        bump(Post.objects.filter(pk=instance.post_id), comments_count=1)
+
+
+@receiver(post_delete, sender=Comment)
+def count_comment_on_delete(sender, instance, **kwargs):
+    if instance.post_id in deleting_post_ids():
+        return
+    bump(Post.objects.filter(pk=instance.post_id), comments_count=-1)
+
+
+@receiver(post_save, sender=Follow)
+def count_follow_on_save(sender, instance, created, **kwargs):
+    if created:
+        bump_author(instance.author_id, followers_count=1)
+        bump_author(instance.user_id, following_count=1)
+
+
+@receiver(post_delete, sender=Follow)
+def count_follow_on_delete(sender, instance, **kwargs):
+    bump_author(instance.author_id, followers_count=-1)
+    bump_author(instance.user_id, following_count=-1)
+    if timeline.needs_catch_up(instance.author_id):
+        run_after_commit(timeline.catch_up, instance.author_id)
+
+
+@receiver(post_save, sender=Post)
+def reset_counts_on_post_save(sender, instance, created, **kwargs):
+    if created:
+        reset_post_counts(instance)
+        return
+    previous_group_id = getattr(instance, 'previous_group_id', None)
+    if previous_group_id != instance.group_id:
+        cache.delete_many([
+            feed_count_key('group', previous_group_id),
+            feed_count_key('group', instance.group_id),
+        ])
+
+
+@receiver(post_delete, sender=Post)
+def reset_counts_on_post_delete(sender, instance, **kwargs):
+    reset_post_counts(instance)
+
+
+def reset_post_counts(post):
+    """Сбрасывает кэш числа записей всех лент, где виден пост.
+
+    Ленты подписок сбрасывают фоновые задачи (timeline.fan_out
+    и touch_followers): подписчиков может быть слишком много.
+    """
+    cache.delete_many([
+        feed_count_key('index'),
+        feed_count_key('group', post.group_id),
+        feed_count_key('profile', post.author_id),
+    ])
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def update_follow_graph(sender, instance, **kwargs):
+    follow_graph.forget(instance.user_id)
+    transaction.on_commit(lambda: follow_graph.refresh(instance.user_id))
+
+
+@receiver(post_save, sender=Post)
+def fan_out_post(sender, instance, created, **kwargs):
+    if created:
+        run_after_commit(timeline.fan_out, instance.pk)
+
+
+@receiver(post_save, sender=Follow)
+def backfill_timeline(sender, instance, created, **kwargs):
+    if created:
+        run_after_commit(
+            timeline.backfill, instance.user_id, instance.author_id
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def prune_timeline(sender, instance, **kwargs):
+    timeline.prune(instance.user_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Post)
+def touch_follow_feeds(sender, instance, **kwargs):
+    run_after_commit(timeline.touch_followers, instance.author_id)
+
+
+# Версии кэша сбрасываются последними, когда счётчики уже обновлены:
+# иначе под новой версией мог бы закэшироваться старый счётчик.
+@receiver(post_save, sender=Post)
+def bump_post_versions_on_save(sender, instance, **kwargs):
+    bump_versions(*post_scopes(
+        instance, getattr(instance, 'previous_group_id', None)
+    ))
+
+
+@receiver(post_delete, sender=Post)
+def bump_post_versions_on_delete(sender, instance, **kwargs):
+    bump_versions(*post_scopes(instance))
+
+
+@receiver((post_save, post_delete), sender=Comment)
+def bump_comment_versions(sender, instance, **kwargs):
+    if instance.post_id in deleting_post_ids():
+        return
+    bump_versions(*comment_scopes(instance))
+
+
+def comment_scopes(comment):
+    """Области кэша поста комментария.
+
+    Пост, уже загруженный вместе с комментарием (как в add_comment),
+    не читается заново; иначе читаются только автор и группа.
+    """
+    post = Comment._meta.get_field('post').get_cached_value(comment, None)
+    if post is None:
+        row = Post.objects.filter(pk=comment.post_id).values(
+            'author_id', 'group_id'
+        ).first()
+        if row is None:
+            return [f'post:{comment.post_id}']
+        post = Post(pk=comment.post_id, **row)
+    return post_scopes(post)
+
+
+@receiver((post_save, post_delete), sender=Follow)
+def bump_follow_version(sender, instance, **kwargs):
+    bump_versions(
+        f'follow:{instance.user_id}', f'followers:{instance.author_id}'
+    )
+
+
+@receiver(post_delete, sender=User)
+def bump_user_versions(sender, instance, **kwargs):
+    # Имя удалённого пользователя может занять новый: его страницы
+    # не должны достаться из кэша.
+    bump_versions(f'profile:{instance.pk}', f'follow:{instance.pk}',
+                  f'followers:{instance.pk}')
+
+
+# Поля, которые видны на страницах постов, профилей и в лентах.
+USER_DISPLAY_FIELDS = ('username', 'first_name', 'last_name')
+GROUP_DISPLAY_FIELDS = ('title', 'slug')
+
+
+def display_changed(instance, fields, update_fields):
+    """Изменились ли при сохранении поля fields, видные на страницах."""
+    if instance.pk is None:
+        return False
+    if update_fields is not None and not set(fields) & set(update_fields):
+        return False
+    previous = type(instance).objects.filter(
+        pk=instance.pk
+    ).values_list(*fields).first()
+    return previous is not None and previous != tuple(
+        getattr(instance, field) for field in fields
+    )
+
+
+@receiver(pre_save, sender=User)
+def remember_user_rename(sender, instance, update_fields=None, **kwargs):
+    # Вход пользователя сохраняет только last_login: кэш не трогаем.
+    instance.display_changed = display_changed(
+        instance, USER_DISPLAY_FIELDS, update_fields
+    )
+
+
+@receiver(post_save, sender=User)
+def bump_user_versions_on_rename(sender, instance, created, **kwargs):
+    if created or not getattr(instance, 'display_changed', False):
+        return
+    # Имя автора показано в лентах, в его профиле и постах (post_etag
+    # включает profile:<id>) и в комментариях под чужими постами.
+    group_ids = Post.objects.filter(
+        author=instance, group__isnull=False
+    ).order_by().values_list('group_id', flat=True).distinct()
+    commented = Comment.objects.filter(
+        author=instance
+    ).order_by().values_list('post_id', flat=True).distinct()
+    bump_versions(
+        'index', f'profile:{instance.pk}',
+        *(f'group:{group_id}' for group_id in group_ids),
+        *(f'post:{post_id}' for post_id in commented)
+    )
+
+
+def group_author_ids(group_id):
+    return Post.objects.filter(
+        group_id=group_id
+    ).order_by().values_list('author_id', flat=True).distinct()
+
+
+def bump_profiles(author_ids):
+    """Сбрасывает профили авторов: там видны названия групп их постов."""
+    for author_id in author_ids:
+        bump_versions(f'profile:{author_id}')
+
+
+def bump_group_profiles(group_id):
+    bump_profiles(group_author_ids(group_id).iterator())
+
+
+@receiver(pre_save, sender=Group)
+def remember_group_rename(sender, instance, update_fields=None, **kwargs):
+    instance.display_changed = display_changed(
+        instance, GROUP_DISPLAY_FIELDS, update_fields
+    )
+
+
+# Страницы постов группы сбрасывает group:<id>: он входит в post_etag.
+@receiver(post_save, sender=Group)
+def bump_group_versions(sender, instance, **kwargs):
+    bump_versions('index', f'group:{instance.pk}')
+    if getattr(instance, 'display_changed', False):
+        run_after_commit(bump_group_profiles, instance.pk)
+
+
+@receiver(pre_delete, sender=Group)
+def bump_group_versions_on_delete(sender, instance, **kwargs):
+    bump_versions('index', f'group:{instance.pk}')
+    # После коммита посты уже отвязаны от группы (SET_NULL), поэтому
+    # авторов нужно запомнить до удаления.
+    run_after_commit(bump_profiles, list(group_author_ids(instance.pk)))
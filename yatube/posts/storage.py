@@ -0,0 +1,68 @@
+"""Хранилище картинок постов по содержимому.
+
+Файл сохраняется под именем из SHA-256 своего содержимого, поэтому
+одна и та же картинка, загруженная много раз, лежит на диске один раз.
+Миниатюры sorl называются по имени исходного файла, то есть тоже по его
+хэшу, и для одинаковых картинок создаются один раз. Сколько постов
+ссылается на файл, считает posts.blobs.
+"""
+import hashlib
+import os
+import tempfile
+
+from django.core.files.storage import FileSystemStorage
+from django.utils.deconstruct import deconstructible
+
+
+def file_digest(content):
+    """SHA-256 содержимого файла.
+
+    Загрузки, принятые LimitedUploadHandler, уже посчитаны при приёме;
+    остальные файлы читаются по кускам.
+    """
+    digest = getattr(content, 'sha256', None)
+    if digest is not None:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in content.chunks():
+        hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def blob_name(name, digest):
+    """posts/картинка.JPG -> posts/ab/ab…(64 символа).jpg"""
+    directory = os.path.dirname(name)
+    extension = os.path.splitext(name)[1].lower()
+    return os.path.join(directory, digest[:2], digest + extension)
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Файловое хранилище, где имя файла — хэш его содержимого."""
+
+    def get_available_name(self, name, max_length=None):
+        # Одинаковое имя означает одинаковое содержимое: суффиксы
+        # для «занятых» имён не нужны.
+        return name
+
+    def _save(self, name, content):
+        name = blob_name(name, file_digest(content))
+        path = self.path(name)
+        if os.path.exists(path):
+            # Повторная загрузка продлевает жизнь файла: сборщик
+            # не удалит его, пока новая ссылка на него не записана.
+            os.utime(path)
+            return name
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        # Пишем во временный файл и переименовываем: читатели
+        # не увидят недописанный файл, а одновременная запись
+        # того же содержимого безопасна.
+        with tempfile.NamedTemporaryFile(
+            dir=directory, prefix='.upload-', delete=False
+        ) as temporary:
+            for chunk in content.chunks():
+                temporary.write(chunk)
+        os.chmod(temporary.name, self.file_permissions_mode or 0o644)
+        os.replace(temporary.name, path)
+        return name
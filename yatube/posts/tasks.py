@@ -0,0 +1,47 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import connections, transaction
+
+from core import metrics
+
+logger = logging.getLogger(__name__)
+
+executor = ThreadPoolExecutor(
+    max_workers=settings.BACKGROUND_WORKERS,
+    thread_name_prefix='yatube-background'
+)
+
+
+def run_after_commit(func, *args):
+    """Выполняет func(*args) в фоновом потоке после коммита транзакции.
+
+    При BACKGROUND_TASKS_EAGER задача выполняется сразу в текущем потоке.
+    """
+    if settings.BACKGROUND_TASKS_EAGER:
+        func(*args)
+        return
+    transaction.on_commit(lambda: _submit(func, *args))
+
+
+def _submit(func, *args):
+    # Глубина очереди — разность счётчиков: так она складывается
+    # по всем процессам, в отличие от размера очереди одного executor.
+    metrics.registry.inc(
+        'yatube_background_tasks_queued_total', task=func.__name__
+    )
+    executor.submit(_run, func, *args)
+
+
+def _run(func, *args):
+    try:
+        func(*args)
+    except Exception:
+        logger.exception('Фоновая задача %s завершилась ошибкой',
+                         func.__name__)
+    finally:
+        connections.close_all()
+        metrics.registry.inc(
+            'yatube_background_tasks_done_total', task=func.__name__
+        )
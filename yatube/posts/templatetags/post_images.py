@@ -0,0 +1,18 @@
+from django import template
+from django.conf import settings
+
+from ..thumbnails import ready_picture, thumbnail_size
+
+register = template.Library()
+
+
+@register.simple_tag
+def post_picture(post, name):
+    """Миниатюры для <picture> или None, пока они создаются."""
+    return ready_picture(post, name)
+
+
+@register.simple_tag
+def post_picture_size(post, name):
+    """Ширина и высота миниатюры img для заглушки, пока её нет."""
+    return thumbnail_size(post, settings.POST_PICTURES[name]['img'])
@@ -1,13 +1,24 @@
+import hashlib
+import os
 import shutil
+import time
 import tempfile
+from io import BytesIO, StringIO
+from unittest import mock
 
 from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import Client, TestCase, override_settings
 from django.urls import reverse
 from django.conf import settings
+from PIL import Image
 
-from ..models import Group, Post, Comment
+from ..models import Group, MediaBlob, Post, Comment
+from ..thumbnails import backend, thumbnail_options
 
 User = get_user_model()
 
@@ -31,6 +42,7 @@ class TaskCreateFormTests(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -175,6 +187,7 @@ class ImagionFormTests(TestCase):
         shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -206,7 +219,8 @@ class ImagionFormTests(TestCase):
             'username': self.user.username}))
         self.assertEqual(Post.objects.count(), posts_count + 1)
         first_post = Post.objects.first()
-        self.assertEqual(first_post.image, 'posts/picture.gif')
+        digest = hashlib.sha256(self.picture).hexdigest()
+        self.assertEqual(first_post.image, f'posts/{digest[:2]}/{digest}.gif')
         self.assertEqual(first_post.author, self.post.author)
         self.assertEqual(first_post.group, self.post.group)
 
@@ -249,3 +263,265 @@ class ImagionFormTests(TestCase):
         self.assertEqual(test_posts.image, self.post.image)
         test_object = response.context['posts']
         self.check_post(test_object)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_upload_pregenerates_thumbnails(self):
+        """ Миниатюры создаются сразу после загрузки картинки. """
+        uploaded = SimpleUploadedFile(
+            name='thumb.gif',
+            content=self.picture,
+            content_type='image/gif')
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'С миниатюрой', 'image': uploaded})
+        post = Post.objects.get(text='С миниатюрой')
+        geometry, options = thumbnail_options('card')
+        thumbnail = backend.get_ready_thumbnail(
+            post.image.name, geometry, **options
+        )
+        self.assertIsNotNone(thumbnail)
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, thumbnail.url)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_feed_renders_picture_with_variants(self):
+        """ Лента отдаёт <picture> с вариантами WebP и JPEG разной ширины. """
+        self.authorized_client.post(
+            reverse('posts:post_create'),
+            data={'text': 'С вариантами', 'image': SimpleUploadedFile(
+                name='variants.gif',
+                content=self.picture,
+                content_type='image/gif')})
+        post = Post.objects.get(text='С вариантами')
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, '<source type="image/webp"')
+        self.assertContains(response, '<source type="image/jpeg"')
+        for alias in ('card_480_webp', 'card_720', 'card'):
+            with self.subTest(alias=alias):
+                geometry, options = thumbnail_options(alias)
+                thumbnail = backend.get_ready_thumbnail(
+                    post.image.name, geometry, **options
+                )
+                self.assertContains(
+                    response, f'{thumbnail.url} {thumbnail.width}w'
+                )
+
+    def test_feed_shows_placeholder_until_thumbnail_ready(self):
+        """ Пока миниатюры нет, лента показывает заглушку. """
+        Post.objects.create(
+            text='Без миниатюры',
+            author=self.user,
+            image=SimpleUploadedFile(
+                name='pending.gif',
+                content=self.picture,
+                content_type='image/gif')
+        )
+        response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'aspect-ratio: 960 / 339')
+        self.assertNotContains(response, '<img class="card-img')
+
+    def test_placeholder_follows_image_size(self):
+        """ Пропорции заглушки — как у будущей миниатюры исходника. """
+        Post.objects.create(
+            text='Маленькая', author=self.user, image='posts/small.gif',
+            image_width=300, image_height=200
+        )
+        thumbnails = {
+            **settings.POST_THUMBNAILS,
+            'card': ('960x339', {'crop': 'center', 'upscale': False}),
+        }
+        with self.settings(POST_THUMBNAILS=thumbnails):
+            response = self.guest_client.get(reverse('posts:index'))
+        self.assertContains(response, 'aspect-ratio: 300 / 200')
+
+    def test_feed_thumbnails_prefetched_in_one_query(self):
+        """ Миниатюры страницы ищутся одним запросом, а не на каждый пост. """
+        Post.objects.bulk_create(
+            Post(text=f'Пост {number}', author=self.user,
+                 image=f'posts/picture_{number}.gif')
+            for number in range(settings.POSTS_PER_PAGE)
+        )
+        with self.assertNumQueries(4):
+            self.guest_client.get(reverse('posts:index'))
+
+
+def jpeg_with_orientation(width, height, orientation):
+    image = Image.new('RGB', (width, height), 'red')
+    exif = Image.Exif()
+    exif[0x0112] = orientation
+    buffer = BytesIO()
+    image.save(buffer, 'JPEG', exif=exif.tobytes())
+    return buffer.getvalue()
+
+
+@override_settings(MEDIA_ROOT=TEMP_MEDIA_ROOT)
+class UploadPipelineTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='uploader')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+
+    def create(self, name, content):
+        return self.authorized_client.post(reverse('posts:post_create'), {
+            'text': name,
+            'image': SimpleUploadedFile(name, content, 'image/jpeg'),
+        })
+
+    @override_settings(IMAGE_UPLOAD_MAX_BYTES=100)
+    def test_upload_over_byte_limit_rejected(self):
+        """ Файл больше лимита отбрасывается при приёме с ошибкой формы. """
+        response = self.create('big.jpg', jpeg_with_orientation(64, 64, 1))
+        self.assertFormError(
+            response, 'form', 'image', 'Файл больше 100 байт.'
+        )
+        self.assertFalse(Post.objects.filter(text='big.jpg').exists())
+
+    @override_settings(IMAGE_MAX_PIXELS=100)
+    def test_upload_over_pixel_limit_rejected(self):
+        """ Картинка больше лимита пикселей не принимается. """
+        response = self.create('wide.jpg', jpeg_with_orientation(20, 10, 1))
+        self.assertFormError(
+            response, 'form', 'image', 'Картинка больше 100 пикселей.'
+        )
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_upload_rotated_and_reencoded(self):
+        """ Картинка поворачивается по EXIF и сохраняется без метаданных. """
+        self.create('rotated.jpg', jpeg_with_orientation(20, 10, 6))
+        post = Post.objects.get(text='rotated.jpg')
+        self.assertNotEqual(post.image.name, 'posts/rotated.jpg')
+        with Image.open(post.image.path) as image:
+            self.assertEqual(image.size, (10, 20))
+            self.assertNotIn('exif', image.info)
+        geometry, options = thumbnail_options('card')
+        self.assertIsNotNone(backend.get_ready_thumbnail(
+            post.image.name, geometry, **options
+        ))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_upload_stores_image_metadata(self):
+        """ После загрузки у поста есть размеры, байты, цвет и заглушка. """
+        self.create('meta.jpg', jpeg_with_orientation(40, 30, 1))
+        post = Post.objects.get(text='meta.jpg')
+        self.assertEqual((post.image_width, post.image_height), (40, 30))
+        self.assertEqual(post.image_size, post.image.size)
+        self.assertRegex(post.image_color, r'^#[0-9a-f]{6}$')
+        self.assertTrue(
+            post.image_placeholder.startswith('data:image/jpeg;base64,')
+        )
+
+    def test_feed_does_not_open_original_image(self):
+        """ Лента рендерится без чтения исходных файлов картинок. """
+        Post.objects.create(
+            text='Заглушка', author=self.user, image='posts/absent.jpg',
+            image_color='#102030', image_placeholder='data:image/jpeg;base64,'
+        )
+        with mock.patch.object(
+            default_storage, 'open', side_effect=AssertionError
+        ):
+            response = self.authorized_client.get(reverse('posts:index'))
+        self.assertContains(response, 'background: #102030 url(')
+
+    def test_backfill_fills_missing_metadata(self):
+        """ backfill_image_metadata заполняет метаданные старых постов. """
+        post = Post.objects.create(
+            text='Старый пост', author=self.user,
+            image=SimpleUploadedFile(
+                'old.jpg', jpeg_with_orientation(8, 6, 1), 'image/jpeg'
+            )
+        )
+        Post.objects.create(
+            text='Без файла', author=self.user, image='posts/missing.jpg'
+        )
+        out, err = StringIO(), StringIO()
+        call_command(
+            'backfill_image_metadata', workers=1, stdout=out, stderr=err
+        )
+        post.refresh_from_db()
+        self.assertEqual((post.image_width, post.image_height), (8, 6))
+        self.assertIn('Готово: 1, ошибок: 1.', out.getvalue())
+        self.assertIn('posts/missing.jpg', err.getvalue())
+
+
+@override_settings(
+    MEDIA_ROOT=TEMP_MEDIA_ROOT, BACKGROUND_TASKS_EAGER=True,
+    MEDIA_BLOB_GRACE=0
+)
+class MediaBlobTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.user = User.objects.create_user(username='sharer')
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(TEMP_MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        self.authorized_client = Client()
+        self.authorized_client.force_login(self.user)
+        content = jpeg_with_orientation(16, 12, 1)
+        for text in ('Первый', 'Второй'):
+            self.authorized_client.post(reverse('posts:post_create'), {
+                'text': text,
+                'image': SimpleUploadedFile('meme.jpg', content, 'image/jpeg'),
+            })
+        self.first = Post.objects.get(text='Первый')
+        self.second = Post.objects.get(text='Второй')
+
+    def card(self, post):
+        geometry, options = thumbnail_options('card')
+        return backend.get_ready_thumbnail(
+            post.image.name, geometry, **options
+        )
+
+    def test_same_upload_stored_once(self):
+        """ Одинаковые картинки хранятся одним файлом с общими миниатюрами. """
+        self.assertEqual(self.first.image.name, self.second.image.name)
+        self.assertEqual(
+            MediaBlob.objects.get(name=self.first.image.name).refs, 2
+        )
+        self.assertEqual(
+            len(os.listdir(os.path.dirname(self.first.image.path))), 1
+        )
+        self.assertEqual(self.card(self.first).name,
+                         self.card(self.second).name)
+
+    def test_shared_file_removed_with_last_post(self):
+        """ Файл удаляется вместе с последним ссылающимся постом. """
+        path = self.first.image.path
+        thumbnail = self.card(self.first)
+        self.first.delete()
+        self.assertTrue(os.path.exists(path))
+        self.assertTrue(default_storage.exists(thumbnail.name))
+        self.second.delete()
+        self.assertFalse(os.path.exists(path))
+        self.assertFalse(default_storage.exists(thumbnail.name))
+        self.assertFalse(MediaBlob.objects.exists())
+
+    @override_settings(MEDIA_BLOB_GRACE=60)
+    def test_collect_media_removes_old_orphans(self):
+        """ collect_media удаляет старые файлы без ссылок. """
+        storage = self.first.image.storage
+        orphan = storage.save('posts/orphan.jpg', ContentFile(b'orphan'))
+        call_command('collect_media', stdout=StringIO())
+        self.assertTrue(storage.exists(orphan))
+        past = time.time() - 120
+        os.utime(storage.path(orphan), (past, past))
+        out = StringIO()
+        call_command('collect_media', stdout=out)
+        self.assertFalse(storage.exists(orphan))
+        self.assertTrue(storage.exists(self.first.image.name))
+        self.assertIn('файлов удалено: 1.', out.getvalue())
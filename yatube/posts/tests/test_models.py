@@ -1,7 +1,13 @@
+from io import StringIO
+
+from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
 
-from ..models import Group, Post
+from ..counters import repair_counters
+from ..models import AuthorStats, Comment, Follow, Group, Post
 
 User = get_user_model()
 
@@ -33,3 +39,96 @@ class PostModelTest(TestCase):
         for expected_object_name, model in models.items():
             with self.subTest(expected_object_name=expected_object_name):
                 self.assertEqual(expected_object_name, model)
+
+
+class CountersTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='Author')
+        cls.reader = User.objects.create_user(username='Reader')
+        cls.group = Group.objects.create(
+            title='Группа',
+            slug='counters',
+            description='Описание',
+        )
+
+    def stats(self, user):
+        return AuthorStats.objects.get(user=user)
+
+    def test_counters_follow_writes(self):
+        """ Счётчики меняются при создании и удалении записей. """
+        post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост'
+        )
+        Comment.objects.create(post=post, author=self.reader, text='Да')
+        follow = Follow.objects.create(user=self.reader, author=self.author)
+        post.refresh_from_db()
+        self.group.refresh_from_db()
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+        self.assertEqual(self.stats(self.author).followers_count, 1)
+        self.assertEqual(self.stats(self.reader).following_count, 1)
+        self.assertEqual(post.comments_count, 1)
+        self.assertEqual(self.group.posts_count, 1)
+        follow.delete()
+        post.delete()
+        self.group.refresh_from_db()
+        self.assertEqual(self.stats(self.author).posts_count, 0)
+        self.assertEqual(self.stats(self.author).followers_count, 0)
+        self.assertEqual(self.stats(self.reader).following_count, 0)
+        self.assertEqual(self.group.posts_count, 0)
+
+    def test_counters_group_change(self):
+        """ При смене группы счётчик переходит в новую группу. """
+        post = Post.objects.create(
+            author=self.author, group=self.group, text='Пост'
+        )
+        post.group = None
+        post.save()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+
+    def test_repair_counters(self):
+        """ repair_counters исправляет разошедшиеся счётчики. """
+        Post.objects.create(author=self.author, text='Пост')
+        AuthorStats.objects.filter(user=self.author).update(posts_count=42)
+        fixed = repair_counters()
+        self.assertEqual(fixed['AuthorStats.posts_count'], 1)
+        self.assertEqual(self.stats(self.author).posts_count, 1)
+
+    def test_user_delete_with_posts(self):
+        """ Удаление автора не ломается на пересчёте счётчиков. """
+        Post.objects.create(author=self.reader, group=self.group, text='1')
+        self.reader.delete()
+        self.group.refresh_from_db()
+        self.assertEqual(self.group.posts_count, 0)
+
+
+class QueryPlanTest(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        author = User.objects.create_user(username='plans')
+        reader = User.objects.create_user(username='plans_reader')
+        Post.objects.bulk_create(
+            Post(author=author, text=f'Пост {number}')
+            for number in range(settings.POSTS_PER_PAGE + 2)
+        )
+        Follow.objects.create(user=reader, author=author)
+
+    def check_plans(self):
+        posts = Post.objects.count()
+        out = StringIO()
+        call_command('check_query_plans', stdout=out)
+        self.assertIn('Все запросы используют индексы.', out.getvalue())
+        self.assertEqual(Post.objects.count(), posts)
+
+    def test_views_use_indexes(self):
+        """ Запросы всех view обходятся без полных проходов и сортировок. """
+        self.check_plans()
+
+    def test_views_use_indexes_after_analyze(self):
+        """ Проверка проходит и со статистикой ANALYZE. """
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        self.check_plans()
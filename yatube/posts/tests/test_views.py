@@ -1,12 +1,30 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
+from unittest import mock
+
 from django import forms
 from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.test import Client, TestCase
+from django.core.management import call_command
+from django.test import (
+    Client, TestCase, TransactionTestCase, override_settings
+)
 from django.urls import reverse
 from django.core.cache import cache
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 
+from .. import tasks
+from ..follow_graph import following_ids
 from ..forms import PostForm
-from ..models import Group, Post, Comment, Follow
+from ..middleware import page_cache_stats
+from ..models import (
+    AuthorStats, Group, Post, Comment, Follow, TimelineEntry
+)
+from ..timeline import follow_count_key
+from ..utils import FeedPaginator, feed_count_key
 
 User = get_user_model()
 
@@ -44,6 +62,7 @@ class PostViewsTests(TestCase):
         }
 
     def setUp(self):
+        cache.clear()
         self.guest_client = Client()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
@@ -211,13 +230,39 @@ class PostViewsTests(TestCase):
     def test_caching_correct_work(self):
         """ Корректность раболты cache на главной странице. """
         primary_response = self.guest_client.get(reverse('posts:index')).content
-        Post.objects.filter(text=self.post.text).delete()
+        Post.objects.filter(pk=self.post.pk).update(text='Без сигналов')
         response_action = self.guest_client.get(reverse('posts:index')).content
         self.assertEqual(primary_response, response_action)
         cache.clear()
         response_clear_action = self.guest_client.get(reverse('posts:index')).content
         self.assertNotEqual(response_clear_action, primary_response)
 
+    def test_cache_reset_on_post_delete(self):
+        """ Удаление поста сразу сбрасывает кэш лент. """
+        pages = [
+            reverse('posts:index'),
+            reverse('posts:group_lists', kwargs={'slug': self.group.slug}),
+            reverse('posts:profile', kwargs={'username': self.user.username})
+        ]
+        for page in pages:
+            self.guest_client.get(page)
+        Post.objects.filter(pk=self.post.pk).delete()
+        for page in pages:
+            with self.subTest(page=page):
+                response = self.guest_client.get(page)
+                self.assertNotContains(response, self.post.text)
+
+    def test_cache_key_includes_page(self):
+        """ Разные страницы ленты кэшируются под разными ключами. """
+        for number in range(SUM_OF_PAGINATOR_POSTS):
+            Post.objects.create(text=f'Пост {number}', author=self.user)
+        first_page = self.guest_client.get(reverse('posts:index'))
+        second_page = self.guest_client.get(
+            reverse('posts:index'), {'page': 2}
+        )
+        self.assertNotEqual(first_page.content, second_page.content)
+        self.assertContains(second_page, self.post.text)
+
 
 class PiginatorViewsTest(TestCase):
     @classmethod
@@ -237,6 +282,7 @@ class PiginatorViewsTest(TestCase):
             )
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
 
@@ -271,7 +317,63 @@ class PiginatorViewsTest(TestCase):
                     response.context['page_obj']
                 ), SECOND_PAGE_PAGINATOR_POSTS)
 
+    def test_paginator_cursor_pages(self):
+        """ Курсоры ведут на соседние страницы без OFFSET. """
+        url = reverse('posts:index')
+        first_page = self.authorized_client.get(url).context['page_obj']
+        self.assertFalse(first_page.has_previous())
+        self.assertTrue(first_page.has_next())
+        second_page = self.authorized_client.get(
+            url, {'cursor': first_page.next_cursor}
+        ).context['page_obj']
+        self.assertEqual(len(second_page), SECOND_PAGE_PAGINATOR_POSTS)
+        self.assertFalse(second_page.has_next())
+        self.assertTrue(second_page.has_previous())
+        self.assertEqual(
+            list(Post.objects.order_by('-pub_date', '-pk')),
+            list(first_page) + list(second_page)
+        )
+        back_page = self.authorized_client.get(
+            url, {'cursor': second_page.previous_cursor}
+        ).context['page_obj']
+        self.assertEqual(list(back_page), list(first_page))
+        self.assertFalse(back_page.has_previous())
+
+    def test_paginator_count_cached_and_reset(self):
+        """ Число записей ленты кэшируется и сбрасывается при записи. """
+        cache.clear()
+        key = feed_count_key('group', self.group.pk)
+        self.authorized_client.get(
+            reverse('posts:group_lists', kwargs={'slug': self.group.slug}),
+            {'page': 1}
+        )
+        self.assertEqual(cache.get(key), SUM_OF_PAGINATOR_POSTS)
+        Post.objects.create(author=self.user, group=self.group, text='Ещё')
+        self.assertIsNone(cache.get(key))
+
+    def test_paginator_page_window(self):
+        """ Паджинатор выводит окно страниц, а не все номера. """
+        paginator = FeedPaginator(list(range(1000)), 10)
+        self.assertEqual(
+            list(paginator.get_elided_page_range(50)),
+            [1, 2, paginator.ELLIPSIS, 47, 48, 49, 50, 51, 52, 53,
+             paginator.ELLIPSIS, 99, 100]
+        )
+        self.assertEqual(
+            list(paginator.get_elided_page_range(2)),
+            [1, 2, 3, 4, 5, paginator.ELLIPSIS, 99, 100]
+        )
+
+    def test_paginator_broken_cursor(self):
+        """ Битый курсор открывает первую страницу. """
+        response = self.authorized_client.get(
+            reverse('posts:index'), {'cursor': 'не-курсор'}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.context['page_obj'].number, 1)
+
 
+@override_settings(BACKGROUND_TASKS_EAGER=True)
 class FollowTests(TestCase):
     @classmethod
     def setUpClass(cls):
@@ -284,6 +386,7 @@ class FollowTests(TestCase):
         )
 
     def setUp(self):
+        cache.clear()
         self.authorized_client = Client()
         self.authorized_client.force_login(self.user)
         self.follower_client = Client()
@@ -315,3 +418,732 @@ class FollowTests(TestCase):
         self.assertEqual(test_page, self.post.text)
         response = self.authorized_client.get(reverse('posts:follow_index'))
         self.assertNotContains(response, self.post.text)
+
+    def test_timeline_fan_out_and_prune(self):
+        """ Новый пост раскладывается по лентам подписчиков,
+        а после отписки посты автора убираются из ленты. """
+        Follow.objects.create(user=self.follower, author=self.user)
+        new_post = Post.objects.create(text='Свежий пост', author=self.user)
+        self.assertTrue(TimelineEntry.objects.filter(
+            user=self.follower, post=new_post).exists())
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(
+            list(response.context['page_obj']), [new_post, self.post]
+        )
+        self.follower_client.get(reverse('posts:profile_unfollow',
+                                         kwargs={'username': self.user}))
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.follower).exists()
+        )
+
+    def test_follow_count_key_reads_one_version(self):
+        """ Ключ числа записей не зависит от числа подписок. """
+        authors = [
+            User.objects.create_user(username=f'many_{number}')
+            for number in range(5)
+        ]
+        Follow.objects.bulk_create(
+            Follow(user=self.follower, author=author) for author in authors
+        )
+        follower = User.objects.get(pk=self.follower.pk)
+        cache.clear()
+        with mock.patch.multiple(
+            'posts.caching.cache', get_many=mock.DEFAULT,
+            set_many=mock.DEFAULT, add=mock.DEFAULT
+        ) as calls:
+            calls['get_many'].return_value = {}
+            with self.assertNumQueries(0):
+                follow_count_key(follower)
+        self.assertEqual(len(calls['get_many'].call_args[0][0]), 1)
+        calls['set_many'].assert_called_once()
+        calls['add'].assert_not_called()
+
+    def test_follow_count_reset_by_new_and_deleted_posts(self):
+        """ Новый и удалённый пост сбрасывают число записей ленты
+        подписчика, и у раскладываемого, и у подмешиваемого автора. """
+        Follow.objects.create(user=self.follower, author=self.user)
+        url = reverse('posts:follow_index')
+        for limit in (10, 0):
+            with self.subTest(limit=limit), self.settings(
+                TIMELINE_FANOUT_LIMIT=limit
+            ):
+                count = self.follower_client.get(
+                    url, {'page': 1}
+                ).context['page_obj'].paginator.count
+                post = Post.objects.create(text='Ещё пост', author=self.user)
+                response = self.follower_client.get(url, {'page': 1})
+                self.assertEqual(
+                    response.context['page_obj'].paginator.count, count + 1
+                )
+                Post.objects.filter(pk=post.pk).delete()
+                response = self.follower_client.get(url, {'page': 1})
+                self.assertEqual(
+                    response.context['page_obj'].paginator.count, count
+                )
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=0)
+    def test_timeline_pull_for_popular_authors(self):
+        """ Посты популярных авторов подмешиваются в ленту при чтении. """
+        Follow.objects.create(user=self.follower, author=self.user)
+        self.assertFalse(TimelineEntry.objects.exists())
+        response = self.follower_client.get(reverse('posts:follow_index'))
+        self.assertEqual(list(response.context['page_obj']), [self.post])
+
+    @override_settings(TIMELINE_FANOUT_LIMIT=1)
+    def test_timeline_catch_up_after_author_loses_followers(self):
+        """ Посты, опубликованные, пока автор был популярным, остаются
+        в ленте, когда подписчиков снова не больше лимита. """
+        other = User.objects.create_user(username='other_follower')
+        Follow.objects.create(user=other, author=self.user)
+        Follow.objects.create(user=self.follower, author=self.user)
+        popular_post = Post.objects.create(text='Пока популярен',
+                                           author=self.user)
+        self.assertFalse(
+            TimelineEntry.objects.filter(user=self.follower).exists()
+        )
+        url = reverse('posts:follow_index')
+        response = self.follower_client.get(url)
+        self.assertEqual(
+            list(response.context['page_obj']), [popular_post, self.post]
+        )
+        Follow.objects.filter(user=other).delete()
+        self.assertEqual(set(TimelineEntry.objects.filter(
+            user=self.follower
+        ).values_list('post_id', flat=True)), {popular_post.pk, self.post.pk})
+        self.assertFalse(
+            AuthorStats.objects.get(user=self.user).timeline_pending
+        )
+        response = self.follower_client.get(url)
+        self.assertEqual(
+            list(response.context['page_obj']), [popular_post, self.post]
+        )
+
+
+@override_settings(BACKGROUND_TASKS_EAGER=False)
+class TimelineTaskTests(TransactionTestCase):
+    """ Раскладка в фоновом потоке, как в работе, а не при записи. """
+
+    def setUp(self):
+        cache.clear()
+        self.author = User.objects.create_user(username='async_author')
+        self.reader = User.objects.create_user(username='async_reader')
+        with self.delayed_tasks():
+            Post.objects.create(text='Старый пост', author=self.author)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    @contextmanager
+    def delayed_tasks(self):
+        """Задачи после коммита ждут в очереди до выхода из блока."""
+        gate = threading.Event()
+        executor = ThreadPoolExecutor(max_workers=1)
+        executor.submit(gate.wait)
+        with mock.patch.object(tasks, 'executor', executor):
+            try:
+                yield
+            finally:
+                gate.set()
+                executor.shutdown(wait=True)
+
+    def test_follow_feed_refreshed_after_tasks(self):
+        """ Лента, закэшированная до раскладки, обновляется после неё. """
+        url = reverse('posts:follow_index')
+        with self.delayed_tasks():
+            self.reader_client.get(reverse(
+                'posts:profile_follow',
+                kwargs={'username': self.author.username}
+            ))
+            self.assertNotContains(self.reader_client.get(url), 'Старый пост')
+        self.assertContains(self.reader_client.get(url), 'Старый пост')
+        with self.delayed_tasks():
+            Post.objects.create(text='Новый пост', author=self.author)
+            response = self.reader_client.get(url, {'page': 1})
+            self.assertNotContains(response, 'Новый пост')
+        response = self.reader_client.get(url, {'page': 1})
+        self.assertContains(response, 'Новый пост')
+        self.assertEqual(response.context['page_obj'].paginator.count, 2)
+
+
+class FollowGraphTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.reader = User.objects.create_user(username='graph_reader')
+        cls.authors = [
+            User.objects.create_user(username=f'graph_author_{number}')
+            for number in range(5)
+        ]
+        for author in cls.authors[:2]:
+            Follow.objects.create(user=cls.reader, author=author)
+
+    def setUp(self):
+        cache.clear()
+        # Множество запоминается на объекте, а объект класса общий.
+        self.reader = User.objects.get(pk=self.reader.pk)
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_following_ids_loaded_once(self):
+        """ Подписки читаются одним запросом, дальше — из кэша. """
+        ids = {author.pk for author in self.authors[:2]}
+        with self.assertNumQueries(1):
+            self.assertEqual(following_ids(self.reader), ids)
+        reader = User.objects.get(pk=self.reader.pk)
+        with self.assertNumQueries(0):
+            self.assertEqual(following_ids(reader), ids)
+
+    def test_follow_and_unfollow_update_graph(self):
+        """ Подписка и отписка сразу видны в множестве подписок. """
+        author = self.authors[2]
+        following_ids(self.reader)
+        self.reader_client.get(reverse(
+            'posts:profile_follow', kwargs={'username': author.username}
+        ))
+        reader = User.objects.get(pk=self.reader.pk)
+        self.assertIn(author.pk, following_ids(reader))
+        response = self.reader_client.get(reverse(
+            'posts:profile', kwargs={'username': author.username}
+        ))
+        self.assertTrue(response.context['following'])
+        self.reader_client.get(reverse(
+            'posts:profile_unfollow', kwargs={'username': author.username}
+        ))
+        reader = User.objects.get(pk=self.reader.pk)
+        self.assertNotIn(author.pk, following_ids(reader))
+
+
+class QueryBudgetTests(TestCase):
+    """ Число запросов ленты не зависит от числа постов на странице. """
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(
+            username='budget', first_name='Имя', last_name='Фамилия'
+        )
+        cls.reader = User.objects.create_user(username='reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='budget', description='Описание'
+        )
+        Follow.objects.create(user=cls.reader, author=cls.author)
+        for number in range(SUM_OF_PAGINATOR_POSTS):
+            author = User.objects.create_user(username=f'author_{number}')
+            cls.post = Post.objects.create(
+                author=cls.author if number % 2 else author,
+                group=Group.objects.create(
+                    title=f'Группа {number}', slug=f'group-{number}',
+                    description='Описание'
+                ) if number % 3 else cls.group,
+                text=f'Пост {number}'
+            )
+            Comment.objects.create(
+                post=cls.post, author=author, text='Комментарий'
+            )
+        for post in Post.objects.filter(author=cls.author):
+            TimelineEntry.objects.create(
+                user=cls.reader, post=post, pub_date=post.pub_date
+            )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def test_feed_query_budget(self):
+        """ Ленты и страница поста укладываются в бюджет запросов. """
+        # Группа, профиль и пост тратят ещё один запрос на ETag,
+        # лента подписок — на множество подписок при холодном кэше.
+        budgets = (
+            (self.guest_client, reverse('posts:index'), 3),
+            (self.guest_client, reverse('posts:index') + '?page=2', 3),
+            (self.guest_client, reverse(
+                'posts:group_lists', kwargs={'slug': self.group.slug}), 3),
+            (self.guest_client, reverse(
+                'posts:profile', kwargs={'username': self.author}), 3),
+            (self.guest_client, reverse(
+                'posts:post_detail', kwargs={'post_id': self.post.pk}), 3),
+            (self.reader_client, reverse('posts:follow_index'), 4),
+        )
+        for client, url, budget in budgets:
+            cache.clear()
+            self.reader_client.force_login(self.reader)
+            with self.subTest(url=url):
+                with self.assertNumQueries(budget):
+                    client.get(url)
+
+
+class SearchViewTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='searcher')
+        cls.group = Group.objects.create(
+            title='Путешествия', slug='travel', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group,
+            text='Поездка в горы <b>летом</b>'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def search(self, query, **params):
+        response = self.guest_client.get(
+            reverse('posts:search'), {'q': query, **params}
+        )
+        return response, list(response.context['page_obj'])
+
+    def test_search_finds_text_group_and_author(self):
+        """ Поиск находит пост по тексту, группе, автору и префиксу. """
+        for query in ('горы', 'путешествия', 'searcher', 'поезд'):
+            with self.subTest(query=query):
+                _, found = self.search(query)
+                self.assertEqual(found, [self.post])
+
+    def test_search_ranks_and_highlights(self):
+        """ Выдача отсортирована по bm25, совпадения подсвечены. """
+        best = Post.objects.create(
+            author=self.author, text='горы, горы и снова горы'
+        )
+        response, found = self.search('горы')
+        self.assertEqual(found, [best, self.post])
+        self.assertContains(response, '<mark>горы</mark>')
+        self.assertContains(response, '&lt;b&gt;летом&lt;/b&gt;')
+
+    def test_search_count(self):
+        """ count() найденных постов работает и с рангом в запросе. """
+        Post.objects.create(author=self.author, text='Снова горы')
+        found = Post.objects.search('горы').order_by('rank')
+        self.assertEqual(found.count(), 2)
+        self.assertEqual(found.filter(group=self.group).count(), 1)
+        self.assertEqual(Post.objects.search('').count(), 0)
+
+    def test_search_index_follows_changes(self):
+        """ Индекс обновляется при правке, переименовании и удалении. """
+        Post.objects.filter(pk=self.post.pk).update(text='Поездка к морю')
+        self.assertEqual(self.search('горы')[1], [])
+        self.assertEqual(self.search('морю')[1], [self.post])
+        Group.objects.filter(pk=self.group.pk).update(title='Отпуск')
+        self.assertEqual(self.search('отпуск')[1], [self.post])
+        Post.objects.filter(pk=self.post.pk).delete()
+        self.assertEqual(self.search('морю')[1], [])
+
+    def test_search_paginates_with_cursor(self):
+        """ Страницы выдачи листаются курсором и сохраняют запрос. """
+        Post.objects.bulk_create(
+            Post(author=self.author, text=f'горы {number}')
+            for number in range(SUM_OF_PAGINATOR_POSTS)
+        )
+        response, first = self.search('горы')
+        self.assertEqual(len(first), settings.POSTS_PER_PAGE)
+        page_obj = response.context['page_obj']
+        self.assertContains(response, f'?q=%D0%B3%D0%BE%D1%80%D1%8B&amp;'
+                                      f'cursor={page_obj.next_cursor}')
+        _, second = self.search('горы', cursor=page_obj.next_cursor)
+        self.assertEqual(
+            len(second), SUM_OF_PAGINATOR_POSTS + 1 - settings.POSTS_PER_PAGE
+        )
+        self.assertFalse(set(first) & set(second))
+
+    def test_empty_and_operator_queries(self):
+        """ Пустой запрос и операторы FTS5 не ломают поиск. """
+        for query in ('', '   ', '"', 'горы OR', 'NEAR(горы'):
+            with self.subTest(query=query):
+                response, _ = self.search(query)
+                self.assertEqual(response.status_code, 200)
+
+    def test_admin_search_uses_index(self):
+        """ Поиск в админке идёт по тому же индексу. """
+        admin = User.objects.create_superuser(
+            'admin', 'admin@example.com', 'password'
+        )
+        self.guest_client.force_login(admin)
+        response = self.guest_client.get(
+            reverse('admin:posts_post_changelist'), {'q': 'путешествия'}
+        )
+        self.assertEqual(list(response.context['cl'].result_list),
+                         [self.post])
+
+
+class CommentPaginationTests(TestCase):
+    COMMENTS = 45
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='commenter')
+        cls.post = Post.objects.create(author=cls.author, text='Пост')
+        Comment.objects.bulk_create(
+            Comment(post=cls.post, author=cls.author, text=f'Комментарий {n}')
+            for n in range(cls.COMMENTS)
+        )
+        cls.comments = list(
+            Comment.objects.filter(post=cls.post).order_by('created', 'pk')
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def test_first_chunk_rendered_with_post(self):
+        """ Страница поста показывает только первую порцию комментариев. """
+        response = self.guest_client.get(
+            reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+        )
+        page = response.context['comments']
+        self.assertEqual(
+            list(page), self.comments[:settings.COMMENTS_PER_PAGE]
+        )
+        self.assertTrue(page.has_next())
+        self.assertContains(response, reverse(
+            'posts:post_comments', kwargs={'post_id': self.post.pk}
+        ) + f'?cursor={page.next_cursor}')
+
+    def test_fragment_endpoint_continues_from_cursor(self):
+        """ Фрагмент по курсору отдаёт следующие порции до конца. """
+        url = reverse('posts:post_comments', kwargs={'post_id': self.post.pk})
+        cursor = None
+        shown = []
+        while True:
+            response = self.guest_client.get(
+                url, {'cursor': cursor} if cursor else {}
+            )
+            page = response.context['comments']
+            shown.extend(page)
+            if not page.has_next():
+                break
+            cursor = page.next_cursor
+        self.assertEqual(shown, self.comments)
+        self.assertNotContains(response, 'Показать ещё')
+
+    def test_json_chunk(self):
+        """ С Accept: application/json порция приходит в JSON. """
+        response = self.guest_client.get(
+            reverse('posts:post_comments', kwargs={'post_id': self.post.pk}),
+            HTTP_ACCEPT='application/json'
+        )
+        data = response.json()
+        self.assertEqual(
+            [comment['id'] for comment in data['comments']],
+            [comment.pk for comment in
+             self.comments[:settings.COMMENTS_PER_PAGE]]
+        )
+        self.assertEqual(data['comments'][0]['author'], 'commenter')
+        self.assertIsNotNone(data['next_cursor'])
+
+    def test_post_detail_query_count_independent_of_comments(self):
+        """ Число запросов не растёт с числом комментариев. """
+        with self.assertNumQueries(3):
+            self.guest_client.get(
+                reverse('posts:post_detail', kwargs={'post_id': self.post.pk})
+            )
+
+    def test_post_delete_cost_independent_of_comments(self):
+        """ Каскадное удаление комментариев не обновляет пост
+        и кэш на каждый комментарий. """
+        lonely = Post.objects.create(author=self.author, text='Один')
+        Comment.objects.create(post=lonely, author=self.author, text='К')
+        with CaptureQueriesContext(connection) as few:
+            Post.objects.filter(pk=lonely.pk).delete()
+        with CaptureQueriesContext(connection) as many:
+            Post.objects.filter(pk=self.post.pk).delete()
+        self.assertEqual(len(many), len(few))
+        self.assertEqual(
+            Post.objects.filter(comments_count__lt=0).count(), 0
+        )
+
+
+class ConditionalGetTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='etag')
+        cls.reader = User.objects.create_user(username='etag_reader')
+        cls.group = Group.objects.create(
+            title='Группа', slug='etag', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост'
+        )
+        cls.urls = {
+            'post': reverse(
+                'posts:post_detail', kwargs={'post_id': cls.post.pk}
+            ),
+            'profile': reverse(
+                'posts:profile', kwargs={'username': cls.author.username}
+            ),
+            'group': reverse(
+                'posts:group_lists', kwargs={'slug': cls.group.slug}
+            ),
+        }
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+        self.reader_client = Client()
+        self.reader_client.force_login(self.reader)
+
+    def revalidate(self, url, client=None):
+        client = client or self.guest_client
+        etag = client.get(url)['ETag']
+        return client.get(url, HTTP_IF_NONE_MATCH=etag)
+
+    def test_unchanged_page_not_modified(self):
+        """ Неизменная страница отдаёт 304 без шаблонов. """
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                # Первый ответ ставит CSRF-cookie, а она входит в ETag.
+                self.reader_client.get(url)
+                etag = self.reader_client.get(url)['ETag']
+                # Пользователь и запрос для ETag, без queryset страницы.
+                with self.assertNumQueries(2):
+                    response = self.reader_client.get(
+                        url, HTTP_IF_NONE_MATCH=etag
+                    )
+                self.assertEqual(response.status_code, 304)
+                self.assertEqual(response.templates, [])
+
+    def test_changes_invalidate_etag(self):
+        """ Запись в области страницы меняет её ETag. """
+        changes = {
+            'post': lambda: Comment.objects.create(
+                post=self.post, author=self.reader, text='Новый'
+            ),
+            'profile': lambda: Follow.objects.create(
+                user=self.reader, author=self.author
+            ),
+            'group': lambda: Post.objects.create(
+                author=self.reader, group=self.group, text='Ещё пост'
+            ),
+        }
+        for name, change in changes.items():
+            with self.subTest(page=name):
+                url = self.urls[name]
+                etag = self.guest_client.get(url)['ETag']
+                change()
+                response = self.guest_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 200)
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_renames_invalidate_etag(self):
+        """ Новые название группы и имя автора или комментатора
+        меняют ETag страниц, где они видны, а вход — нет. """
+        Comment.objects.create(
+            post=self.post, author=self.reader, text='Комментарий'
+        )
+
+        def rename_group():
+            group = Group.objects.get(pk=self.group.pk)
+            group.title = 'Новое название'
+            group.save()
+
+        def rename(user_id):
+            def change():
+                user = User.objects.get(pk=user_id)
+                user.first_name = 'Новое имя'
+                user.save()
+            return change
+
+        changes = (
+            ('group', rename_group, ('post', 'profile')),
+            ('author', rename(self.author.pk), ('post', 'profile')),
+            ('commenter', rename(self.reader.pk), ('post',)),
+        )
+        for change_name, change, pages in changes:
+            etags = {
+                name: self.guest_client.get(self.urls[name])['ETag']
+                for name in pages
+            }
+            change()
+            for name in pages:
+                with self.subTest(change=change_name, page=name):
+                    response = self.guest_client.get(
+                        self.urls[name], HTTP_IF_NONE_MATCH=etags[name]
+                    )
+                    self.assertEqual(response.status_code, 200)
+        etag = self.guest_client.get(self.urls['profile'])['ETag']
+        self.client.force_login(self.author)
+        self.assertEqual(
+            self.guest_client.get(
+                self.urls['profile'], HTTP_IF_NONE_MATCH=etag
+            ).status_code, 304
+        )
+
+    def test_group_rename_skips_group_posts(self):
+        """ Переименование группы не перебирает её посты при сохранении. """
+        Post.objects.bulk_create(
+            Post(author=self.author, group=self.group, text=f'Пост {i}')
+            for i in range(5)
+        )
+        group = Group.objects.get(pk=self.group.pk)
+        group.title = 'Новое название'
+        with CaptureQueriesContext(connection) as queries:
+            group.save()
+        self.assertFalse(any(
+            'posts_post' in query['sql'] for query in queries
+        ))
+
+    @override_settings(BACKGROUND_TASKS_EAGER=True)
+    def test_group_delete_invalidates_etag(self):
+        """ Удаление группы меняет ETag поста и профиля автора. """
+        etags = {
+            name: self.guest_client.get(self.urls[name])['ETag']
+            for name in ('post', 'profile')
+        }
+        Group.objects.filter(pk=self.group.pk).delete()
+        for name, etag in etags.items():
+            with self.subTest(page=name):
+                response = self.guest_client.get(
+                    self.urls[name], HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 200)
+
+    def test_etag_depends_on_viewer(self):
+        """ Другой зритель не получает чужую страницу по ETag. """
+        for name, url in self.urls.items():
+            with self.subTest(page=name):
+                etag = self.guest_client.get(url)['ETag']
+                response = self.reader_client.get(
+                    url, HTTP_IF_NONE_MATCH=etag
+                )
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(
+                    self.revalidate(url, self.reader_client).status_code, 304
+                )
+
+    def test_missing_object_has_no_etag(self):
+        """ Для несуществующих объектов ETag не считается. """
+        response = self.guest_client.get(
+            reverse('posts:profile', kwargs={'username': 'nobody'})
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(response.has_header('ETag'))
+
+
+class PageCacheTests(TestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.author = User.objects.create_user(username='cached')
+        cls.other = User.objects.create_user(username='other')
+        cls.group = Group.objects.create(
+            title='Группа', slug='cached', description='Описание'
+        )
+        cls.other_group = Group.objects.create(
+            title='Другая', slug='other', description='Описание'
+        )
+        cls.post = Post.objects.create(
+            author=cls.author, group=cls.group, text='Пост'
+        )
+        cls.other_post = Post.objects.create(
+            author=cls.other, group=cls.other_group, text='Другой пост'
+        )
+
+    def setUp(self):
+        cache.clear()
+        self.guest_client = Client()
+
+    def url(self, name, **kwargs):
+        return reverse(f'posts:{name}', kwargs=kwargs)
+
+    def cache_status(self, url):
+        return self.guest_client.get(url).get('X-Page-Cache')
+
+    def test_anonymous_pages_served_from_cache(self):
+        """ Повторный запрос анонима отдаётся из кэша без запросов к БД. """
+        url = self.url('post_detail', post_id=self.post.pk)
+        first = self.guest_client.get(url)
+        self.assertEqual(first['X-Page-Cache'], 'MISS')
+        self.assertEqual(
+            first['Surrogate-Key'].split(),
+            [
+                f'post:{self.post.pk}', f'profile:{self.author.pk}',
+                f'group:{self.group.pk}'
+            ]
+        )
+        with self.assertNumQueries(0):
+            second = self.guest_client.get(url)
+        self.assertEqual(second['X-Page-Cache'], 'HIT')
+        self.assertEqual(second.content, first.content)
+        not_modified = self.guest_client.get(
+            url, HTTP_IF_NONE_MATCH=first['ETag']
+        )
+        self.assertEqual(not_modified.status_code, 304)
+
+    def test_writes_purge_only_affected_pages(self):
+        """ Запись сбрасывает только страницы со своими ключами. """
+        urls = {
+            'index': self.url('index'),
+            'group': self.url('group_lists', slug=self.group.slug),
+            'other_group': self.url('group_lists', slug=self.other_group.slug),
+            'profile': self.url('profile', username=self.author.username),
+            'other_profile': self.url(
+                'profile', username=self.other.username
+            ),
+            'post': self.url('post_detail', post_id=self.post.pk),
+            'other_post': self.url('post_detail', post_id=self.other_post.pk),
+        }
+        writes = {
+            'post': (
+                lambda: Post.objects.create(
+                    author=self.author, group=self.group, text='Новый'
+                ),
+                # На странице поста виден счётчик постов автора.
+                {'index', 'group', 'profile', 'post'},
+            ),
+            'comment': (
+                lambda: Comment.objects.create(
+                    post=self.post, author=self.other, text='Комментарий'
+                ),
+                {'index', 'group', 'profile', 'post'},
+            ),
+            'follow': (
+                lambda: Follow.objects.create(
+                    user=self.other, author=self.author
+                ),
+                {'profile', 'other_profile'},
+            ),
+        }
+        for write, (change, purged) in writes.items():
+            with self.subTest(write=write):
+                for url in urls.values():
+                    self.guest_client.get(url)
+                change()
+                self.assertEqual(
+                    {name for name, url in urls.items()
+                     if self.cache_status(url) == 'MISS'},
+                    purged
+                )
+
+    def test_authenticated_and_other_views_not_cached(self):
+        """ Страницы пользователей и прочие view не кэшируются. """
+        client = Client()
+        client.force_login(self.author)
+        url = self.url('index')
+        client.get(url)
+        self.assertFalse(client.get(url).has_header('X-Page-Cache'))
+        self.assertIsNone(self.cache_status(self.url('search')))
+
+    def test_hit_ratio_reported(self):
+        """ Доля попаданий видна в статистике и команде. """
+        url = self.url('index')
+        hits, misses = page_cache_stats()
+        for _ in range(4):
+            self.guest_client.get(url)
+        self.assertEqual(page_cache_stats(), (hits + 3, misses + 1))
+        out = StringIO()
+        call_command('page_cache_stats', stdout=out)
+        self.assertIn(f'попаданий: {hits + 3}', out.getvalue())
+
+    def test_deleted_user_pages_purged(self):
+        """ Страница удалённого автора не достаётся его тёзке. """
+        user = User.objects.create_user(username='reused')
+        url = self.url('profile', username='reused')
+        self.guest_client.get(url)
+        user.delete()
+        User.objects.create_user(username='reused')
+        self.assertEqual(self.cache_status(url), 'MISS')
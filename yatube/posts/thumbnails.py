@@ -0,0 +1,232 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.core.cache import cache
+from sorl.thumbnail import default
+from sorl.thumbnail.base import ThumbnailBackend
+from sorl.thumbnail.conf import defaults as default_settings
+from sorl.thumbnail.conf import settings as thumbnail_settings
+from sorl.thumbnail.images import ImageFile, deserialize_image_file
+from sorl.thumbnail.kvstores.base import add_prefix
+from sorl.thumbnail.kvstores import cached_db_kvstore
+from sorl.thumbnail.models import KVStore as KVStoreModel
+
+from core import timing
+
+from .caching import bump_versions, post_scopes
+from .models import Post
+from .tasks import run_after_commit
+
+
+class ReadyThumbnailBackend(ThumbnailBackend):
+    """Бэкенд sorl, который умеет искать миниатюру, не создавая её."""
+
+    def get_options(self, source, options):
+        """Параметры миниатюры с умолчаниями, как в get_thumbnail()."""
+        options = dict(options)
+        if thumbnail_settings.THUMBNAIL_PRESERVE_FORMAT:
+            options.setdefault('format', self._get_format(source))
+        for key, value in self.default_options.items():
+            options.setdefault(key, value)
+        for key, attr in self.extra_options:
+            value = getattr(thumbnail_settings, attr)
+            if value != getattr(default_settings, attr):
+                options.setdefault(key, value)
+        return options
+
+    def thumbnail_keys(self, requests):
+        """Ключи хранилища sorl для списка (файл, геометрия, параметры)."""
+        keys = []
+        for file_, geometry_string, options in requests:
+            source = ImageFile(file_)
+            name = self._get_thumbnail_filename(
+                source, geometry_string, self.get_options(source, options)
+            )
+            keys.append(add_prefix(ImageFile(name, default.storage).key))
+        return keys
+
+    def get_ready_thumbnail(self, file_, geometry_string, **options):
+        """Готовая миниатюра из хранилища ключей sorl или None."""
+        requests = [(file_, geometry_string, options)]
+        return self.get_ready_thumbnails(requests)[0]
+
+    def get_ready_thumbnails(self, requests):
+        """Готовые миниатюры для списка (файл, геометрия, параметры).
+
+        Все ключи читаются из кэша одним get_many, а промахи — одним
+        запросом к базе, вместо отдельного чтения на каждую миниатюру.
+        """
+        with timing.measure('thumb', len(requests)):
+            keys = self.thumbnail_keys(requests)
+            values = _get_many_raw(keys)
+        return [
+            deserialize_image_file(values[key])
+            if values.get(key) is not None else None
+            for key in keys
+        ]
+
+
+backend = ReadyThumbnailBackend()
+
+
+def _get_many_raw(keys):
+    kvstore = default.kvstore
+    if not isinstance(kvstore, cached_db_kvstore.KVStore):
+        return {key: kvstore._get_raw(key) for key in keys}
+    empty = cached_db_kvstore.EMPTY_VALUE
+    values = kvstore.cache.get_many(keys)
+    missing = [key for key in set(keys) if key not in values]
+    if missing:
+        found = dict(KVStoreModel.objects.filter(
+            key__in=missing
+        ).values_list('key', 'value'))
+        # Как и cached_db_kvstore, запоминаем отсутствие ключа в кэше,
+        # чтобы следующая страница не ходила за ним в базу.
+        fetched = {key: found.get(key, empty) for key in missing}
+        kvstore.cache.set_many(
+            fetched, thumbnail_settings.THUMBNAIL_CACHE_TIMEOUT
+        )
+        values.update(fetched)
+    return {
+        key: None if value == empty else value
+        for key, value in values.items()
+    }
+
+
+def thumbnail_options(alias):
+    """Геометрия и параметры размера из settings.POST_THUMBNAILS."""
+    geometry, options = settings.POST_THUMBNAILS[alias]
+    return geometry, dict(options)
+
+
+def thumbnail_size(post, alias):
+    """Ширина и высота миниатюры alias по сохранённым размерам картинки.
+
+    Повторяет расчёт sorl: с crop миниатюра заполняет геометрию, без
+    него вписывается в неё, без upscale не больше исходника. Пока
+    размеры картинки неизвестны — размер самой геометрии.
+    """
+    geometry, options = thumbnail_options(alias)
+    width, height = map(int, geometry.split('x'))
+    if not post.image_width or not post.image_height:
+        return width, height
+    crop = options.get('crop')
+    factors = (width / post.image_width, height / post.image_height)
+    factor = max(factors) if crop else min(factors)
+    if not options.get('upscale', thumbnail_settings.THUMBNAIL_UPSCALE):
+        factor = min(factor, 1)
+    scaled = (
+        round(post.image_width * factor), round(post.image_height * factor)
+    )
+    if crop:
+        return min(scaled[0], width), min(scaled[1], height)
+    return scaled
+
+
+def generate_thumbnails(post_id):
+    """Создаёт миниатюры всех размеров для картинки поста.
+
+    После создания сбрасывает версии кэша ленты, чтобы вместо
+    заглушки в закэшированных фрагментах появилась картинка.
+    """
+    post = Post.objects.filter(pk=post_id).only(
+        'pk', 'author_id', 'group_id', 'image'
+    ).first()
+    if post is None or not post.image:
+        return
+    for alias in settings.POST_THUMBNAILS:
+        geometry, options = thumbnail_options(alias)
+        backend.get_thumbnail(post.image.name, geometry, **options)
+    forget_queued(post.image.name)
+    bump_versions(*post_scopes(post))
+
+
+def queue_thumbnails(post, task=generate_thumbnails):
+    """Ставит создание миниатюр поста в очередь фоновых задач.
+
+    Пока задача не выполнена (или после ошибки, до THUMBNAIL_QUEUE_TIMEOUT),
+    повторные вызовы для той же картинки ничего не делают. task заменяет
+    generate_thumbnails задачей, которая создаёт миниатюры после другой
+    работы с картинкой.
+    """
+    if not post.image:
+        return
+    if cache.add(_queued_key(post.image.name), True,
+                 settings.THUMBNAIL_QUEUE_TIMEOUT):
+        run_after_commit(task, post.pk)
+
+
+def forget_queued(name):
+    """Разрешает снова ставить в очередь обработку картинки name."""
+    cache.delete(_queued_key(name))
+
+
+def prefetch_thumbnails(posts):
+    """Находит миниатюры всех размеров для картинок страницы разом.
+
+    Результат запоминается в постах, и {% post_picture %} больше
+    не читает хранилище ключей для каждого поста отдельно.
+    """
+    posts = [post for post in posts if post.image]
+    aliases = list(settings.POST_THUMBNAILS)
+    requests = [
+        (post.image.name, *thumbnail_options(alias))
+        for post in posts for alias in aliases
+    ]
+    thumbnails = iter(backend.get_ready_thumbnails(requests))
+    for post in posts:
+        post._prefetched_thumbnails = {
+            alias: next(thumbnails) for alias in aliases
+        }
+
+
+def ready_thumbnail(post, alias):
+    """Готовая миниатюра картинки поста или None.
+
+    Если миниатюры ещё нет, её создание ставится в очередь: поток
+    запроса никогда не декодирует исходную картинку.
+    """
+    if not post.image:
+        return None
+    prefetched = getattr(post, '_prefetched_thumbnails', {})
+    if alias in prefetched:
+        thumbnail = prefetched[alias]
+    else:
+        geometry, options = thumbnail_options(alias)
+        thumbnail = backend.get_ready_thumbnail(
+            post.image.name, geometry, **options
+        )
+    if thumbnail is None:
+        queue_thumbnails(post)
+    return thumbnail
+
+
+Picture = namedtuple('Picture', 'img sources sizes')
+Source = namedtuple('Source', 'type srcset')
+
+
+def ready_picture(post, name):
+    """Готовые миниатюры для <picture> из settings.POST_PICTURES
+    или None, пока нет миниатюры для src.
+
+    В srcset попадают только уже созданные варианты: недостающие
+    ставятся в очередь, как в ready_thumbnail().
+    """
+    picture = settings.POST_PICTURES[name]
+    img = ready_thumbnail(post, picture['img'])
+    if img is None:
+        return None
+    sources = []
+    for mime_type, aliases in picture['sources'].items():
+        variants = [ready_thumbnail(post, alias) for alias in aliases]
+        srcset = ', '.join(
+            f'{variant.url} {variant.width}w'
+            for variant in variants if variant is not None
+        )
+        if srcset:
+            sources.append(Source(mime_type, srcset))
+    return Picture(img, sources, picture['sizes'])
+
+
+def _queued_key(name):
+    return f'thumbnail_queued:{name}'
@@ -0,0 +1,204 @@
+"""Домашняя лента подписок, разложенная при записи (fan-out on write).
+
+При публикации пост копируется в TimelineEntry каждого подписчика автора,
+и лента подписок читается одним проходом по индексу
+(user, pub_date, post). Посты авторов, у которых подписчиков больше
+TIMELINE_FANOUT_LIMIT, не раскладываются, а подмешиваются при чтении.
+Когда подписчиков снова становится не больше лимита, catch_up
+раскладывает пропущенные посты, и только после этого автор перестаёт
+подмешиваться.
+"""
+from django.conf import settings
+from django.db.models import F, Q
+
+from .caching import bump_versions, get_versions
+from .follow_graph import following_ids
+from .models import AuthorStats, Follow, Post, TimelineEntry
+from .utils import feed_count_key
+
+
+def _pull():
+    """Авторы, чьи посты подмешиваются при чтении: подписчиков больше
+    лимита или посты ещё не разложены после его снижения."""
+    return (Q(followers_count__gt=settings.TIMELINE_FANOUT_LIMIT)
+            | Q(timeline_pending=True))
+
+
+def is_pull_author(author_id):
+    return AuthorStats.objects.filter(_pull(), user_id=author_id).exists()
+
+
+def pull_author_ids(author_ids):
+    """Авторы из подписок пользователя, чьи посты не раскладываются."""
+    if not author_ids:
+        return []
+    return list(AuthorStats.objects.filter(
+        _pull(), user_id__in=author_ids
+    ).values_list('user_id', flat=True))
+
+
+def _skip_pull_author(author_id):
+    """True, если автор подмешивается при чтении. Тогда пропущенная
+    раскладка отмечается, чтобы catch_up потом её догнал."""
+    if not is_pull_author(author_id):
+        return False
+    AuthorStats.objects.filter(
+        user_id=author_id, timeline_pending=False
+    ).update(timeline_pending=True)
+    return True
+
+
+def lay_out(user_ids, posts):
+    """Записи ленты каждого из user_ids для постов [(id, pub_date)]."""
+    TimelineEntry.objects.bulk_create(
+        (TimelineEntry(user_id=user_id, post_id=pk, pub_date=pub_date)
+         for user_id in user_ids for pk, pub_date in posts),
+        batch_size=settings.TIMELINE_BATCH_SIZE,
+        ignore_conflicts=True
+    )
+
+
+def fan_out(post_id):
+    """Раскладывает пост по лентам подписчиков автора."""
+    post = Post.objects.filter(pk=post_id).first()
+    if post is None:
+        return
+    if _skip_pull_author(post.author_id):
+        # Пост подмешается при чтении, но число записей лент
+        # подписчиков изменилось.
+        touch_followers(post.author_id)
+        return
+    # Подписчиков не больше TIMELINE_FANOUT_LIMIT: список помещается
+    # в память и нужен ещё раз, чтобы сбросить их ленты.
+    followers = list(Follow.objects.filter(
+        author_id=post.author_id
+    ).values_list('user_id', flat=True))
+    lay_out(followers, [(post.pk, post.pub_date)])
+    touch_feeds(followers)
+
+
+def backfill(user_id, author_id):
+    """Добавляет в ленту нового подписчика уже опубликованные посты."""
+    if _skip_pull_author(author_id):
+        return
+    lay_out([user_id], Post.objects.filter(
+        author_id=author_id
+    ).values_list('pk', 'pub_date').iterator())
+    touch_feeds([user_id])
+
+
+def _pending(author_id):
+    """Счётчики автора, если подписчиков у него снова не больше лимита,
+    а посты ещё не разложены."""
+    return AuthorStats.objects.filter(
+        user_id=author_id, timeline_pending=True,
+        followers_count__lte=settings.TIMELINE_FANOUT_LIMIT
+    )
+
+
+def needs_catch_up(author_id):
+    return _pending(author_id).exists()
+
+
+def catch_up(author_id):
+    """Раскладывает посты автора по лентам всех его подписчиков и
+    возвращает автора к раскладке при записи.
+
+    Пока стоит timeline_pending, посты автора подмешиваются при чтении,
+    поэтому ни до, ни во время раскладки они не пропадают из лент.
+    """
+    pending = _pending(author_id)
+    if not pending.exists():
+        return
+    posts = Post.objects.filter(author_id=author_id)
+    follows = Follow.objects.filter(author_id=author_id)
+    rows = list(posts.values_list('pk', 'pub_date'))
+    last_post = max((pk for pk, _ in rows), default=0)
+    last_follow = follows.order_by('-pk').values_list(
+        'pk', flat=True
+    ).first() or 0
+    followers = list(follows.filter(
+        pk__lte=last_follow
+    ).values_list('user_id', flat=True))
+    lay_out(followers, rows)
+    # Подписчиков снова стало больше лимита: автор остаётся
+    # подмешиваемым, разложенные записи ему не мешают.
+    if not pending.update(timeline_pending=False):
+        return
+    # Посты и подписки, появившиеся во время раскладки, задачи fan_out
+    # и backfill могли пропустить, ещё видя флаг.
+    lay_out(followers, posts.filter(
+        pk__gt=last_post
+    ).values_list('pk', 'pub_date'))
+    late = list(follows.filter(
+        pk__gt=last_follow
+    ).values_list('user_id', flat=True))
+    lay_out(late, list(posts.values_list('pk', 'pub_date')))
+    # А отписавшиеся за это время не должны видеть посты автора.
+    TimelineEntry.objects.filter(post__author_id=author_id).exclude(
+        user_id__in=follows.values('user_id')
+    ).delete()
+    touch_feeds(followers + late)
+
+
+def touch_feeds(user_ids):
+    """Сбрасывает кэш лент подписок пользователей, в которые легли записи.
+
+    Раскладка выполняется после коммита, когда сигналы записи уже
+    сбросили версии: страница и число записей, посчитанные между
+    коммитом и задачей, закэшированы без новых записей. Версия
+    follow:<id> входит и в ключ фрагмента ленты, и в follow_count_key.
+    """
+    bump_versions(*(f'follow:{user_id}' for user_id in user_ids))
+
+
+def touch_followers(author_id):
+    """Сбрасывает кэш лент подписок всех подписчиков автора пачками:
+    у подмешиваемого автора их может быть сколько угодно."""
+    batch = []
+    for user_id in Follow.objects.filter(
+        author_id=author_id
+    ).values_list('user_id', flat=True).iterator():
+        batch.append(user_id)
+        if len(batch) >= settings.TIMELINE_BATCH_SIZE:
+            touch_feeds(batch)
+            batch = []
+    touch_feeds(batch)
+
+
+def prune(user_id, author_id):
+    """Убирает из ленты посты автора, от которого отписались."""
+    TimelineEntry.objects.filter(
+        user_id=user_id, post__author_id=author_id
+    ).delete()
+
+
+def follow_feed(user):
+    """Queryset ленты подписок и параметры пагинатора для него."""
+    pulled = pull_author_ids(following_ids(user))
+    if pulled:
+        posts = Post.objects.filter(
+            Q(pk__in=TimelineEntry.objects.filter(
+                user=user).values('post_id'))
+            | Q(author_id__in=pulled)
+        ).for_feed()
+        return posts, {}
+    posts = Post.objects.filter(timeline_entries__user=user).annotate(
+        feed_pub_date=F('timeline_entries__pub_date'),
+        feed_post_id=F('timeline_entries__post_id'),
+    ).for_feed()
+    return posts, {
+        'order_field': '-feed_pub_date',
+        'tiebreak_field': 'feed_post_id',
+    }
+
+
+def follow_count_key(user):
+    """Ключ кэша числа записей ленты подписок пользователя.
+
+    В ключ входит только версия follow:<id>: её сбрасывают подписка
+    и отписка, раскладка нового поста (и подмешиваемого автора тоже)
+    и удаление поста (touch_followers).
+    """
+    version, = get_versions(f'follow:{user.pk}')
+    return feed_count_key('follow', f'{user.pk}:{version}')
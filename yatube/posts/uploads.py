@@ -0,0 +1,128 @@
+"""Загрузка картинок постов: потоковый приём с лимитами и обработка
+в пуле процессов после ответа.
+
+Файл пишется во временный файл по кускам FILE_UPLOAD_HANDLERS и
+обрывается на IMAGE_UPLOAD_MAX_BYTES, размер в пикселях форма проверяет
+по заголовку, не декодируя картинку. Поворот по EXIF и перекодирование
+выполняет пул процессов: тяжёлое декодирование не раздувает память
+процессов WSGI-сервера.
+"""
+import hashlib
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.conf import settings
+from django.core.files import File
+from django.core.files.uploadhandler import (
+    SkipFile, TemporaryFileUploadHandler
+)
+from django.db import transaction
+
+from . import blobs, image_ops
+from .models import Post
+from .thumbnails import (
+    forget_queued, generate_thumbnails, queue_thumbnails
+)
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+class LimitedUploadHandler(TemporaryFileUploadHandler):
+    """Пишет файл во временный файл по кускам, не держа его в памяти,
+    считает по ним SHA-256 и пропускает файл целиком, как только он
+    превысил IMAGE_UPLOAD_MAX_BYTES.
+    """
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received = 0
+        self.hasher = hashlib.sha256()
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        limit = settings.IMAGE_UPLOAD_MAX_BYTES
+        if self.received > limit:
+            if self.request is not None:
+                rejected = getattr(self.request, 'rejected_uploads', {})
+                rejected[self.field_name] = (
+                    f'Файл больше {limit // (1024 * 1024)} МБ.'
+                    if limit >= 1024 * 1024 else f'Файл больше {limit} байт.'
+                )
+                self.request.rejected_uploads = rejected
+            raise SkipFile
+        self.hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        file = super().file_complete(file_size)
+        # Хэш для хранилища по содержимому: файл не перечитывается.
+        file.sha256 = self.hasher.hexdigest()
+        return file
+
+
+def rejected_uploads(request):
+    """Ошибки полей, чьи файлы отброшены при приёме: {поле: сообщение}."""
+    return getattr(request, 'rejected_uploads', {})
+
+
+def process_pool():
+    """Общий пул процессов для картинок (spawn: процессы без потоков
+    и соединений родителя)."""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=settings.IMAGE_PROCESS_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+def process_image(post_id):
+    """Поворачивает и перекодирует картинку поста, сохраняет её
+    метаданные и создаёт миниатюры.
+
+    Результат сохраняется в хранилище как новый файл: у старого имени
+    уже могут быть миниатюры и закэшированные страницы. Если картинку
+    успели сменить, ссылка на результат не записывается, и сборщик
+    удалит его.
+    """
+    post = Post.objects.filter(pk=post_id).only('pk', 'image').first()
+    if post is None or not post.image:
+        return
+    source = post.image.name
+    storage = post.image.storage
+    with tempfile.TemporaryDirectory() as directory:
+        target = os.path.join(directory, os.path.basename(source))
+        reencoded, metadata = process_pool().submit(
+            image_ops.prepare, storage.path(source), target,
+            settings.IMAGE_MAX_PIXELS
+        ).result()
+        if reencoded:
+            with open(target, 'rb') as file:
+                metadata['image'] = storage.save(
+                    post.image.field.generate_filename(
+                        post, os.path.basename(source)
+                    ),
+                    File(file)
+                )
+    with transaction.atomic():
+        updated = Post.objects.filter(pk=post_id, image=source).update(
+            **metadata
+        )
+        if reencoded and updated and metadata['image'] != source:
+            blobs.acquire(metadata['image'])
+            blobs.release(source)
+    # Та же картинка может прийти снова (файлы общие по содержимому):
+    # её обработку нельзя считать уже поставленной.
+    forget_queued(source)
+    generate_thumbnails(post_id)
+
+
+def queue_image_processing(post):
+    """Ставит обработку загруженной картинки в очередь фоновых задач."""
+    queue_thumbnails(post, task=process_image)
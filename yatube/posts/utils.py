@@ -1,12 +1,282 @@
+import base64
+import binascii
+
 from django.conf import settings
-from django.core.paginator import Paginator
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from django.core.paginator import Page, Paginator
+from django.db import DatabaseError, connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+CURSOR_NEXT = 'n'
+CURSOR_PREVIOUS = 'p'
+
+
+def feed_count_key(feed, scope=''):
+    """Ключ кэша с числом записей ленты: index, group, profile, follow."""
+    return f'feed_count:{feed}:{scope}'
+
+
+class CursorPage(Page):
+    """Страница ленты, которая знает курсоры соседних страниц.
+
+    Строки страницы, открытой по курсору, выбираются лениво: запрос
+    уходит в базу только при первом обращении к содержимому страницы.
+    Тогда же для них вызывается paginator.prefetch, если он задан.
+    """
+
+    def __init__(self, object_list, number, paginator, direction=None):
+        super().__init__(object_list, number, paginator)
+        self.direction = direction
+
+    @cached_property
+    def _fetched(self):
+        rows = list(self.object_list)
+        has_more = None
+        if self.direction is not None:
+            has_more = len(rows) > self.paginator.per_page
+            rows = rows[:self.paginator.per_page]
+            if self.direction == CURSOR_PREVIOUS:
+                rows.reverse()
+        if self.paginator.prefetch is not None:
+            self.paginator.prefetch(rows)
+        return rows, has_more
+
+    @property
+    def rows(self):
+        return self._fetched[0]
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, index):
+        if not isinstance(index, (int, slice)):
+            raise TypeError
+        return self.rows[index]
+
+    def __repr__(self):
+        if self.number is None:
+            return '<CursorPage %s>' % self.direction
+        return super().__repr__()
+
+    def has_next(self):
+        if self.direction == CURSOR_NEXT:
+            return self._fetched[1]
+        if self.direction == CURSOR_PREVIOUS:
+            return self.paginator.exists_beyond(self.rows, CURSOR_NEXT)
+        return super().has_next()
+
+    def has_previous(self):
+        if self.direction == CURSOR_PREVIOUS:
+            return self._fetched[1]
+        if self.direction == CURSOR_NEXT and self.number is None:
+            return self.paginator.exists_beyond(self.rows, CURSOR_PREVIOUS)
+        return super().has_previous()
+
+    @property
+    def next_cursor(self):
+        if not self.rows:
+            return None
+        return self.paginator.encode_cursor(self.rows[-1], CURSOR_NEXT)
+
+    @property
+    def previous_cursor(self):
+        if not self.rows:
+            return None
+        return self.paginator.encode_cursor(self.rows[0], CURSOR_PREVIOUS)
+
+
+class CursorPaginator(Paginator):
+    """Пагинатор с поиском по ключу (keyset) вместо LIMIT/OFFSET.
+
+    Страницы по номеру (?page=N) работают как у обычного Paginator,
+    а страницы по курсору (?cursor=...) выбираются условием
+    (order_field, tiebreak_field) < (значение, id) и не зависят от
+    глубины. Оба поля могут быть и аннотациями queryset.
+
+    prefetch(rows) вызывается один раз для строк каждой страницы —
+    например, чтобы разом подготовить данные для всех карточек.
+    """
+
+    def __init__(self, object_list, per_page, order_field='-pub_date',
+                 tiebreak_field='pk', prefetch=None, **kwargs):
+        self.prefetch = prefetch
+        self.descending = order_field.startswith('-')
+        self.order_field = order_field.lstrip('-')
+        self.tiebreak_field = tiebreak_field
+        sign = '-' if self.descending else ''
+        self.ordering = (sign + self.order_field, sign + tiebreak_field)
+        if hasattr(object_list, 'order_by'):
+            object_list = object_list.order_by(*self.ordering)
+        super().__init__(object_list, per_page, **kwargs)
+
+    def _get_page(self, *args, **kwargs):
+        return CursorPage(*args, **kwargs)
+
+    def encode_cursor(self, obj, direction):
+        value = getattr(obj, self.order_field)
+        if hasattr(value, 'isoformat'):
+            value = value.isoformat()
+        key = getattr(obj, self.tiebreak_field)
+        raw = f'{direction}|{value}|{key}'.encode()
+        return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        """Вернёт (направление, значение, pk) или None для битого курсора."""
+        try:
+            raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+            direction, value, pk = raw.decode().split('|')
+            value = self._field.to_python(value)
+            pk = int(pk)
+        except (binascii.Error, UnicodeDecodeError, ValueError,
+                ValidationError):
+            return None
+        if direction not in (CURSOR_NEXT, CURSOR_PREVIOUS) or value is None:
+            return None
+        return direction, value, pk
+
+    def cursor_page(self, cursor=None):
+        """Страница по курсору; без курсора или с битым курсором — первая."""
+        decoded = cursor and self.decode_cursor(cursor)
+        if not decoded:
+            return self._get_page(
+                self.object_list[:self.per_page + 1], 1, self, CURSOR_NEXT
+            )
+        direction, value, pk = decoded
+        rows = self._seek(value, pk, direction)
+        return self._get_page(
+            rows[:self.per_page + 1], None, self, direction
+        )
+
+    def exists_beyond(self, rows, direction):
+        """Есть ли записи за пределами rows в направлении direction."""
+        if not rows:
+            return False
+        edge = rows[-1] if direction == CURSOR_NEXT else rows[0]
+        value = getattr(edge, self.order_field)
+        key = getattr(edge, self.tiebreak_field)
+        return self._seek(value, key, direction).exists()
+
+    @cached_property
+    def _field(self):
+        annotation = self.object_list.query.annotations.get(self.order_field)
+        if annotation is not None:
+            return annotation.output_field
+        return self.object_list.model._meta.get_field(self.order_field)
+
+    def _seek(self, value, pk, direction):
+        forward = direction == CURSOR_NEXT
+        lookup = 'lt' if forward == self.descending else 'gt'
+        # Первое условие — диапазон по индексу (order_field, id),
+        # второе отсекает уже показанные строки с тем же значением.
+        seek = Q(**{f'{self.order_field}__{lookup}e': value}) & (
+            Q(**{f'{self.order_field}__{lookup}': value})
+            | Q(**{f'{self.tiebreak_field}__{lookup}': pk})
+        )
+        ordering = self.ordering if forward else tuple(
+            field[1:] if field.startswith('-') else '-' + field
+            for field in self.ordering
+        )
+        return self.object_list.filter(seek).order_by(*ordering)
+
+
+class FeedPage(CursorPage):
+
+    @property
+    def page_window(self):
+        """Ограниченное окно номеров страниц вокруг текущей."""
+        if self.number is None:
+            return []
+        return self.paginator.get_elided_page_range(self.number)
+
+
+class FeedPaginator(CursorPaginator):
+    """Пагинатор ленты с кэшированным числом записей.
+
+    Число записей хранится в кэше под count_key и сбрасывается сигналами
+    при изменении ленты. С estimate=True для больших таблиц вместо
+    COUNT(*) берётся оценка из статистики планировщика.
+    """
+    ELLIPSIS = '…'
+
+    def __init__(self, object_list, per_page, count_key=None,
+                 estimate=False, **kwargs):
+        self.count_key = count_key
+        self.estimate = estimate
+        super().__init__(object_list, per_page, **kwargs)
+
+    def _get_page(self, *args, **kwargs):
+        return FeedPage(*args, **kwargs)
+
+    @cached_property
+    def count(self):
+        if self.count_key is None:
+            return super().count
+        count = cache.get(self.count_key)
+        if count is None:
+            count = self.estimate and self._estimated_count()
+            if not count:
+                count = self.object_list.count()
+            cache.set(self.count_key, count, settings.FEED_COUNT_TIMEOUT)
+        return count
+
+    def get_elided_page_range(self, number, on_each_side=3, on_ends=2):
+        """Номера страниц вокруг текущей, остальные заменены на ELLIPSIS."""
+        number = self.validate_number(number)
+        if self.num_pages <= (on_each_side + on_ends) * 2:
+            yield from self.page_range
+            return
+        if number > 1 + on_each_side + on_ends + 1:
+            yield from range(1, on_ends + 1)
+            yield self.ELLIPSIS
+            yield from range(number - on_each_side, number + 1)
+        else:
+            yield from range(1, number + 1)
+        if number < self.num_pages - on_each_side - on_ends - 1:
+            yield from range(number + 1, number + on_each_side + 1)
+            yield self.ELLIPSIS
+            yield from range(
+                self.num_pages - on_ends + 1, self.num_pages + 1
+            )
+        else:
+            yield from range(number + 1, self.num_pages + 1)
 
+    def _estimated_count(self):
+        """Оценка числа строк таблицы или None, если оценки нет."""
+        model = self.object_list.model
+        connection = connections[self.object_list.db]
+        if connection.vendor == 'sqlite':
+            sql = 'SELECT stat FROM sqlite_stat1 WHERE tbl = %s LIMIT 1'
+        elif connection.vendor == 'postgresql':
+            sql = 'SELECT reltuples::bigint FROM pg_class WHERE relname = %s'
+        else:
+            return None
+        try:
+            with connection.cursor() as cursor:
+                cursor.execute(sql, [model._meta.db_table])
+                row = cursor.fetchone()
+        except DatabaseError:
+            return None
+        if row is None:
+            return None
+        estimate = int(str(row[0]).split()[0])
+        if estimate < settings.FEED_COUNT_ESTIMATE_THRESHOLD:
+            return None
+        return estimate
 
-def pagination(queryset, request):
 
-    paginator = Paginator(queryset, settings.POSTS_PER_PAGE)
+def pagination(queryset, request, count_key=None, estimate=False,
+               **kwargs):
+    paginator = FeedPaginator(
+        queryset, settings.POSTS_PER_PAGE,
+        count_key=count_key, estimate=estimate, **kwargs
+    )
     page_number = request.GET.get('page')
-    page_obj = paginator.get_page(page_number)
+    if page_number is not None:
+        page_obj = paginator.get_page(page_number)
+    else:
+        page_obj = paginator.cursor_page(request.GET.get('cursor'))
     return {
         'page_obj': page_obj,
     }
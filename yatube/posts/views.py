@@ -1,60 +1,175 @@
+from django.conf import settings
 from django.contrib.auth.decorators import login_required
+from django.http import HttpResponse, JsonResponse
 from django.shortcuts import get_object_or_404, redirect, render
+from django.template.loader import render_to_string
+from django.utils.http import urlencode
+from django.views.decorators.cache import cache_control
+from django.views.decorators.http import condition
 
-
+from .caching import feed_cache, page_etag
+from .follow_graph import is_following
 from .forms import PostForm, CommentForm
 from .models import Group, Post, User, Comment, Follow
-from .utils import pagination
+from .search import attach_snippets, match_expression
+from .thumbnails import prefetch_thumbnails
+from .timeline import follow_count_key, follow_feed
+from .uploads import queue_image_processing, rejected_uploads
+from .utils import CursorPaginator, feed_count_key, pagination
 
 
 def index(request):
-    posts = pagination(Post.objects.all(), request)
-    return render(request, 'posts/index.html', posts)
+    context = pagination(
+        Post.objects.for_feed(), request,
+        count_key=feed_count_key('index'), estimate=True,
+        prefetch=prefetch_thumbnails
+    )
+    context.update(feed_cache(request, 'index', 'index'))
+    return render(request, 'posts/index.html', context)
+
+
+def group_etag(request, slug):
+    group_id = Group.objects.filter(slug=slug).values_list(
+        'pk', flat=True
+    ).first()
+    if group_id is None:
+        return None
+    return page_etag(request, f'group:{group_id}')
 
 
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=group_etag)
 def group_posts(request, slug):
     group = get_object_or_404(Group, slug=slug)
-    posts = group.posts.all()
+    posts = group.posts.for_feed()
     context = {
         'group': group
     }
-    context.update(pagination(posts, request))
+    context.update(pagination(
+        posts, request, count_key=feed_count_key('group', group.pk),
+        prefetch=prefetch_thumbnails
+    ))
+    context.update(feed_cache(request, 'group', f'group:{group.pk}'))
     return render(request, 'posts/group_list.html', context)
 
 
+def profile_etag(request, username):
+    author_id = User.objects.filter(username=username).values_list(
+        'pk', flat=True
+    ).first()
+    if author_id is None:
+        return None
+    scopes = [f'profile:{author_id}', f'follow:{author_id}',
+              f'followers:{author_id}']
+    if request.user.is_authenticated:
+        scopes.append(f'follow:{request.user.pk}')
+    return page_etag(request, *scopes)
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=profile_etag)
 def profile(request, username):
-    author = get_object_or_404(User, username=username)
-    following = request.user.is_authenticated and Follow.objects.filter(
-        user=request.user, author=author
-    ).exists()
+    author = get_object_or_404(
+        User.objects.select_related('stats'), username=username
+    )
+    following = is_following(request.user, author.pk)
     context = {
         'author': author,
         'following': following
     }
-    context.update(pagination(author.posts.all(), request))
+    context.update(pagination(
+        author.posts.for_feed(), request,
+        count_key=feed_count_key('profile', author.pk),
+        prefetch=prefetch_thumbnails
+    ))
+    context.update(feed_cache(request, 'profile', f'profile:{author.pk}'))
     return render(request, 'posts/profile.html', context)
 
 
+def search(request):
+    query = request.GET.get('q', '').strip()
+    context = {
+        'query': query,
+        'page_query': urlencode({'q': query}) + '&' if query else '',
+    }
+    context.update(pagination(
+        Post.objects.for_feed().search(query), request,
+        order_field='rank', prefetch=attach_snippets(match_expression(query))
+    ))
+    return render(request, 'posts/search.html', context)
+
+
+def post_etag(request, post_id):
+    post = Post.objects.filter(pk=post_id).values_list(
+        'author_id', 'group_id'
+    ).first()
+    if post is None:
+        return None
+    author_id, group_id = post
+    scopes = [f'post:{post_id}', f'profile:{author_id}']
+    if group_id is not None:
+        # Название и ссылка группы: их сбрасывает одна версия группы.
+        scopes.append(f'group:{group_id}')
+    return page_etag(request, *scopes)
+
+
+@cache_control(private=True, no_cache=True)
+@condition(etag_func=post_etag)
 def post_detail(request, post_id):
-    post = get_object_or_404(Post, id=post_id)
-    comments = Comment.objects.filter(post=post)
+    post = get_object_or_404(
+        Post.objects.for_feed().select_related('author__stats'), id=post_id
+    )
     form = CommentForm(request.POST or None)
     context = {
         'posts': post,
         'form': form,
-        'comments': comments
+        'comments': comments_page(post, request)
     }
     return render(request, 'posts/post_detail.html', context)
 
 
+def comments_page(post, request):
+    """Порция комментариев поста по курсору вместе с авторами."""
+    comments = Comment.objects.filter(post=post).select_related(
+        'author'
+    ).only('text', 'created', 'post', 'author__username')
+    paginator = CursorPaginator(
+        comments, settings.COMMENTS_PER_PAGE, order_field='created'
+    )
+    return paginator.cursor_page(request.GET.get('cursor'))
+
+
+def post_comments(request, post_id):
+    """Следующая порция комментариев: фрагмент HTML или JSON."""
+    post = get_object_or_404(Post.objects.only('pk'), pk=post_id)
+    comments = comments_page(post, request)
+    if 'application/json' in request.META.get('HTTP_ACCEPT', ''):
+        next_cursor = comments.next_cursor if comments.has_next() else None
+        return JsonResponse({
+            'comments': [{
+                'id': comment.pk,
+                'author': comment.author.username,
+                'text': comment.text,
+                'created': comment.created,
+            } for comment in comments],
+            'next_cursor': next_cursor,
+        })
+    return HttpResponse(render_to_string(
+        'posts/includes/comment_list.html',
+        {'posts': post, 'comments': comments}, request
+    ))
+
+
 @login_required
 def post_create(request):
     is_edit = False
-    form = PostForm(request.POST or None, files=request.FILES or None)
+    form = PostForm(request.POST or None, files=request.FILES or None,
+                    rejected_uploads=rejected_uploads(request))
     if form.is_valid():
         post = form.save(commit=False)
         post.author = request.user
         post.save()
+        queue_image_processing(post)
         return redirect('posts:profile', username=post.author)
     return render(request, 'posts/create_post.html', {
         'form': form, 'is_edit': is_edit
@@ -69,7 +184,8 @@ def post_edit(request, post_id):
     post = get_object_or_404(Post, pk=post_id)
     form = PostForm(request.POST or None,
                     files=request.FILES or None,
-                    instance=post)
+                    instance=post,
+                    rejected_uploads=rejected_uploads(request))
     context = {
         'post': post,
         'form': form,
@@ -78,7 +194,11 @@ def post_edit(request, post_id):
     if user != post.author:
         return redirect('post:post_detail', post.pk)
     if form.is_valid():
+        if 'image' in form.changed_data:
+            post.reset_image_metadata()
         form.save()
+        if 'image' in form.changed_data:
+            queue_image_processing(post)
         return redirect('posts:post_detail', post.pk)
     return render(request, 'posts/create_post.html', context)
 
@@ -99,10 +219,19 @@ def add_comment(request, post_id):
 
 @login_required
 def follow_index(request):
-    following = Post.objects.filter(
-        author__following__user=request.user)
+    following, ordering = follow_feed(request.user)
     context = {}
-    context.update(pagination(following, request))
+    context.update(pagination(
+        following, request,
+        count_key=follow_count_key(request.user),
+        prefetch=prefetch_thumbnails, **ordering
+    ))
+    # Записи ленты раскладываются фоновыми задачами уже после сигналов
+    # записи; по завершении они сами сбрасывают follow:<id>
+    # (timeline.touch_feeds), иначе фрагмент остался бы без них.
+    context.update(feed_cache(
+        request, 'follow', f'follow:{request.user.pk}', 'index'
+    ))
     return render(request, 'posts/follow.html', context)
 
 
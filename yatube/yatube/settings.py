@@ -31,19 +31,24 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'posts',
-    'core',
+    'posts.apps.PostsConfig',
+    'core.apps.CoreConfig',
     'about',
     'sorl.thumbnail',
 ]
 
 MIDDLEWARE = [
+    'core.middleware.MetricsMiddleware',
+    'core.middleware.ServerTimingMiddleware',
+    'core.middleware.ProfilingMiddleware',
+    'core.middleware.ReplicaPinningMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
+    'posts.middleware.AnonymousPageCacheMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
 ]
 
@@ -56,7 +61,7 @@ STATICFILES_DIRS = [os.path.join(BASE_DIR, 'static')]
 
 TEMPLATES = [
     {
-        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'BACKEND': 'core.template_backend.DjangoTemplates',
         'DIRS': [TEMPLATES_DIR],
         'APP_DIRS': True,
         'OPTIONS': {
@@ -81,7 +86,38 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
-    }
+    },
+    # Копия основной базы, которую обновляет
+    # python manage.py sync_replica --lag <секунды>.
+    'replica': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(BASE_DIR, 'replica.sqlite3'),
+        'TEST': {'MIRROR': 'default'},
+    },
+}
+
+DATABASE_ROUTERS = ['core.routers.PrimaryReplicaRouter']
+
+# Базы, с которых читают запросы (пусто — всё читается из default).
+# Для проверки с отставанием: DATABASE_REPLICAS = ['replica'].
+DATABASE_REPLICAS = []
+
+# Сколько секунд после записи пользователь читает основную базу.
+REPLICA_PIN_SECONDS = 10
+
+REPLICA_PIN_COOKIE = 'pin_primary'
+
+# Профиль SQLite для каждого нового соединения (core.sqlite).
+# WAL не даёт читателям блокировать писателей, а NORMAL синхронизирует
+# журнал на контрольных точках, а не на каждом коммите. cache_size
+# в отрицательных значениях задаётся в КиБ.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'busy_timeout': 5000,
+    'cache_size': -64 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'MEMORY',
 }
 
 
@@ -125,10 +161,60 @@ MEDIA_URL = '/media/'
 
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Файлы MEDIA_URL отдаёт core.media.serve. Имена, подходящие под
+# MEDIA_IMMUTABLE, никогда не меняют содержимое (миниатюры sorl и
+# картинки, названные по хэшу), и браузеры кэшируют их на год.
+MEDIA_IMMUTABLE = (
+    r'^cache/',
+    r'^posts/[0-9a-f]{2}/[0-9a-f]{64}\.',
+)
+MEDIA_MAX_AGE = 60 * 60
+MEDIA_IMMUTABLE_MAX_AGE = 60 * 60 * 24 * 365
+
+# Передача файла фронтовому прокси вместо чтения его в Python:
+# 'x-accel-redirect' (nginx, internal-location MEDIA_OFFLOAD_PREFIX
+# с alias на MEDIA_ROOT) или 'x-sendfile' (Apache, lighttpd).
+MEDIA_OFFLOAD = None
+MEDIA_OFFLOAD_PREFIX = '/protected-media/'
+
+# Загрузки пишутся во временный файл по кускам и обрываются на лимите
+# байт (posts.uploads). Картинки больше лимита пикселей не декодируются.
+FILE_UPLOAD_HANDLERS = ['posts.uploads.LimitedUploadHandler']
+
+IMAGE_UPLOAD_MAX_BYTES = 10 * 1024 * 1024
+
+IMAGE_MAX_PIXELS = 40_000_000
+
+# Процессы, которые поворачивают и перекодируют загруженные картинки.
+IMAGE_PROCESS_WORKERS = 2
+
 STATIC_URL = '/static/'
 
 POSTS_PER_PAGE = 10
 
+# Комментарии на странице поста отдаются порциями по курсору.
+COMMENTS_PER_PAGE = 20
+
+# Сколько секунд хранится число записей ленты.
+FEED_COUNT_TIMEOUT = 60 * 60
+
+# С какого размера таблицы лента берёт оценку вместо COUNT(*).
+FEED_COUNT_ESTIMATE_THRESHOLD = 100_000
+
+# Фрагменты лент сбрасываются версиями при записи, поэтому хранятся долго.
+FEED_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Фоновые задачи: пул потоков; в тестах удобно выполнять их сразу.
+BACKGROUND_WORKERS = 4
+
+BACKGROUND_TASKS_EAGER = False
+
+# Посты авторов с большим числом подписчиков не раскладываются по лентам,
+# а подмешиваются в ленту подписок при чтении.
+TIMELINE_FANOUT_LIMIT = 10_000
+
+TIMELINE_BATCH_SIZE = 500
+
 LOGIN_URL = 'users:login'
 
 LOGIN_REDIRECT_URL = 'posts:index'
@@ -141,8 +227,113 @@ EMAIL_FILE_PATH = os.path.join(BASE_DIR, 'sent_emails')
 
 CSRF_FAILURE_VIEW = 'core.views.csrf_failure'
 
+# Каталог файлов кэша и метрик, общих для всех процессов хоста.
+# Тесты (core.test_runner) подменяют их временным каталогом.
+RUNTIME_DIR = os.environ.get('YATUBE_RUNTIME_DIR', BASE_DIR)
+
+TEST_RUNNER = 'core.test_runner.TestRunner'
+
+# Один файл кэша на хост: его видят все процессы WSGI-сервера, поэтому
+# сброс версий лент в одном процессе сразу виден остальным.
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'core.cache.SQLiteCache',
+        'LOCATION': os.path.join(RUNTIME_DIR, 'cache.sqlite3'),
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100_000,
+            'MAX_SIZE': 256 * 1024 * 1024,
+        },
     }
 }
+
+# Доля запросов с заголовком Server-Timing и как часто писать в лог
+# сводку замеров по view (в секундах).
+SERVER_TIMING_SAMPLE_RATE = 0.05
+
+SERVER_TIMING_SUMMARY_INTERVAL = 60
+
+# Метрики Prometheus: общий файл для всех процессов хоста, как у кэша.
+# Процесс переносит туда накопленное не чаще раза в интервал (секунды).
+METRICS_STORE = os.path.join(RUNTIME_DIR, 'metrics.sqlite3')
+
+METRICS_FLUSH_INTERVAL = 1
+
+# Токен для /metrics: Prometheus передаёт его в заголовке
+# Authorization: Bearer <токен>. Адрес клиента за прокси ничего
+# не говорит, поэтому без токена /metrics закрыта для всех.
+METRICS_TOKEN = os.environ.get('YATUBE_METRICS_TOKEN', '')
+
+# Профилирование живого трафика: каждый N-й запрос к каждому view
+# (0 — выключено), интервал снятия стеков в секундах и каталог
+# профилей для команды merge_profiles.
+PROFILE_SAMPLE_EVERY = 0
+
+PROFILE_INTERVAL = 0.002
+
+PROFILE_SPOOL_DIR = os.path.join(BASE_DIR, 'profiles')
+
+# Целые страницы для анонимных читателей: устаревают по версиям
+# своих областей кэша, срок — только страховка.
+PAGE_CACHE_ENABLED = True
+
+PAGE_CACHE_TIMEOUT = 60 * 60
+
+# Множества подписок пользователей (posts.follow_graph) обновляются
+# при подписке и отписке, срок — только страховка.
+FOLLOW_GRAPH_TIMEOUT = 24 * 60 * 60
+
+PAGE_CACHE_VIEWS = (
+    'posts:index',
+    'posts:group_lists',
+    'posts:profile',
+    'posts:post_detail',
+)
+
+# Сессии читаются из общего кэша, а база остаётся источником истины.
+SESSION_ENGINE = 'django.contrib.sessions.backends.cached_db'
+
+# Хранилище sorl-thumbnail тоже читает через общий кэш.
+THUMBNAIL_KVSTORE = 'sorl.thumbnail.kvstores.cached_db_kvstore.KVStore'
+THUMBNAIL_CACHE = 'default'
+
+# Размеры миниатюр картинок постов: создаются в фоне сразу после загрузки,
+# а шаблоны до этого показывают заглушку.
+# Карточка есть в нескольких ширинах для srcset, в JPEG и в WebP;
+# 'card' — JPEG наибольшей ширины для браузеров без <picture>.
+POST_THUMBNAILS = {
+    'card': ('960x339', {'crop': 'center', 'upscale': True}),
+    'card_720': ('720x254', {'crop': 'center', 'upscale': True}),
+    'card_480': ('480x170', {'crop': 'center', 'upscale': True}),
+    'card_webp': ('960x339', {
+        'crop': 'center', 'upscale': True, 'format': 'WEBP', 'quality': 80
+    }),
+    'card_720_webp': ('720x254', {
+        'crop': 'center', 'upscale': True, 'format': 'WEBP', 'quality': 80
+    }),
+    'card_480_webp': ('480x170', {
+        'crop': 'center', 'upscale': True, 'format': 'WEBP', 'quality': 80
+    }),
+}
+
+# Картинки <picture> из миниатюр POST_THUMBNAILS: img — миниатюра для
+# src, sources — варианты srcset по MIME-типам в порядке предпочтения,
+# sizes — ширина слота карточки на странице.
+POST_PICTURES = {
+    'card': {
+        'img': 'card',
+        'sizes': '(max-width: 960px) 100vw, 960px',
+        'sources': {
+            'image/webp': ('card_480_webp', 'card_720_webp', 'card_webp'),
+            'image/jpeg': ('card_480', 'card_720', 'card'),
+        },
+    },
+}
+
+# Сколько секунд файл картинки без ссылок не удаляется после записи:
+# запрос, загрузивший его, мог ещё не сохранить пост.
+MEDIA_BLOB_GRACE = 60 * 60
+
+# Сколько не ставить повторно в очередь картинку, миниатюры которой
+# уже создаются (или не создались из-за ошибки).
+THUMBNAIL_QUEUE_TIMEOUT = 60 * 10